@@ -13,6 +13,7 @@ import backup_model
 # The MIDI messages received from the MC6Pro sometimes have garbage data in the unused bytes
 # This is a first pass at cleaning them up
 # This gets rid of messages that are type None, but the garbage data prevents the entire message from being None
+@jg.keeps_none
 def midi_message_cleanup(message, _ctxt, _lp):
     if message is not None:
         if message.type is None:
@@ -402,6 +403,6 @@ backup_schema = \
              "data",
              jg.Dict('data',
                      [jg.Dict.make_key('bankArray',
-                                       jg.List('Bank List', 128, bank_array_schema, var='banks')),
+                                       jg.List('Bank List', 128, bank_array_schema, parallel=True, var='banks')),
                       jg.Dict.make_key('controller_settings', controller_settings_schema, required=False)]))],
         model=backup_model.Backup)
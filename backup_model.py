@@ -21,6 +21,8 @@ def msg_array_data_byte(msg_array_data, byte, mask=None):
 
 # Model object for MIDI messages
 class MidiMessage(jg.GrammarModel):
+    model_fields = ('msg_array_data', 'channel', 'type', 'trigger', 'toggle_state')
+
     def __init__(self):
         super().__init__('MidiMessage')
         self.msg_array_data = None
@@ -84,6 +86,10 @@ class MidiMessage(jg.GrammarModel):
 
 # Model for a Preset
 class Preset(jg.GrammarModel):
+    model_fields = ('short_name', 'toggle_name', 'long_name', 'name_color', 'name_toggle_color', 'shifted_name_color',
+                    'background_color', 'background_toggle_color', 'strip_color', 'strip_toggle_color', 'to_toggle',
+                    'toggle_group', 'to_msg_scroll', 'messages')
+
     def __init__(self):
         super().__init__('Preset')
         self.short_name = None
@@ -130,6 +136,9 @@ class Preset(jg.GrammarModel):
 
 # Model for a Bank
 class Bank(jg.GrammarModel):
+    model_fields = ('name', 'description', 'short_name', 'text_color', 'background_color', 'to_display', 'clear_toggle',
+                    'messages', 'presets', 'exp_presets')
+
     def __init__(self):
         super().__init__('Bank')
         self.name = None
@@ -178,6 +187,8 @@ class Bank(jg.GrammarModel):
 
 # Model for a MIDI Channel Name mapping
 class MidiChannel(jg.GrammarModel):
+    model_fields = ('name',)
+
     def __init__(self):
         super().__init__('MidiChannel')
         self.name = None
@@ -192,6 +203,8 @@ class MidiChannel(jg.GrammarModel):
 
 # Model for a Bank Arrangement Item
 class BankArrangementItem(jg.GrammarModel):
+    model_fields = ('name',)
+
     def __init__(self):
         super().__init__('BankArrangementItem')
         self.name = None
@@ -206,6 +219,8 @@ class BankArrangementItem(jg.GrammarModel):
 
 # Model for the entire backup/config file
 class Backup(jg.GrammarModel):
+    model_fields = ('hash', 'download_date', 'banks', 'midi_channels', 'bank_arrangement', 'midi_channel')
+
     def __init__(self):
         super().__init__('Backup')
         self.hash = None
@@ -18,6 +18,7 @@ colors = ["black", "lime", "blue", "purple", "yellow", "orchid", "gray", "white"
           "color104", "color105", "color106", "color107", "color108", "color109", "color110", "color111",
           "color112", "color113", "color114", "color115", "color116", "color117", "color118", "color119",
           "color120", "color121", "color122", "color123", "color124", "color125", "color126", "default"]
+color_codec = jg.enum_codec(colors)
 default_color = colors[7]
 empty_color = colors[0]
 
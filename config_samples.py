@@ -0,0 +1,89 @@
+import functools
+
+import grammar as jg
+import backup_grammar
+import simple_grammar
+import simple_message as sm
+import simple_model
+
+# The sample functions for Grammar.sample of backup and simple configs, keyed by the schema nodes
+# The schemas can't express the values that make a sample convert: the MIDI channels, or the message types and
+# triggers, which differ for the bank and the preset messages that share a message node.
+
+
+# Get the node below schema through the keys key_names
+def key_schema(schema, *key_names):
+    for key_name in key_names:
+        schema = schema.key_table.index[key_name]['schema']
+    return schema
+
+
+def sample_choice(choices, sampler, _schema, _ctxt, _lp):
+    return sampler.random.choice(choices)
+
+
+def sample_channel(sampler, _schema, _ctxt, _lp):
+    if not sampler.filled():
+        return 1
+    return sampler.random.randint(1, 16)
+
+
+# The bank arrangement follows the bank names, which aren't known where Grammar.sample fills it, so it is left out
+def sample_empty(_sampler, _schema, _ctxt, _lp):
+    return ''
+
+
+# Samples up to length entries of the list, with functions for the nodes below it (see GrammarSampler.sample_using)
+def sample_list(length, functions, sampler, schema, _ctxt, lp):
+    return sampler.sample_using(functions, schema.sample_entries, sampler, length, lp)
+
+
+# The messages are filled with the types whose data are MIDI bytes, the other types pack enums, flags, names and bank
+# positions into their data, which random values don't convert
+sample_message_type_names = ['PC', 'CC', 'Note On', 'Note Off', 'Song Position', 'Delay', 'Bank Up', 'Bank Down',
+                             'Bank Change Mode', 'MIDI Clock Tap', 'Toggle Preset']
+
+
+# The types of message_type (the bank or preset message types) that are sampled, as their positions in the enum
+def sample_message_types(message_type):
+    return [pos for pos, type_name in enumerate(message_type) if type_name in sample_message_type_names]
+
+
+# Backup configs
+backup_message_schema = backup_grammar.msg_array_schema
+
+
+def backup_message_functions(message_type, trigger):
+    return {key_schema(backup_message_schema, 't'): functools.partial(sample_choice,
+                                                                       sample_message_types(message_type)),
+            key_schema(backup_message_schema, 'a'): functools.partial(sample_choice, list(range(1, len(trigger))))}
+
+
+backup_preset_messages = \
+    functools.partial(sample_list, 32, backup_message_functions(sm.simple_message_type,
+                                                                simple_model.preset_message_trigger))
+backup_sample_functions = {
+    key_schema(backup_message_schema, 'c'): sample_channel,
+    key_schema(backup_message_schema, 'tg'): functools.partial(sample_choice, [0, 1, 2, 3]),
+    key_schema(backup_grammar.bank_array_schema, 'bankMsgArray'):
+        functools.partial(sample_list, 32, backup_message_functions(sm.bank_message_type,
+                                                                    simple_model.bank_message_trigger)),
+    key_schema(backup_grammar.preset_array_schema, 'msgArray'): backup_preset_messages,
+    key_schema(backup_grammar.exp_preset_array_schema, 'msgArray'): backup_preset_messages,
+    key_schema(backup_grammar.bank_arrangement_item_schema, 'data', 'bankName'): sample_empty}
+
+
+# Simple configs
+# The lists are unlimited, but they convert to backup lists, so they are filled up to the backup lengths
+def simple_message_functions(message_type):
+    sample_types = [type_name for type_name in sample_message_type_names if type_name in message_type]
+    return {sm.message_switch_key['schema']: functools.partial(sample_choice, sample_types)}
+
+
+simple_sample_functions = {
+    key_schema(simple_grammar.bank_schema, 'messages'):
+        functools.partial(sample_list, 32, simple_message_functions(sm.bank_message_type)),
+    key_schema(simple_grammar.preset_schema, 'messages'):
+        functools.partial(sample_list, 32, simple_message_functions(sm.simple_message_type)),
+    key_schema(simple_grammar.bank_schema, 'presets'): functools.partial(jg.sample_length, 24),
+    key_schema(simple_grammar.bank_schema, 'exp_presets'): functools.partial(jg.sample_length, 4)}
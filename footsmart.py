@@ -11,6 +11,7 @@
 # are not required
 
 import argparse
+import json
 import grammar as jg
 import backup_grammar
 import intuitive_grammar
@@ -23,6 +24,8 @@ from IntuitiveException import IntuitiveException
 # Convert an intuitive file to a simple file --intuitive-to-simple -I
 # Convert a simple file to a backup file     --simple-to-backup    -s
 # Convert a backup file to a simple file     --backup-to-simple    -b
+# Check a file without converting it         --check               -c
+#   (a backup file with -b, a simple file with -s, otherwise an intuitive file)
 if __name__ == '__main__':
     desc = "Morningstar Configuration Management. Convert various file formats"
     parser = argparse.ArgumentParser(description=desc)
@@ -34,8 +37,15 @@ if __name__ == '__main__':
                         help='Convert a config file to an backup file')
     parser.add_argument('--intuitive-to-simple', '-I', action='store_true',
                         help='Convert a config file to an backup file')
+    parser.add_argument('--check', '-c', action='store_true',
+                        help='Only check the source config: a backup config with -b, a simple config with -s, '
+                             'otherwise an intuitive config')
+    parser.add_argument('--profile', metavar='PROFILE',
+                        help='Profile the grammars, print the reports and write the profiles to PROFILE (JSON)')
+    parser.add_argument('--workers', '-w', type=int, metavar='WORKERS',
+                        help='Parse and gen the banks of backup configs in WORKERS processes')
     parser.add_argument('source', help='The source config')
-    parser.add_argument('dest', help='The destination config')
+    parser.add_argument('dest', nargs='?', help='The destination config (not used with --check)')
     args = parser.parse_args()
 
     flags = 0
@@ -50,36 +60,82 @@ if __name__ == '__main__':
     if flags > 1:
         print("Error: At most one of -b, -i, or -c must be specified")
         exit(1)
+    if args.dest is None and not args.check:
+        print("Error: The destination config must be specified")
+        exit(1)
+
+    profile = args.profile is not None
+    # The grammars are built when first used, so a conversion only pays for the grammars it needs
+    grammar_builders = {
+        'backup': lambda: jg.Grammar(backup_grammar.backup_schema, profile=profile, workers=args.workers).compile(),
+        'simple': lambda: jg.Grammar(simple_grammar.simple_schema, minimal=True, profile=profile).compile(),
+        'intuitive': lambda: jg.Grammar(intuitive_grammar.intuitive_schema, minimal=True, profile=profile).compile()}
+    grammars = {}
 
-    backup_grammar_obj = jg.Grammar(backup_grammar.backup_schema)
-    simple_grammar_obj = jg.Grammar(simple_grammar.simple_schema, minimal=True)
-    intuitive_grammar_obj = jg.Grammar(intuitive_grammar.intuitive_schema, minimal=True)
+    def get_grammar(grammar_name):
+        if grammar_name not in grammars:
+            grammars[grammar_name] = grammar_builders[grammar_name]()
+        return grammars[grammar_name]
 
     source_file = jg.GrammarFile(args.source)
-    dest_file = jg.GrammarFile(args.dest)
+    dest_file = None
+    if args.dest is not None:
+        dest_file = jg.GrammarFile(args.dest)
 
     try:
-        if args.backup_to_simple:
-            backup_model = backup_grammar_obj.parse_config(source_file.load())
+        if args.check:
+            # Validating checks the config against its grammar without building the models
+            # An invalid config is parsed again to list all of its errors, see Grammar.parse_collect
+            if args.backup_to_simple:
+                check_grammar = get_grammar('backup')
+            elif args.simple_to_backup:
+                check_grammar = get_grammar('simple')
+            else:
+                check_grammar = get_grammar('intuitive')
+            source = source_file.load()
+            try:
+                check_grammar.validate(source)
+            except jg.GrammarException:
+                errors = check_grammar.parse_collect(source)[1]
+                if not errors:
+                    raise
+                print("ERROR\n")
+                for error_path, error in errors:
+                    print(error_path + ": " + error.args[1])
+                exit(1)
+            print(args.source + " is valid")
+        elif args.backup_to_simple:
+            backup_model = source_file.load_parse(get_grammar('backup'))
 
             simple_model_obj = simple_model.Simple()
             simple_model_obj.from_backup(backup_model)
 
-            dest_file.save(simple_grammar_obj.gen_config(simple_model_obj))
+            dest_file.save_gen(get_grammar('simple'), simple_model_obj)
         elif args.simple_to_backup:
-            simple_model_obj = simple_grammar_obj.parse_config(source_file.load())
+            simple_model_obj = get_grammar('simple').parse_config(source_file.load())
 
             backup_model = simple_model_obj.to_backup()
 
-            dest_file.save(backup_grammar_obj.gen_config(backup_model))
+            dest_file.save_gen(get_grammar('backup'), backup_model)
         else:  # args.intuitive_to_backup or args.intuitive_to_simple:
-            intuitive_model_obj = intuitive_grammar_obj.parse_config(source_file.load())
+            intuitive_model_obj = get_grammar('intuitive').parse_config(source_file.load())
             simple_model = intuitive_model_obj.to_simple()
             if args.intuitive_to_simple:
-                dest_file.save(simple_grammar_obj.gen_config(simple_model))
+                dest_file.save_gen(get_grammar('simple'), simple_model)
             else:
                 backup_model = simple_model.to_backup()
-                dest_file.save(backup_grammar_obj.gen_config(backup_model))
+                dest_file.save_gen(get_grammar('backup'), backup_model)
+
+        if profile:
+            for grammar_name in ['intuitive', 'simple', 'backup']:
+                if grammar_name not in grammars:
+                    continue
+                report = grammars[grammar_name].profile.report()
+                if report != '':
+                    print('Grammar ' + grammar_name + "\n" + report)
+            profiles = {grammar_name: grammar_obj.profile.summary() for grammar_name, grammar_obj in grammars.items()}
+            with open(args.profile, "w") as write_file:
+                json.dump(profiles, write_file, indent=4)
     except jg.GrammarException as e:
         print("ERROR\n")
         print(e.args[1])
@@ -88,3 +144,6 @@ if __name__ == '__main__':
         print("ERROR\n")
         print(e.args[1])
         exit(1)
+    finally:
+        for grammar_obj in grammars.values():
+            grammar_obj.close_workers()
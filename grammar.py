@@ -1,8 +1,12 @@
-import copy
+import concurrent.futures
+import functools
 import inspect
 import json
+import operator
 import yaml
+import random
 import re
+import time
 
 
 # JSON/YAML Grammar
@@ -23,6 +27,7 @@ import re
 # It is like an abstract syntax tree, but more focused on meaning than syntax
 # Generating takes a model and creates the JSON/YAML string equivalent.
 # Printing prints out the grammar in human-readable form (more or less)
+# A grammar can also be compiled, which speeds up parsing and generating (see Grammar.compile)
 #
 # Grammar elements are Dictionaries, Switch Dictionaries, Lists, Enums and Atoms
 # Dictionaries and switch dictionaries have keys that map to elements
@@ -54,38 +59,96 @@ import re
 # The "context" is the immediately enclosing dictionary or list element
 # The list position is a list of integers, representing which position in the list this element occurred in, with the
 # innermost being the last in the list
+# The list position is shared, not copied: a List pushes a position, updates it in place for each entry and pops it
+# when done. Functions can index it (lp[-1] is the innermost position), but must copy it to keep it after returning
 #
 # Models are python classes, with variables mapping to values.
 # All models must inherit from GrammarModel
+# Models can declare their variables (see GrammarModelType), which makes them smaller and faster
 
 class GrammarException(Exception):
     """used for exceptions raised during parsing"""
     pass
 
 
-class GrammarModel:
+# The debugging trail (the name passed to parse) is built lazily: each node and key adds a (parent, ':' + name)
+# pair rather than a new string, and the trail is only turned into a string when an error is reported.
+# A plain string is also a trail, so parse can be called directly with a name like "foo"
+def trail_name(name):
+    parts = []
+    while isinstance(name, tuple):
+        name, part = name
+        parts.append(part)
+    parts.append(name)
+    parts.reverse()
+    return ''.join(parts)
+
+
+# A model class can declare its variables as a tuple of names, model_fields, which become its __slots__
+# A model whose classes all declare their fields has no __dict__, the variables are stored in the slots
+# The variables must still be set (normally to None) in __init__
+# declared_fields is the set of the fields declared by the class and its bases, slot_fields all their slots
+class GrammarModelType(type):
+    def __new__(mcs, name, bases, namespace):
+        if 'model_fields' in namespace:
+            namespace['__slots__'] = tuple(namespace['model_fields'])
+        cls = super().__new__(mcs, name, bases, namespace)
+        declared_fields = set()
+        slot_fields = []
+        for base in cls.__mro__:
+            declared_fields.update(vars(base).get('model_fields', ()))
+            slot_fields.extend(field for field in vars(base).get('__slots__', ()) if field not in slot_fields)
+        cls.declared_fields = frozenset(declared_fields)
+        cls.slot_fields = tuple(slot_fields)
+        return cls
+
+
+class GrammarModel(metaclass=GrammarModelType):
     """Base class for models, includes the modified boolean"""
+    __slots__ = ('modified', 'model_name')
+
     def __init__(self, name):
         self.modified = False
         self.model_name = name
 
+    # The variables are the declared fields and, for models that don't declare them all, the instance variables
+    def has_var(self, variable):
+        return variable in self.declared_fields or variable in getattr(self, '__dict__', ())
+
     def get_var(self, variable):
-        model_vars = vars(self)
-        if variable not in model_vars:
-            raise GrammarException('model_missing_var', 'In ' + name + ' the model ' + self.model_name +
+        if not self.has_var(variable):
+            raise GrammarException('model_missing_var', 'The model ' + self.model_name +
                                    ' is missing the variable ' + variable)
-        return model_vars[variable]
+        return getattr(self, variable)
 
     def set_var(self, variable, result, name):
         self.modified = True
-        model_vars = vars(self)
-        if variable not in model_vars:
-            raise GrammarException('model_missing_var', 'In ' + name + ' the model ' + self.model_name +
+        if not self.has_var(variable):
+            raise GrammarException('model_missing_var', 'In ' + trail_name(name) + ' the model ' + self.model_name +
                                    ' is missing the variable ' + variable)
-        if model_vars[variable] is not None:
-            raise GrammarException('multiply_assigned_var', 'In ' + name + ' with model ' + self.model_name +
+        if getattr(self, variable) is not None:
+            raise GrammarException('multiply_assigned_var', 'In ' + trail_name(name) + ' with model ' +
+                                   self.model_name +
                                    ' the variable ' + variable + ' is assigned multiple times')
-        model_vars[variable] = result
+        setattr(self, variable, result)
+
+
+# Copies a parse result the way a new parse of its element makes it: the models, lists and dicts are new, the atom
+# values are shared (see Grammar.parse_memo)
+def copy_result(result):
+    result_type = type(result)
+    if result_type is list:
+        return [copy_result(entry) for entry in result]
+    if result_type is dict:
+        return {key: copy_result(value) for key, value in result.items()}
+    if isinstance(result, GrammarModel):
+        copied = result_type.__new__(result_type)
+        for field in result_type.slot_fields:
+            setattr(copied, field, copy_result(getattr(result, field)))
+        if hasattr(result, '__dict__'):
+            copied.__dict__.update((variable, copy_result(value)) for variable, value in result.__dict__.items())
+        return copied
+    return result
 
 
 # The base class for all grammar modes
@@ -103,9 +166,124 @@ class GrammarNode:
     def gen(self, grammar, model, context, list_pos):
         raise GrammarException("virtual-method", "Attempted virtual method call: GrammarNode.gen")
 
+    # Validating, see Grammar.validate
+    # The nodes without nodes below them don't make or bind models, and their parse result is just dropped
+    def validate(self, grammar, elem, name, context, list_pos):
+        self.parse(grammar, elem, name, context, list_pos, None)
+
+    # Parsing a path, see Grammar.parse_path
+    # Returns the node and element for the step, with their context, trail and the model class they bind into
+    def path_step(self, grammar, step, elem, name, list_pos, model_class):
+        raise self.bad_path_error(name, step, 'there are no elements below ' + self.name)
+
+    # Sampling, see Grammar.sample
+    # Returns a random element for the node, with context and list_pos as for parse
+    def sample(self, sampler, context, list_pos):
+        raise GrammarException("virtual-method", "Attempted virtual method call: GrammarNode.sample")
+
+    @staticmethod
+    def bad_path_error(name, step, reason):
+        return GrammarException('bad_path', 'In ' + trail_name(name) + ' the path step ' + step + ' is not valid, ' +
+                                reason)
+
     def print(self, indent):
         raise GrammarException("virtual-method", "Attempted virtual method call: GrammarNode.print")
 
+    # Compiling, see Grammar.compile
+    # The containers compile their loops over the nodes below them, the atoms their specialized parse and gen (see
+    # ConstantAtom). The other nodes compile to their own parse and gen
+    def compile_parse(self, grammar):
+        return functools.partial(self.parse, grammar)
+
+    def compile_gen(self, grammar):
+        return functools.partial(self.gen, grammar)
+
+    # Default templates, see Grammar.default_template
+    # Returns the expression for the complete gen of the node without a model, or None if there isn't one
+    # depth is the number of template lists around the node
+    def template_source(self, source, depth):
+        return None
+
+    # The nodes directly below this one
+    def sub_schemas(self):
+        return []
+
+    # If parsing the node can depend on the list position or context (other than through the nodes below)
+    position_pure = True
+
+    # Only containers get their own template, the atoms are cheap to gen
+    has_template = False
+    # and their own default fingerprint, see Grammar.default_fingerprint
+    has_fingerprint = False
+
+    # The containers parse and gen with generators on the explicit stack, see Grammar.stack_parse
+    # (parse_steps/gen_steps). The other nodes don't parse or gen nodes below them, and are called as usual
+    has_steps = False
+
+
+# Key tables are built when a Dict or SwitchDict is constructed, so parsing doesn't search or rebuild the key lists
+# index maps each key name to its key, names are the key names in schema order
+# plans holds, for complete (plans[False]) and minimal (plans[True]) grammars, the key name, the trail part, the
+# schema and if the key is required; gen_plan holds the key name and schema
+class KeyTable:
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {}
+        self.names = []
+        for key in keys:
+            self.index.setdefault(key['name'], key)
+            self.names.append(key['name'])
+        self.name_set = frozenset(self.names)
+        self.count = len(keys)
+        self.duplicates = len(self.name_set) != self.count
+        self.plans = {}
+        for minimal in [False, True]:
+            plan = []
+            for key in keys:
+                # If 'required' is explicit, that takes precedence
+                # Otherwise it is set to True for complete, false for minimal grammars
+                required = key['required']
+                if required is None:
+                    required = not minimal
+                plan.append((key['name'], ':' + key['name'], key['schema'], required))
+            self.plans[minimal] = plan
+        self.gen_plan = [(key['name'], key['schema']) for key in keys]
+
+
+# The plan for the keys of a Dict, or of one case of a SwitchDict, built when the node is constructed
+# Without a model variable, all keys are parsed and genned with the enclosing model (parse_table, gen_table)
+# With a model variable, the common keys use the enclosing model, and the case keys the case model (model_parse_table,
+# model_gen_table), which is bound to the model variable (model_var)
+# The switch key of a SwitchDict is a known key, and is counted as found (switch_keys)
+# Every engine parses and gens the keys from the plan, see DictBase
+class DictCase:
+    def __init__(self, parse_table, gen_table, model_parse_table=None, model_gen_table=None, model=None,
+                 model_var=None, switch_key_name=None):
+        self.parse_table = parse_table
+        self.gen_table = gen_table
+        self.model_parse_table = model_parse_table
+        self.model_gen_table = model_gen_table
+        self.model = model
+        self.model_var = model_var
+        self.valid_keys = parse_table.names
+        if model_parse_table is not None:
+            self.valid_keys = self.valid_keys + model_parse_table.names
+        key_names = self.valid_keys
+        self.switch_keys = 0
+        if switch_key_name is not None:
+            key_names = key_names + [switch_key_name]
+            self.switch_keys = 1
+        self.known_keys = frozenset(key_names)
+        self.duplicates = len(self.known_keys) != len(key_names)
+
+    # Make sure all keys in the elem were processed
+    def parsed(self, elem, name, found_keys, result):
+        if found_keys < len(elem):
+            raise DictBase.undefined_keys_error(name, elem, self.known_keys, self.valid_keys)
+        if result == {}:
+            return None
+        return result
+
 
 # Base class for Dict and SwitchDict nodes
 class DictBase(GrammarNode):
@@ -116,135 +294,133 @@ class DictBase(GrammarNode):
     def make_key(key_name, key_schema, required=None):
         return {'name': key_name, 'schema': key_schema, 'required': required}
 
-    @staticmethod
-    def lookup_key(key_name, key_list):
-        for potential_match in key_list:
-            if key_name == potential_match['name']:
-                return potential_match['name']
-        return False
-
     @staticmethod
     def check_elem(elem):
         if not isinstance(elem, dict):
             raise GrammarException('type_not_dict', "parse called on non-dict")
 
+    # Errors shared by the engines, so they all report the same thing
     @staticmethod
-    def parse_key(grammar, elem, name, list_pos, model, key, found_keys_name, result, seen_keys):
-        found_keys = 0
-        if key['name'] not in elem:
-            # If 'required' is explicit, that takes precedence
-            # Otherwise it is set to True for complete, false for minimal grammars
-            if key['required'] is None:
-                required = not grammar.minimal
-            else:
-                required = key['required']
-            if not required:
-                key_result = None
-            else:
-                raise GrammarException(
-                    'dict_bad_keys',
-                    "Parse position: " + name + ", error: parse dictionary/switch dictionary expected key: \"" +
-                    key['name'] + "\" but didn't find it in " + str(elem.keys()))
-        else:
-            found_keys = 1
-            found_keys_name.append(key['name'])
-            # Note we update the context with the elem for sub-parsing
-            key_result = grammar.parse(elem[key['name']], key['schema'], name + ':' + key['name'], elem, list_pos,
-                                       model)
-        if key['name'] in seen_keys:
-            raise GrammarException('dict_duplicate_keys', 'grammar has duplicate keys')
-        seen_keys[key['name']] = True
-        # Only store if significant
-        if key_result is not None:
-            if result is None:
-                msg = ('Paring SwitchDict ' + name + ' the key ' + key['name'] +
-                       'returned a result instead of being stored in the switch model')
-                raise GrammarException('switch_model_result', msg)
-            result[key['name']] = key_result
-
-        return found_keys
-
-    def parse_keys(self, grammar, elem, name, list_pos, model, non_model_keys, model_keys, switch_model, result,
-                   seen_keys):
-        self.check_elem(elem)
+    def missing_key_error(name, key_name, elem):
+        return GrammarException(
+            'dict_bad_keys',
+            "Parse position: " + trail_name(name) + ", error: parse dictionary/switch dictionary expected key: \"" +
+            key_name + "\" but didn't find it in " + str(elem.keys()))
 
-        # The list of keys seen ensures we don't allow keys to appear twice
-        # Found keys is the number of keys found in the elem while processing the schema
-        # If this is not the total number of keys in the elem, some keys didn't match
-        found_keys = len(seen_keys)
-        found_keys_name = []
-        for key in seen_keys:
-            found_keys_name.append(key)
+    @staticmethod
+    def switch_model_result_error(name, key_name):
+        msg = ('Paring SwitchDict ' + trail_name(name) + ' the key ' + key_name +
+               'returned a result instead of being stored in the switch model')
+        return GrammarException('switch_model_result', msg)
 
-        # process each schema key
-        for key in non_model_keys:
-            found_keys += self.parse_key(grammar, elem, name, list_pos, model, key, found_keys_name, result, seen_keys)
+    @staticmethod
+    def undefined_keys_error(name, elem, found_keys_name, valid_keys):
+        missing_keys = []
+        for key in elem:
+            if key not in found_keys_name:
+                missing_keys.append(key)
+        message = 'While parsing ' + trail_name(name) + ' the following keys are undefined: '
+        message += ", ".join(missing_keys)
+        message += "\nThe valid keys are: " + ", ".join(valid_keys)
+        return GrammarException('dict_bad_keys', message)
 
-        for key in model_keys:
-            found_keys += self.parse_key(grammar, elem, name, list_pos, switch_model, key, found_keys_name, None,
-                                         seen_keys)
+    @staticmethod
+    def duplicate_keys_error():
+        return GrammarException('dict_duplicate_keys', 'grammar has duplicate keys')
 
-        # Make sure all keys in the elem were processed
-        if found_keys < len(elem):
-            missing_keys = []
-            for key in elem:
-                if key not in found_keys_name:
-                    missing_keys.append(key)
-            message = 'While parsing ' + name + ' the following keys are undefined: '
-            message += ", ".join(missing_keys)
-            valid_keys = []
-            for key in non_model_keys:
-                valid_keys.append(key['name'])
-            for key in model_keys:
-                valid_keys.append(key['name'])
-            message += "\nThe valid keys are: " + ", ".join(valid_keys)
-            raise GrammarException('dict_bad_keys', message)
-        if result == {}:
-            return None
-        return result
+    # The path step for a key, see Grammar.parse_path
+    @staticmethod
+    def path_key(key, elem, name, model_class):
+        if key['name'] not in elem:
+            raise DictBase.missing_key_error(name, key['name'], elem)
+        return key['schema'], elem[key['name']], elem, (name, ':' + key['name']), model_class
 
+    # Parsing and genning the keys of a case (see DictCase)
+    # Each engine has its own loop over the keys, as it calls the nodes below its own way; the checks, errors and
+    # results are shared
+    #
+    # The interpreter calls key_parse for each key, grammar.parse, or grammar.validate_elem when validating (without
+    # a result or models). The keys of the case model are parsed into the case model, switched_model.
+    # A schema with duplicate keys is reported before its keys are parsed
+    @staticmethod
+    def parse_case_keys(key_parse, minimal, elem, name, list_pos, model, case, result, switched_model):
+        if case.duplicates:
+            raise DictBase.duplicate_keys_error()
+        found_keys = case.switch_keys
+        found_keys += DictBase.parse_key_table(key_parse, elem, name, list_pos, model, case.parse_table.plans[minimal],
+                                               result)
+        if case.model_parse_table is not None:
+            found_keys += DictBase.parse_key_table(key_parse, elem, name, list_pos, switched_model,
+                                                   case.model_parse_table.plans[minimal], None)
+        return case.parsed(elem, name, found_keys, result)
+
+    # Parses each key in a key table plan, returns the number of keys found
     @staticmethod
-    def gen_key(grammar, model, model_is_dict, key, list_pos, result, variable_result):
+    def parse_key_table(key_parse, elem, name, list_pos, model, key_plan, result):
         found_keys = 0
-        if model_is_dict:
-            # Model is a dictionary, look up the key name to get the submodel
-            sub_model = None
-            if key['name'] in model:
-                sub_model = model[key['name']]
-                found_keys = 1
-        else:
-            sub_model = model
-        result[key['name']] = grammar.gen(sub_model, key['schema'], result, list_pos)
-        if result[key['name']] is not None:
-            variable_result[key['name']] = result[key['name']]
+        for key_name, key_trail, key_schema, required in key_plan:
+            if key_name in elem:
+                found_keys += 1
+                # Note we update the context with the elem for sub-parsing
+                key_result = key_parse(elem[key_name], key_schema, (name, key_trail), elem, list_pos, model)
+                # Only store if significant
+                if key_result is not None:
+                    if result is None:
+                        raise DictBase.switch_model_result_error(name, key_name)
+                    result[key_name] = key_result
+            elif required:
+                raise DictBase.missing_key_error(name, key_name, elem)
         return found_keys
 
     # gen the keys of a dict or a switch dict
-    # found keys is the number of keys found (0 for dicts, 1 for switch dicts, since we found the switch key)
     # the model is either None, a model object, or a dictionary
     # If none or an object, we pass directly to the sub-gen
     # If a dictionary we get the key out of the model and use that
     # If an atom uses the context function, keys are added to the context in the order they appear in the schema
+    # The keys of the case model are genned from the model variable
+    @staticmethod
+    def gen_case_keys(key_gen, minimal, model, list_pos, case, result, variable_result):
+        model_is_dict = DictBase.gen_model_is_dict(model)
+        found_keys = case.switch_keys
+        found_keys += DictBase.gen_key_table(key_gen, model, model_is_dict, case.gen_table.gen_plan, list_pos, result,
+                                             variable_result)
+        if case.model_gen_table is not None:
+            switched_model = model.get_var(case.model_var)
+            found_keys += DictBase.gen_key_table(key_gen, switched_model, model_is_dict, case.model_gen_table.gen_plan,
+                                                 list_pos, result, variable_result)
+        return DictBase.genned_keys(minimal, model, model_is_dict, found_keys, result, variable_result)
+
+    # Gens each key in a key table gen plan, returns the number of keys found in the model
+    @staticmethod
+    def gen_key_table(key_gen, model, model_is_dict, key_plan, list_pos, result, variable_result):
+        found_keys = 0
+        for key_name, key_schema in key_plan:
+            if model_is_dict:
+                # Model is a dictionary, look up the key name to get the submodel
+                sub_model = None
+                if key_name in model:
+                    sub_model = model[key_name]
+                    found_keys += 1
+            else:
+                sub_model = model
+            key_result = key_gen(sub_model, key_schema, result, list_pos)
+            result[key_name] = key_result
+            if key_result is not None:
+                variable_result[key_name] = key_result
+        return found_keys
+
     @staticmethod
-    def gen_keys(grammar, model, keys, model_keys, model_var, list_pos, result, variable_result, found_keys):
+    def gen_model_is_dict(model):
         model_is_dict = isinstance(model, dict)
         if model is not None and not isinstance(model, GrammarModel) and not model_is_dict:
             raise GrammarException('type_not_dict', "gen called on non dict")
+        return model_is_dict
 
-        # Determine the model for genning sub elements
-        # sub_model = model
-        for key in keys:
-            found_keys += DictBase.gen_key(grammar, model, model_is_dict, key, list_pos, result, variable_result)
-
-        if model_var is not None:
-            switched_model = model.get_var(model_var)
-            for key in model_keys:
-                found_keys += DictBase.gen_key(grammar, switched_model, model_is_dict, key, list_pos, result,
-                                               variable_result)
-
+    @staticmethod
+    def genned_keys(minimal, model, model_is_dict, found_keys, result, variable_result):
         if model_is_dict and found_keys != len(model.keys()):
             raise GrammarException('dict_bad_keys', "gen_dict has unknown key in model")
-        if grammar.minimal:
+        if minimal:
             if variable_result == {}:
                 return None
             else:
@@ -252,6 +428,165 @@ class DictBase(GrammarNode):
         else:
             return result
 
+    # The compiled engine (see Grammar.compile) uses the plans of the case with the key schemas replaced by their
+    # compiled closures
+    @staticmethod
+    def compile_parse_case(grammar, case):
+        model_key_plan = None
+        if case.model_parse_table is not None:
+            model_key_plan = DictBase.compile_parse_plan(grammar, case.model_parse_table)
+        return case, DictBase.compile_parse_plan(grammar, case.parse_table), model_key_plan
+
+    @staticmethod
+    def compile_parse_plan(grammar, key_table):
+        return [(key_name, key_trail, grammar.compile_parse(key_schema), required)
+                for key_name, key_trail, key_schema, required in key_table.plans[grammar.minimal]]
+
+    @staticmethod
+    def parse_compiled_case(compiled_case, elem, name, list_pos, model, result, switched_model):
+        case, key_plan, model_key_plan = compiled_case
+        if case.duplicates:
+            raise DictBase.duplicate_keys_error()
+        found_keys = case.switch_keys + DictBase.parse_key_plan(key_plan, elem, name, list_pos, model, result)
+        if model_key_plan is not None:
+            found_keys += DictBase.parse_key_plan(model_key_plan, elem, name, list_pos, switched_model, None)
+        return case.parsed(elem, name, found_keys, result)
+
+    # parse_key_table for a compiled plan
+    @staticmethod
+    def parse_key_plan(key_plan, elem, name, list_pos, model, result):
+        found_keys = 0
+        for key_name, key_trail, key_parse, required in key_plan:
+            if key_name in elem:
+                found_keys += 1
+                key_result = key_parse(elem[key_name], (name, key_trail), elem, list_pos, model)
+                if key_result is not None:
+                    if result is None:
+                        raise DictBase.switch_model_result_error(name, key_name)
+                    result[key_name] = key_result
+            elif required:
+                raise DictBase.missing_key_error(name, key_name, elem)
+        return found_keys
+
+    @staticmethod
+    def compile_gen_case(grammar, case):
+        model_key_plan = None
+        if case.model_gen_table is not None:
+            model_key_plan = DictBase.compile_gen_plan(grammar, case.model_gen_table)
+        return case, DictBase.compile_gen_plan(grammar, case.gen_table), model_key_plan
+
+    @staticmethod
+    def compile_gen_plan(grammar, key_table):
+        return [(key_name, grammar.compile_gen(key_schema)) for key_name, key_schema in key_table.gen_plan]
+
+    @staticmethod
+    def gen_compiled_case(compiled_case, minimal, model, list_pos, result, variable_result):
+        case, key_plan, model_key_plan = compiled_case
+        model_is_dict = DictBase.gen_model_is_dict(model)
+        found_keys = case.switch_keys + DictBase.gen_key_plan(key_plan, model, model_is_dict, list_pos, result,
+                                                              variable_result)
+        if model_key_plan is not None:
+            switched_model = model.get_var(case.model_var)
+            found_keys += DictBase.gen_key_plan(model_key_plan, switched_model, model_is_dict, list_pos, result,
+                                                variable_result)
+        return DictBase.genned_keys(minimal, model, model_is_dict, found_keys, result, variable_result)
+
+    # gen_key_table for a compiled plan
+    @staticmethod
+    def gen_key_plan(key_plan, model, model_is_dict, list_pos, result, variable_result):
+        found_keys = 0
+        for key_name, key_gen in key_plan:
+            if model_is_dict:
+                sub_model = None
+                if key_name in model:
+                    sub_model = model[key_name]
+                    found_keys += 1
+            else:
+                sub_model = model
+            key_result = key_gen(sub_model, result, list_pos)
+            result[key_name] = key_result
+            if key_result is not None:
+                variable_result[key_name] = key_result
+        return found_keys
+
+    # The explicit stack engine (see Grammar.stack_parse) yields the containers below to be parsed or genned, and
+    # passes the other nodes to grammar.parse/gen
+    @staticmethod
+    def parse_case_keys_steps(grammar, elem, name, list_pos, model, case, result, switched_model):
+        if case.duplicates:
+            raise DictBase.duplicate_keys_error()
+        found_keys = case.switch_keys
+        found_keys += yield from DictBase.parse_key_table_steps(grammar, elem, name, list_pos, model,
+                                                                case.parse_table.plans[grammar.minimal], result)
+        if case.model_parse_table is not None:
+            found_keys += yield from DictBase.parse_key_table_steps(grammar, elem, name, list_pos, switched_model,
+                                                                    case.model_parse_table.plans[grammar.minimal],
+                                                                    None)
+        return case.parsed(elem, name, found_keys, result)
+
+    @staticmethod
+    def parse_key_table_steps(grammar, elem, name, list_pos, model, key_plan, result):
+        found_keys = 0
+        for key_name, key_trail, key_schema, required in key_plan:
+            if key_name in elem:
+                found_keys += 1
+                if getattr(key_schema, 'has_steps', False):
+                    key_result = yield elem[key_name], key_schema, (name, key_trail), elem, list_pos, model
+                else:
+                    key_result = grammar.parse(elem[key_name], key_schema, (name, key_trail), elem, list_pos, model)
+                if key_result is not None:
+                    if result is None:
+                        raise DictBase.switch_model_result_error(name, key_name)
+                    result[key_name] = key_result
+            elif required:
+                raise DictBase.missing_key_error(name, key_name, elem)
+        return found_keys
+
+    @staticmethod
+    def gen_case_keys_steps(grammar, model, list_pos, case, result, variable_result):
+        model_is_dict = DictBase.gen_model_is_dict(model)
+        found_keys = case.switch_keys
+        found_keys += yield from DictBase.gen_key_table_steps(grammar, model, model_is_dict, case.gen_table.gen_plan,
+                                                              list_pos, result, variable_result)
+        if case.model_gen_table is not None:
+            switched_model = model.get_var(case.model_var)
+            found_keys += yield from DictBase.gen_key_table_steps(grammar, switched_model, model_is_dict,
+                                                                  case.model_gen_table.gen_plan, list_pos, result,
+                                                                  variable_result)
+        return DictBase.genned_keys(grammar.minimal, model, model_is_dict, found_keys, result, variable_result)
+
+    @staticmethod
+    def gen_key_table_steps(grammar, model, model_is_dict, key_plan, list_pos, result, variable_result):
+        found_keys = 0
+        for key_name, key_schema in key_plan:
+            if model_is_dict:
+                sub_model = None
+                if key_name in model:
+                    sub_model = model[key_name]
+                    found_keys += 1
+            else:
+                sub_model = model
+            if getattr(key_schema, 'has_steps', False):
+                key_result = yield sub_model, key_schema, result, list_pos
+            else:
+                key_result = grammar.gen(sub_model, key_schema, result, list_pos)
+            result[key_name] = key_result
+            if key_result is not None:
+                variable_result[key_name] = key_result
+        return found_keys
+
+    # Samples the keys into elem, complete grammars have all the keys (as gen does), and the optional keys of minimal
+    # grammars are filled with the density
+    # With duplicate key names, the first key is sampled
+    @staticmethod
+    def sample_keys(sampler, keys, elem, list_pos):
+        for key in keys:
+            if key['name'] in elem:
+                continue
+            if not sampler.minimal or key['required'] or sampler.filled():
+                elem[key['name']] = sampler.sample(key['schema'], elem, list_pos)
+        return elem
+
     @staticmethod
     def print_key(indent, key, prefix=None):
         result = ' ' * indent
@@ -271,6 +606,8 @@ class Dict(DictBase):
     def __init__(self, name, keys, **kwargs):
         super().__init__(name, **kwargs)
         self.keys = keys
+        self.key_table = KeyTable(keys)
+        self.case = DictCase(self.key_table, self.key_table)
 
     # parse_dict
     # elem is the dictionary element to be parsed
@@ -283,16 +620,66 @@ class Dict(DictBase):
     # In complete, all keys must appear to be sub-parsed
     # In minimal, keys need not appear, but we must still make sure that all appearing keys are in the grammar
     def parse(self, grammar, elem, name, context, list_pos, model):
-        return super().parse_keys(grammar, elem, name, list_pos, model, self.keys, [], None, {}, {})
+        self.check_elem(elem)
+        return self.parse_case_keys(grammar.parse, grammar.minimal, elem, name, list_pos, model, self.case, {}, None)
+
+    def validate(self, grammar, elem, name, context, list_pos):
+        self.check_elem(elem)
+        self.parse_case_keys(grammar.validate_elem, grammar.minimal, elem, name, list_pos, None, self.case, None, None)
+
+    def path_step(self, grammar, step, elem, name, list_pos, model_class):
+        self.check_elem(elem)
+        if step not in self.key_table.index:
+            raise self.bad_path_error(name, step, 'the keys are: ' + ', '.join(self.key_table.names))
+        return self.path_key(self.key_table.index[step], elem, name, model_class)
+
+    def sample(self, sampler, context, list_pos):
+        return super().sample_keys(sampler, self.keys, {}, list_pos)
 
     # generate a dictionary element
     # returns significant keys when minimal, or the entire dict when complete
     def gen(self, grammar, model, context, list_pos):
-        result = {}
-        variable_result = {}
-        found_keys = 0
+        return self.gen_case_keys(grammar.gen, grammar.minimal, model, list_pos, self.case, {}, {})
+
+    def compile_parse(self, grammar):
+        compiled_case = self.compile_parse_case(grammar, self.case)
+        parse_compiled_case = self.parse_compiled_case
+
+        def parse(elem, name, context, list_pos, model):
+            if not isinstance(elem, dict):
+                raise GrammarException('type_not_dict', "parse called on non-dict")
+            return parse_compiled_case(compiled_case, elem, name, list_pos, model, {}, None)
+        return parse
+
+    def compile_gen(self, grammar):
+        compiled_case = self.compile_gen_case(grammar, self.case)
+        gen_compiled_case = self.gen_compiled_case
+        minimal = grammar.minimal
+
+        def gen(model, context, list_pos):
+            return gen_compiled_case(compiled_case, minimal, model, list_pos, {}, {})
+        return gen
+
+    # The containers parse and gen with generators on the explicit stack, see Grammar.stack_parse
+    has_steps = True
 
-        return super().gen_keys(grammar, model, self.keys, [], None, list_pos, result, variable_result, found_keys)
+    def parse_steps(self, grammar, elem, name, context, list_pos, model):
+        self.check_elem(elem)
+        return (yield from self.parse_case_keys_steps(grammar, elem, name, list_pos, model, self.case, {}, None))
+
+    def gen_steps(self, grammar, model, context, list_pos):
+        return (yield from self.gen_case_keys_steps(grammar, model, list_pos, self.case, {}, {}))
+
+    def sub_schemas(self):
+        return [key['schema'] for key in self.keys]
+
+    has_template = True
+    has_fingerprint = True
+
+    def template_source(self, source, depth):
+        if self.case.duplicates:
+            return None
+        return source.template_dict([], self.keys, depth)
 
     def print(self, indent):
         result = ' ' * indent
@@ -308,7 +695,9 @@ class SwitchDict(DictBase):
         super().__init__(name, **kwargs)
         self.model_var = model_var
         self.switch_key = switch_key
-        self.case_keys = copy.deepcopy(case_keys)
+        # The case model is popped from the case key lists below, so the lists are copied, but the key schemas are
+        # shared with the caller (deep copying them dominated building the message schemas)
+        self.case_keys = {case_key: list(case_keys[case_key]) for case_key in case_keys}
         self.case_models = {}
         self.common_keys = common_keys
         if self.common_keys is None:
@@ -340,66 +729,152 @@ class SwitchDict(DictBase):
             else:
                 self.case_keys[case_key].pop(found_pos)
         switch_key_name = switch_key['name']
-        common_match = self.lookup_key(switch_key_name, self.common_keys)
-        if common_match:
+        self.common_table = KeyTable(self.common_keys)
+        if switch_key_name in self.common_table.index:
             msg = ('The SwitchDict ' + name + ' switch key ' + switch_key_name + ' conflicts with a common key ' +
-                   common_match)
+                   switch_key_name)
             raise GrammarException('switch_key_conflict', msg)
+        self.case_plans = {}
         for case_key_name in self.case_keys:
-            case_key_match = self.lookup_key(switch_key_name, self.case_keys[case_key_name])
-            if case_key_match:
+            case_table = KeyTable(self.case_keys[case_key_name])
+            if switch_key_name in case_table.index:
                 msg = ('The SwitchDict ' + name + ' switch key ' + switch_key_name + ' conflicts with a case key ' +
-                       case_key_match)
+                       switch_key_name)
                 raise GrammarException('switch_key_conflict', msg)
+            self.case_plans[case_key_name] = self.make_case(case_key_name, case_table)
+
+        # An enum switch key without a model or cleanup parses to the same value as the parsed switch value, so the
+        # switch key is only parsed once, and the variable (if any) bound directly
+        switch_schema = switch_key['schema']
+        self.switch_parsed_once = (isinstance(switch_schema, Enum) and switch_schema.model is None and
+                                   switch_schema.cleanup is None)
+
+    # The plan for a case, see DictCase
+    # Without a model variable, the common keys then the case keys are parsed, the case keys then the common keys are
+    # genned
+    def make_case(self, case_key, case_table):
+        switch_key_name = self.switch_key['name']
+        case_keys = self.case_keys[case_key]
+        if self.model_var is None:
+            return DictCase(KeyTable(self.common_keys + case_keys), KeyTable(case_keys + self.common_keys),
+                            switch_key_name=switch_key_name)
+        return DictCase(self.common_table, self.common_table, case_table, case_table, self.case_models.get(case_key),
+                        self.model_var, switch_key_name)
+
+    def missing_switch_error(self, name, elem):
+        msg = ('While parsing ' + trail_name(name) + ', the switch key ' + self.switch_key['name'] +
+               ' does not appear in the parsed element.')
+        msg += "\nElement keys are " + ', '.join(elem.keys())
+        return GrammarException('missing_switch', msg)
+
+    def bad_switch_error(self, switch_value, elem):
+        msg = 'The switch element ' + str(switch_value) + ' does not appear in the case keys: '
+        msg += ','.join(self.case_keys)
+        msg += "\nwhile parsing " + str(elem)
+        return GrammarException('bad_switch', msg)
+
+    @staticmethod
+    def no_base_model_error(name):
+        return GrammarException('no_base_model', 'While parsing ' + trail_name(name) +
+                                ' the SwitchDict has a switch model but there is no enclosing model.')
+
+    def gen_bad_switch_error(self, defaulted_switch_value):
+        msg = 'In node ' + self.name + "\n"
+        msg += 'The switch value ' + defaulted_switch_value + " is not in the case keys\n"
+        msg += 'Valid case keys are: ' + ', '.join(self.case_keys)
+        return GrammarException('switch_dict_bad_switch', msg)
 
     # same as parse_dict except
     # we must parse the switch key into a value, even if it is the default
     def parse(self, grammar, elem, name, context, list_pos, model):
+        parse_value, switch_value, case_plan = self.find_case(grammar, elem, name)
+        switched_model = self.bind_case_model(case_plan, model, name)
+        if self.switch_parsed_once:
+            parse_value = self.bind_switch_value(parse_value, name, model)
+        else:
+            parse_value = grammar.parse(switch_value, self.switch_key['schema'], name, None, list_pos, model)
+        return self.parse_case_keys(grammar.parse, grammar.minimal, elem, name, list_pos, model, case_plan,
+                                    self.switch_result(parse_value), switched_model)
+
+    # Figure out what the switch value is: returns the parsed switch key, the switch value (the default when the
+    # switch key parses to None) and its case plan
+    def find_case(self, grammar, elem, name):
         self.check_elem(elem)
         switch_key = self.switch_key
         if switch_key['name'] not in elem:
             if switch_key['schema'].default is None:
-                msg = ('While parsing ' + name + ', the switch key ' + switch_key['name'] +
-                       ' does not appear in the parsed element.')
-                msg += "\nElement keys are " + ', '.join(elem.keys())
-                raise GrammarException('missing_switch', msg)
+                raise self.missing_switch_error(name, elem)
             switch_key_value = switch_key['schema'].default
         else:
             switch_key_value = elem[switch_key['name']]
-        # Figure out what the switch value is
-        switch_value = switch_key['schema'].parse(grammar, switch_key_value, name, None, [], None)
+        parse_value = switch_key['schema'].parse(grammar, switch_key_value, name, None, [], None)
+        switch_value = parse_value
         if switch_value is None:
             switch_value = switch_key['schema'].default
-        if switch_value not in self.case_keys:
-            msg = 'The switch element ' + str(switch_value) + ' does not appear in the case keys: '
-            msg += ','.join(self.case_keys)
-            msg += "\nwhile parsing " + str(elem)
-            raise GrammarException('bad_switch', msg)
-        case_keys = self.case_keys[switch_value]
-
-        if self.model_var is not None:
-            if model is None:
-                raise GrammarException('no_base_model', 'While parsing ' + name +
-                                       ' the SwitchDict has a switch model but there is no enclosing model.')
-            switched_model = None
-            if switch_value in self.case_models:
-                switched_model = self.case_models[switch_value]()
-            model.set_var(self.model_var, switched_model, name)
-            all_keys = self.common_keys
-            switch_model_keys = case_keys
-        else:
-            all_keys = self.common_keys + case_keys
-            switch_model_keys = []
-            switched_model = None
-
-        parse_value = grammar.parse(switch_value, switch_key['schema'], name, None, list_pos, model)
-        result = {}
-        if parse_value is not None:
-            result[switch_key['name']] = parse_value
-        seen_keys = {switch_key['name']: True}
-
-        return super().parse_keys(grammar, elem, name, list_pos, model, all_keys, switch_model_keys, switched_model,
-                                  result, seen_keys)
+        if switch_value not in self.case_plans:
+            raise self.bad_switch_error(switch_value, elem)
+        return parse_value, switch_value, self.case_plans[switch_value]
+
+    # With a model variable, binds a new case model (or None if the case has none) in the model, and returns it
+    def bind_case_model(self, case_plan, model, name):
+        if self.model_var is None:
+            return None
+        if model is None:
+            raise self.no_base_model_error(name)
+        switched_model = None
+        if case_plan.model is not None:
+            switched_model = case_plan.model()
+        model.set_var(self.model_var, switched_model, name)
+        return switched_model
+
+    # With switch_parsed_once, binds the parsed switch key to the variable of the switch key as parsing it would, and
+    # returns the result of the switch key
+    def bind_switch_value(self, parse_value, name, model):
+        switch_schema = self.switch_key['schema']
+        if switch_schema.variable is None or parse_value is None:
+            return parse_value
+        if name == "":
+            model.set_var(switch_schema.variable, parse_value, switch_schema.name)
+        else:
+            model.set_var(switch_schema.variable, parse_value, (name, ':' + switch_schema.name))
+        return None
+
+    # The result starts with the switch key, if it is significant
+    def switch_result(self, parse_value):
+        if parse_value is None:
+            return {}
+        return {self.switch_key['name']: parse_value}
+
+    # Same as parse, without the switch model and variables
+    def validate(self, grammar, elem, name, context, list_pos):
+        _parse_value, switch_value, case_plan = self.find_case(grammar, elem, name)
+        if not self.switch_parsed_once:
+            grammar.validate_elem(switch_value, self.switch_key['schema'], name, None, list_pos)
+        self.parse_case_keys(grammar.validate_elem, grammar.minimal, elem, name, list_pos, None, case_plan, None, None)
+
+    # The keys of the case model (with a model variable) bind into the case model
+    def path_step(self, grammar, step, elem, name, list_pos, model_class):
+        _parse_value, switch_value, case_plan = self.find_case(grammar, elem, name)
+        if step == self.switch_key['name']:
+            return self.path_key(self.switch_key, elem, name, model_class)
+        if step in case_plan.parse_table.index:
+            return self.path_key(case_plan.parse_table.index[step], elem, name, model_class)
+        if case_plan.model_parse_table is not None and step in case_plan.model_parse_table.index:
+            return self.path_key(case_plan.model_parse_table.index[step], elem, name, case_plan.model)
+        valid_keys = [self.switch_key['name']] + case_plan.valid_keys
+        raise self.bad_path_error(name, step, 'the keys for ' + str(switch_value) + ' are: ' + ', '.join(valid_keys))
+
+    # The case is the default when it isn't filled, and the default is a case
+    # A switch key with a sample function picks the case
+    def sample(self, sampler, context, list_pos):
+        switch_schema = self.switch_key['schema']
+        switch_value = switch_schema.default
+        if switch_schema in sampler.functions:
+            switch_value = sampler.sample(switch_schema, None, list_pos)
+        elif switch_value not in self.case_keys or sampler.filled():
+            switch_value = sampler.random.choice(list(self.case_keys))
+        elem = {self.switch_key['name']: switch_value}
+        return super().sample_keys(sampler, self.common_keys + self.case_keys[switch_value], elem, list_pos)
 
     # generate a switch key element
     # returns significant keys when minimal, or the entire dict when complete
@@ -411,39 +886,108 @@ class SwitchDict(DictBase):
     # This affects value and default functions which try to access the switch key
     # I don't have any use cases yet
     def gen(self, grammar, model, context, list_pos):
-        # Determine what the switch is
-        switch_model = model
+        switch_value = grammar.gen(self.switch_model(model), self.switch_key['schema'], {}, list_pos)
+        result, variable_result = self.switch_results(switch_value)
+        return self.gen_case_keys(grammar.gen, grammar.minimal, model, list_pos, self.find_gen_case(switch_value),
+                                  result, variable_result)
+
+    # Determine what the switch is
+    def switch_model(self, model):
         if isinstance(model, dict):
-            if self.switch_key['name'] in model:
-                switch_model = model[self.switch_key['name']]
-            else:
-                switch_model = None
-        switch_value = grammar.gen(switch_model, self.switch_key['schema'], {}, list_pos)
+            return model.get(self.switch_key['name'])
+        return model
 
+    # The case plan for the genned switch value, the default if it is None
+    def find_gen_case(self, switch_value):
         defaulted_switch_value = switch_value
         if defaulted_switch_value is None:
             defaulted_switch_value = self.switch_key['schema'].default
-        if defaulted_switch_value not in self.case_keys:
-            msg = 'In node ' + self.name + "\n"
-            msg += 'The switch value ' + defaulted_switch_value + " is not in the case keys\n"
-            msg += 'Valid case keys are: ' + ', '.join(self.case_keys)
-            raise GrammarException('switch_dict_bad_switch', msg)
-        if self.model_var is None:
-            keys = self.case_keys[defaulted_switch_value] + self.common_keys
-            model_keys = []
+        if defaulted_switch_value not in self.case_plans:
+            raise self.gen_bad_switch_error(defaulted_switch_value)
+        return self.case_plans[defaulted_switch_value]
+
+    # The result and significant result start with the switch key, unless it gens to None
+    def switch_results(self, switch_value):
+        if switch_value is None:
+            return {}, {}
+        return {self.switch_key['name']: switch_value}, {self.switch_key['name']: switch_value}
+
+    # The compiled plans for each case, see DictBase.compile_parse_case
+    def compile_parse(self, grammar):
+        switch_parse = grammar.compile_parse(self.switch_key['schema'])
+        switch_parsed_once = self.switch_parsed_once
+        compiled_cases = {}
+        for case_plan in self.case_plans.values():
+            compiled_cases[case_plan] = self.compile_parse_case(grammar, case_plan)
+        parse_compiled_case = self.parse_compiled_case
+
+        def parse(elem, name, context, list_pos, model):
+            parse_value, switch_value, case_plan = self.find_case(grammar, elem, name)
+            switched_model = self.bind_case_model(case_plan, model, name)
+            if switch_parsed_once:
+                parse_value = self.bind_switch_value(parse_value, name, model)
+            else:
+                parse_value = switch_parse(switch_value, name, None, list_pos, model)
+            return parse_compiled_case(compiled_cases[case_plan], elem, name, list_pos, model,
+                                       self.switch_result(parse_value), switched_model)
+        return parse
+
+    def compile_gen(self, grammar):
+        switch_gen = grammar.compile_gen(self.switch_key['schema'])
+        minimal = grammar.minimal
+        compiled_cases = {}
+        for case_plan in self.case_plans.values():
+            compiled_cases[case_plan] = self.compile_gen_case(grammar, case_plan)
+        gen_compiled_case = self.gen_compiled_case
+
+        def gen(model, context, list_pos):
+            switch_value = switch_gen(self.switch_model(model), {}, list_pos)
+            result, variable_result = self.switch_results(switch_value)
+            return gen_compiled_case(compiled_cases[self.find_gen_case(switch_value)], minimal, model, list_pos,
+                                     result, variable_result)
+        return gen
+
+    has_steps = True
+
+    def parse_steps(self, grammar, elem, name, context, list_pos, model):
+        parse_value, switch_value, case_plan = self.find_case(grammar, elem, name)
+        switched_model = self.bind_case_model(case_plan, model, name)
+        if self.switch_parsed_once:
+            parse_value = self.bind_switch_value(parse_value, name, model)
         else:
-            keys = self.common_keys
-            model_keys = self.case_keys[defaulted_switch_value]
+            parse_value = yield switch_value, self.switch_key['schema'], name, None, list_pos, model
+        return (yield from self.parse_case_keys_steps(grammar, elem, name, list_pos, model, case_plan,
+                                                      self.switch_result(parse_value), switched_model))
+
+    def gen_steps(self, grammar, model, context, list_pos):
+        switch_value = yield self.switch_model(model), self.switch_key['schema'], {}, list_pos
+        result, variable_result = self.switch_results(switch_value)
+        return (yield from self.gen_case_keys_steps(grammar, model, list_pos, self.find_gen_case(switch_value), result,
+                                                    variable_result))
+
+    def sub_schemas(self):
+        result = [self.switch_key['schema']] + [key['schema'] for key in self.common_keys]
+        for case_key in self.case_keys:
+            result += [key['schema'] for key in self.case_keys[case_key]]
+        return result
 
-        result = {}
-        variable_result = {}
-        if switch_value is not None:
-            result = {self.switch_key['name']: switch_value}
-            variable_result = {self.switch_key['name']: switch_value}
-        found_keys = 1
+    has_template = True
+    has_fingerprint = True
 
-        return super().gen_keys(grammar, model, keys, model_keys, self.model_var, list_pos, result, variable_result,
-                                found_keys)
+    # Without a model the switch key gens to its default, which picks the case
+    # (a constant switch key parses to None, and has no default to pick the case with)
+    def template_source(self, source, depth):
+        switch_schema = self.switch_key['schema']
+        if self.model_var is not None or not isinstance(switch_schema, (Enum, DefaultAtom)):
+            return None
+        try:
+            switch_value = switch_schema.gen(source.grammar, None, {}, [])
+        except GrammarException:
+            return None
+        if switch_value not in self.case_plans or self.case_plans[switch_value].duplicates:
+            return None
+        return source.template_dict([(self.switch_key['name'], source.literal(switch_value))],
+                                    self.case_plans[switch_value].gen_table.keys, depth)
 
     def print(self, indent):
         result = ' ' * indent
@@ -462,10 +1006,12 @@ class SwitchDict(DictBase):
 
 
 class List(GrammarNode):
-    def __init__(self, name, length, schema, **kwargs):
+    # parallel lists have their entries parsed and genned in worker processes, see Grammar.parallel_list
+    def __init__(self, name, length, schema, parallel=False, **kwargs):
         super().__init__(name, **kwargs)
         self.length = length
         self.schema = schema
+        self.parallel = parallel
 
     # parse_list
     # for complete grammars, the list must be the exact length of the schema
@@ -474,11 +1020,39 @@ class List(GrammarNode):
     # The significant result is a list with all significant values filled in.
     # Note that the list is not compacted, embedded insignificant values are kept with None
     # If the entire list is empty, None is returned
+    # The entries already parsed by parse_events (ParsedEntries) are taken as they are
     def parse(self, grammar, elem, name, context, list_pos, model):
-        no_max = self.length == 0
+        list_length = self.parse_length(grammar, elem)
+        if isinstance(elem, ParsedEntries) or grammar.parallel_list(self):
+            return self.parsed_entries(grammar, elem, name, list_pos, list_length)
+        return self.parse_list_entries(grammar.parse, grammar, elem, name, list_pos, model, list_length)
+
+    # Parses the entries with entry_parse, grammar.parse, or grammar.validate_elem when validating (without a model)
+    # An entry matching the default fingerprint parses to None
+    def parse_list_entries(self, entry_parse, grammar, elem, name, list_pos, model, list_length):
+        result = [None] * list_length
+        modified = False
+        fingerprint = grammar.default_fingerprint(self.schema)
+        list_pos.append(0)
+        try:
+            for new_list_pos, list_elem in enumerate(elem):
+                if list_elem is not None:
+                    list_pos[-1] = new_list_pos
+                    if fingerprint is not None and fingerprint.matches(list_elem, list_pos):
+                        continue
+                    entry_result = entry_parse(list_elem, self.schema, name, elem, list_pos, model)
+                    if entry_result is not None:
+                        modified = True
+                        result[new_list_pos] = entry_result
+        finally:
+            list_pos.pop()
+        return self.parsed(grammar.minimal, result, modified)
+
+    # The length of the parse result, after checking the element
+    def parse_length(self, grammar, elem):
         if not isinstance(elem, list):
             raise GrammarException('type_not_list', "parse_list called on non list")
-        if not grammar.minimal and no_max:
+        if not grammar.minimal and self.length == 0:
             raise GrammarException('unlimited_list_complete_grammar', 'length 0 with complete grammar')
 
         list_length = self.length
@@ -488,24 +1062,65 @@ class List(GrammarNode):
         if len(elem) != list_length:
             if not (grammar.minimal and len(elem) < list_length):
                 raise GrammarException('list_bad_length', "parse_list called with wrong length list")
+        return list_length
 
-        result = [None] * list_length
-        modified = False
-        for new_list_pos, list_elem in enumerate(elem):
-            if list_elem is not None:
-                entry_result = grammar.parse(list_elem, self.schema, name, elem, list_pos + [new_list_pos],
-                                             model)
-                if entry_result is not None:
-                    modified = True
-                    result[new_list_pos] = entry_result
-        if modified:
-            if grammar.minimal:
-                prune_list(result)
-                if len(result) == 0:
-                    result = None
-            return result
+    # The result of a list already parsed by parse_events, or parsed by the workers
+    def parsed_entries(self, grammar, elem, name, list_pos, list_length):
+        if isinstance(elem, ParsedEntries):
+            result = elem + [None] * (list_length - len(elem))
         else:
+            result = grammar.parallel_parse(self, elem, name, list_pos) + [None] * (list_length - len(elem))
+        return self.parsed(grammar.minimal, result, any([entry_result is not None for entry_result in result]))
+
+    # The significant result, with the trailing None entries of minimal grammars pruned
+    @staticmethod
+    def parsed(minimal, result, modified):
+        if not modified:
             return None
+        if minimal:
+            prune_list(result)
+            if len(result) == 0:
+                return None
+        return result
+
+    def validate(self, grammar, elem, name, context, list_pos):
+        self.parse_list_entries(grammar.validate_elem, grammar, elem, name, list_pos, None,
+                                self.parse_length(grammar, elem))
+
+    # The position is pushed on list_pos, as parse does for the entry
+    def path_step(self, grammar, step, elem, name, list_pos, model_class):
+        if not isinstance(elem, list):
+            raise GrammarException('type_not_list', "parse_list called on non list")
+        if not step.isdigit() or int(step) >= len(elem):
+            raise self.bad_path_error(name, step, 'the list has ' + str(len(elem)) + ' entries')
+        list_pos.append(int(step))
+        return self.schema, elem[int(step)], elem, name, model_class
+
+    # Unlimited lists are up to GrammarSampler.unlimited_length entries, or the length of sample_length
+    def sample(self, sampler, context, list_pos):
+        length = self.length
+        if length == 0:
+            length = sampler.unlimited_length
+        return self.sample_entries(sampler, length, list_pos)
+
+    # The filled entries come first, as in configs, with the density the fraction of the entries that are filled
+    # The other entries of complete lists are the default entries, minimal lists end after the filled entries
+    def sample_entries(self, sampler, length, list_pos):
+        filled = len([entry for entry in range(length) if sampler.filled()])
+        if sampler.minimal:
+            length = filled
+        result = []
+        list_pos.append(0)
+        try:
+            for new_list_pos in range(length):
+                list_pos[-1] = new_list_pos
+                if new_list_pos < filled:
+                    result.append(sampler.sample(self.schema, result, list_pos))
+                else:
+                    result.append(sampler.grammar.gen(None, self.schema, result, list_pos))
+        finally:
+            list_pos.pop()
+        return result
 
     # generate a list from a model
     # For a complete grammar, this is a full length list
@@ -517,34 +1132,186 @@ class List(GrammarNode):
     # The model can be a model, pass through to sub elements
     # The model can be a list, the list elements are used in sub-parsing
     def gen(self, grammar, model, context, list_pos):
+        list_length = self.gen_length(grammar, model)
+        is_list = isinstance(model, list)
+        if is_list and grammar.parallel_list(self):
+            return self.genned(grammar.minimal, grammar.parallel_gen(self, model, list_pos, list_length))
+
+        result = [None] * list_length
+        list_pos.append(0)
+        try:
+            for new_list_pos in range(0, list_length):
+                sub_model = model
+                if is_list:
+                    if new_list_pos >= len(model):
+                        sub_model = None
+                    else:
+                        sub_model = model[new_list_pos]
+                list_pos[-1] = new_list_pos
+                result[new_list_pos] = grammar.gen(sub_model, self.schema, result, list_pos)
+        finally:
+            list_pos.pop()
+        return self.genned(grammar.minimal, result)
+
+    @staticmethod
+    def genned(minimal, result):
+        if minimal:
+            prune_list(result)
+            if len(result) == 0:
+                return None
+        return result
+
+    # The length of the list genned for the model, after checking the model, also used by Grammar.gen_stream
+    def gen_length(self, grammar, model):
         is_list = isinstance(model, list)
-        unlimited = self.length == 0
         if model is not None and not isinstance(model, GrammarModel):
             if not is_list:
                 raise GrammarException('model_schema_mismatch', "gen_list got non list")
-            if not grammar.minimal and not unlimited and len(model) != self.length:
+            if not grammar.minimal and self.length != 0 and len(model) != self.length:
                 raise GrammarException('list_bad_length', "gen_list called with wrong length list")
-            if grammar.minimal and not unlimited and len(model) > self.length:
+            if grammar.minimal and self.length != 0 and len(model) > self.length:
                 raise GrammarException('list_bad_length', "gen_list called with wrong length list")
+        if self.length == 0 and is_list:
+            return len(model)
+        return self.length
+
+    # The compiled loops over the entries, with the checks and results of parse and gen
+    def compile_parse(self, grammar):
+        # The entries of a parallel list are compiled in the workers
+        if grammar.parallel_list(self):
+            return functools.partial(self.parse, grammar)
+        minimal = grammar.minimal
+        entry_parse = grammar.compile_parse(self.schema)
+        fingerprint = grammar.default_fingerprint(self.schema)
+        parse_length = self.parse_length
+        parsed = self.parsed
+
+        def parse(elem, name, context, list_pos, model):
+            result = [None] * parse_length(grammar, elem)
+            modified = False
+            list_pos.append(0)
+            try:
+                for new_list_pos, list_elem in enumerate(elem):
+                    if list_elem is not None:
+                        list_pos[-1] = new_list_pos
+                        if fingerprint is not None and fingerprint.matches(list_elem, list_pos):
+                            continue
+                        entry_result = entry_parse(list_elem, name, elem, list_pos, model)
+                        if entry_result is not None:
+                            modified = True
+                            result[new_list_pos] = entry_result
+            finally:
+                list_pos.pop()
+            return parsed(minimal, result, modified)
+        return parse
+
+    def compile_gen(self, grammar):
+        if grammar.parallel_list(self):
+            return functools.partial(self.gen, grammar)
+        minimal = grammar.minimal
+        entry_gen = grammar.compile_gen(self.schema)
+        gen_length = self.gen_length
+        genned = self.genned
+
+        def gen(model, context, list_pos):
+            list_length = gen_length(grammar, model)
+            result = [None] * list_length
+            list_pos.append(0)
+            try:
+                if isinstance(model, list):
+                    model_length = len(model)
+                    for new_list_pos in range(list_length):
+                        sub_model = None
+                        if new_list_pos < model_length:
+                            sub_model = model[new_list_pos]
+                        list_pos[-1] = new_list_pos
+                        result[new_list_pos] = entry_gen(sub_model, result, list_pos)
+                else:
+                    for new_list_pos in range(list_length):
+                        list_pos[-1] = new_list_pos
+                        result[new_list_pos] = entry_gen(model, result, list_pos)
+            finally:
+                list_pos.pop()
+            return genned(minimal, result)
+        return gen
+
+    # The containers parse and gen with generators on the explicit stack, see Grammar.stack_parse
+    has_steps = True
+
+    def parse_steps(self, grammar, elem, name, context, list_pos, model):
+        list_length = self.parse_length(grammar, elem)
+        if isinstance(elem, ParsedEntries) or grammar.parallel_list(self):
+            return self.parsed_entries(grammar, elem, name, list_pos, list_length)
 
-        list_length = self.length
-        if list_length == 0 and is_list:
-            list_length = len(model)
+        result = [None] * list_length
+        modified = False
+        fingerprint = grammar.default_fingerprint(self.schema)
+        entry_steps = getattr(self.schema, 'has_steps', False)
+        list_pos.append(0)
+        try:
+            for new_list_pos, list_elem in enumerate(elem):
+                if list_elem is not None:
+                    list_pos[-1] = new_list_pos
+                    if fingerprint is not None and fingerprint.matches(list_elem, list_pos):
+                        continue
+                    if entry_steps:
+                        entry_result = yield list_elem, self.schema, name, elem, list_pos, model
+                    else:
+                        entry_result = grammar.parse(list_elem, self.schema, name, elem, list_pos, model)
+                    if entry_result is not None:
+                        modified = True
+                        result[new_list_pos] = entry_result
+        finally:
+            list_pos.pop()
+        return self.parsed(grammar.minimal, result, modified)
+
+    def gen_steps(self, grammar, model, context, list_pos):
+        list_length = self.gen_length(grammar, model)
+        is_list = isinstance(model, list)
+        if is_list and grammar.parallel_list(self):
+            return self.genned(grammar.minimal, grammar.parallel_gen(self, model, list_pos, list_length))
 
         result = [None] * list_length
-        for new_list_pos in range(0, list_length):
-            sub_model = model
-            if is_list:
-                if new_list_pos >= len(model):
-                    sub_model = None
+        entry_steps = getattr(self.schema, 'has_steps', False)
+        list_pos.append(0)
+        try:
+            for new_list_pos in range(0, list_length):
+                sub_model = model
+                if is_list:
+                    if new_list_pos >= len(model):
+                        sub_model = None
+                    else:
+                        sub_model = model[new_list_pos]
+                list_pos[-1] = new_list_pos
+                if entry_steps:
+                    result[new_list_pos] = yield sub_model, self.schema, result, list_pos
                 else:
-                    sub_model = model[new_list_pos]
-            result[new_list_pos] = grammar.gen(sub_model, self.schema, result, list_pos + [new_list_pos])
-        if grammar.minimal:
-            prune_list(result)
-            if len(result) == 0:
-                result = None
-        return result
+                    result[new_list_pos] = grammar.gen(sub_model, self.schema, result, list_pos)
+        finally:
+            list_pos.pop()
+        return self.genned(grammar.minimal, result)
+
+    def sub_schemas(self):
+        return [self.schema]
+
+    has_template = True
+
+    # A list of containers is left to the fingerprints of its entries, its own would repeat them all
+    @property
+    def has_fingerprint(self):
+        return not self.schema.has_template
+
+    # Entries that are simple constants are repeated, the others are built for each position
+    # Complete grammars don't parse lists without a length, so they have no template
+    def template_source(self, source, depth):
+        if self.length == 0:
+            return None
+        entry = source.template_source(self.schema, depth + 1)
+        if entry is None:
+            return None
+        if source.is_literal(entry):
+            return '[' + entry + '] * ' + str(self.length)
+        return '[' + entry + ' for i' + str(depth) + ' in range(' + str(self.length) + ')]'
 
     def print(self, indent):
         result = ' ' * indent
@@ -553,32 +1320,67 @@ class List(GrammarNode):
         return result
 
 
+# An enum codec converts between the names of an enum and their positions with a hash lookup
+# index is the same as list.index, name is the reverse
+# The codec for a list of names is built once, by enum_codec, and shared by every Enum using that list
+class EnumCodec:
+    def __init__(self, names):
+        self.names = names
+        self.positions = {}
+        for pos, enum_name in enumerate(names):
+            self.positions.setdefault(enum_name, pos)
+
+    def index(self, enum_name):
+        pos = self.positions.get(enum_name)
+        if pos is None:
+            raise ValueError(str(enum_name) + ' is not in the enum')
+        return pos
+
+    def name(self, pos):
+        return self.names[pos]
+
+
+enum_codecs = {}
+
+
+def enum_codec(names):
+    codec = enum_codecs.get(id(names))
+    if codec is None:
+        # The codec keeps the names, so the id isn't reused
+        codec = EnumCodec(names)
+        enum_codecs[id(names)] = codec
+    return codec
+
+
 class Enum(GrammarNode):
     def __init__(self, name, base, default=None, **kwargs):
         super().__init__(name, **kwargs)
         self.base = base
-        if default is not None:
-            try:
-                base.index(default)
-            except ValueError:
-                raise GrammarException('bad_enum_value', "bad enum value")
+        self.codec = enum_codec(base)
+        if default is not None and default not in self.codec.positions:
+            raise GrammarException('bad_enum_value', "bad enum value")
         self.default = default
 
+    @staticmethod
+    def wrong_type_error(name, elem):
+        msg = "In Enum " + trail_name(name) + "\n"
+        msg += "Enum expected a string, but received: " + str(elem)
+        return GrammarException('enum_wrong_type', msg)
+
+    def bad_value_error(self, name, elem):
+        msg = 'In Enum ' + trail_name(name) + '\n'
+        msg += 'The value ' + elem + 'is not found\n'
+        msg += 'Enums are ' + ', '.join(self.base)
+        return GrammarException('bad_enum_value', msg)
+
     # parse_enum parses an enum element
     # The result is significant if it is not default
     def parse(self, grammar, elem, name, context, list_pos, model):
         if not isinstance(elem, str):
-            msg = "In Enum " + name + "\n"
-            msg += "Enum expected a string, but received: " + str(elem)
-            raise GrammarException('enum_wrong_type', msg)
+            raise self.wrong_type_error(name, elem)
         # Make sure the elem is valid
-        try:
-            self.base.index(elem)
-        except ValueError:
-            msg = 'In Enum ' + name + '\n'
-            msg += 'The value ' + elem + 'is not found\n'
-            msg += 'Enums are ' + ', '.join(self.base)
-            raise GrammarException('bad_enum_value', msg)
+        if elem not in self.codec.positions:
+            raise self.bad_value_error(name, elem)
         if self.default is not None and elem == self.default:
             return None
         return elem
@@ -586,29 +1388,25 @@ class Enum(GrammarNode):
     # generate an enum
     # This doesn't handle default/value functions
     # I don't have a use case
+    # Without a model, or with the default, the result is the default (which is not significant)
     def gen(self, grammar, model, context, list_pos):
-        enum_value = None
-        if self.default is not None:
-            enum_value = self.default
-
-        result = None
-        variable_result = result
-        if model is None or isinstance(model, GrammarModel):
-            result = enum_value
-        else:
-            if model == enum_value:
-                result = enum_value
-            else:
-                variable_result = model
-                result = model
+        if model is None or isinstance(model, GrammarModel) or model == self.default:
+            if self.default is None:
+                raise GrammarException('enum_no_default', 'gen_enum resulted in None')
+            if grammar.minimal:
+                return None
+            return self.default
+        return model
 
-        if result is None:
-            raise GrammarException('enum_no_default', 'gen_enum resulted in None')
+    def template_source(self, source, depth):
+        if self.default is None:
+            return None
+        return source.literal(self.default)
 
-        if grammar.minimal:
-            return variable_result
-        else:
-            return result
+    def sample(self, sampler, context, list_pos):
+        if self.default is not None and not sampler.filled():
+            return self.default
+        return sampler.random.choice(self.base)
 
     def print(self, indent):
         result = ' ' * indent + 'Enum ' + self.name + ': ['
@@ -620,6 +1418,13 @@ class Enum(GrammarNode):
 
 
 class Atom(GrammarNode):
+    # Atoms are specialized on their value and default, so parse and gen don't decide between them on every call.
+    # Constructing an Atom picks the class once, see atom_class. Classes derived from Atom elsewhere are left alone
+    def __new__(cls, name=None, atom_type=None, default=None, value=None, **kwargs):
+        if cls is Atom:
+            cls = atom_class(default, value)
+        return super().__new__(cls)
+
     def __init__(self, name, atom_type, default=None, value=None, **kwargs):
         super().__init__(name, **kwargs)
         self.type = atom_type
@@ -628,6 +1433,22 @@ class Atom(GrammarNode):
         if self.default is not None and self.value is not None:
             raise GrammarException('both_value_default', 'Schema atom has more than 1 value, default set')
 
+    def wrong_type_error(self, name, elem):
+        message = 'In ' + trail_name(name) + ' expected ' + str(self.type) + ' atom but got ' + str(elem)
+        return GrammarException('atom_wrong_type', message)
+
+    # The value and default are plain attributes, an atom given a default after it was built with a value (or the
+    # other way around) is still reported when parsed
+    @staticmethod
+    def both_value_default_error():
+        return GrammarException('both_value_default', 'Schema atom has more than 1 value, skip and default')
+
+    @staticmethod
+    def wrong_value_error(name, elem, target_elem):
+        msg = "parse atom called with " + str(elem) + " not matching schema " + str(target_elem)
+        msg += " in " + trail_name(name)
+        return GrammarException('atom_wrong_value', msg)
+
     # parse_atom parses a number, string, or boolean
     # It is the same for complete and minimal grammars
     # Significant values differ from the default
@@ -635,10 +1456,9 @@ class Atom(GrammarNode):
     # not yet handled - we will throw an error when getting a config where features are used
     def parse(self, grammar, elem, name, context, list_pos, model):
         if not isinstance(elem, self.type):
-            message = 'In ' + name + ' expected ' + str(self.type) + ' atom but got ' + str(elem)
-            raise GrammarException('atom_wrong_type', message)
+            raise self.wrong_type_error(name, elem)
         if self.default is not None and self.value is not None:
-            raise GrammarException('both_value_default', 'Schema atom has more than 1 value, skip and default')
+            raise self.both_value_default_error()
         target = None
         value = False
         if self.default is not None:
@@ -653,9 +1473,7 @@ class Atom(GrammarNode):
 
         if elem != target_elem:
             if value:
-                msg = "parse atom called with " + str(elem) + " not matching schema " + str(target_elem)
-                msg += " in " + name
-                raise GrammarException('atom_wrong_value', msg)
+                raise self.wrong_value_error(name, elem, target_elem)
             result = elem
         else:
             result = None
@@ -704,6 +1522,19 @@ class Atom(GrammarNode):
         else:
             return result
 
+    # Atoms with a value always have it, the value and default functions are called with no element, as gen does
+    # A default that isn't of the atom type (an empty string for a number) isn't a valid element, so it isn't sampled
+    def sample(self, sampler, context, list_pos):
+        target = self.value
+        default = self.default
+        if target is None and (callable(default) or isinstance(default, self.type)) and not sampler.filled():
+            target = default
+        if target is None:
+            return sampler.atom(self)
+        if callable(target):
+            return target(None, context, list_pos)
+        return target
+
     def print(self, indent):
         result = " " * indent
         result += "Atom " + self.name
@@ -714,20 +1545,300 @@ class Atom(GrammarNode):
         return result
 
 
-# Value/Default atom functions, commonly used
-# identity just returns the position in the list, zero based
-def identity(_elem, _ctxt, lp):
-    return lp[-1]
+# The specialized atoms, see atom_class
+# They give the same results and raise the same exceptions as Atom.parse and Atom.gen
+# Their compiled parse and gen are the same again, with the attributes taken once: the atoms are most of the calls of
+# a parse or gen, and looking the attributes up on each call costs the compiled engine about 15% on a backup. An
+# atom given both a value and a default after it was built compiles to its parse and gen, which report it
+class ConstantAtom(Atom):
+    def parse(self, grammar, elem, name, context, list_pos, model):
+        if not isinstance(elem, self.type):
+            raise self.wrong_type_error(name, elem)
+        if self.default is not None:
+            raise self.both_value_default_error()
+        if elem != self.value:
+            raise self.wrong_value_error(name, elem, self.value)
+        return None
 
+    def gen(self, grammar, model, context, list_pos):
+        if model is None or isinstance(model, GrammarModel):
+            return self.value
+        if model != self.value:
+            raise GrammarException('model_schema_mismatch', "atom has wrong value in model and schema")
+        if grammar.minimal:
+            return None
+        return self.value
 
-# returns the 1 based position in the list
-def identity_plus_1(_elem, _ctxt, lp):
-    return lp[-1] + 1
+    def compile_parse(self, grammar):
+        if self.default is not None:
+            return super().compile_parse(grammar)
+        atom_type = self.type
+        value = self.value
+
+        def parse(elem, name, context, list_pos, model):
+            if not isinstance(elem, atom_type):
+                raise self.wrong_type_error(name, elem)
+            if elem != value:
+                raise self.wrong_value_error(name, elem, value)
+            return None
+        return parse
 
+    def compile_gen(self, grammar):
+        value = self.value
+        model_result = value
+        if grammar.minimal:
+            model_result = None
+
+        def gen(model, context, list_pos):
+            if model is None or isinstance(model, GrammarModel):
+                return value
+            if model != value:
+                raise GrammarException('model_schema_mismatch', "atom has wrong value in model and schema")
+            return model_result
+        return gen
+
+    def template_source(self, source, depth):
+        if not isinstance(self.value, self.type):
+            return None
+        return source.literal(self.value)
+
+
+class DefaultAtom(Atom):
+    def parse(self, grammar, elem, name, context, list_pos, model):
+        if not isinstance(elem, self.type):
+            raise self.wrong_type_error(name, elem)
+        if self.value is not None:
+            raise self.both_value_default_error()
+        if elem != self.default:
+            return elem
+        return None
+
+    def gen(self, grammar, model, context, list_pos):
+        if model is None or isinstance(model, GrammarModel) or model == self.default:
+            if grammar.minimal:
+                return None
+            return self.default
+        return model
+
+    def compile_parse(self, grammar):
+        if self.value is not None:
+            return super().compile_parse(grammar)
+        atom_type = self.type
+        default = self.default
+
+        def parse(elem, name, context, list_pos, model):
+            if not isinstance(elem, atom_type):
+                raise self.wrong_type_error(name, elem)
+            if elem != default:
+                return elem
+            return None
+        return parse
+
+    def compile_gen(self, grammar):
+        default = self.default
+        default_result = default
+        if grammar.minimal:
+            default_result = None
+
+        def gen(model, context, list_pos):
+            if model is None or isinstance(model, GrammarModel) or model == default:
+                return default_result
+            return model
+        return gen
+
+    def template_source(self, source, depth):
+        if not isinstance(self.default, self.type):
+            return None
+        return source.literal(self.default)
+
+
+# The value is the list position at position (-1 innermost) plus offset
+class PositionalAtom(Atom):
+    position_pure = False
+
+    def __init__(self, name, atom_type, default=None, value=None, **kwargs):
+        super().__init__(name, atom_type, default, value, **kwargs)
+        self.position, self.offset = positional_functions[value]
+
+    def parse(self, grammar, elem, name, context, list_pos, model):
+        if not isinstance(elem, self.type):
+            raise self.wrong_type_error(name, elem)
+        if self.default is not None:
+            raise self.both_value_default_error()
+        target_elem = list_pos[self.position] + self.offset
+        if elem != target_elem:
+            raise self.wrong_value_error(name, elem, target_elem)
+        return None
+
+    def gen(self, grammar, model, context, list_pos):
+        atom_value = list_pos[self.position] + self.offset
+        if model is None or isinstance(model, GrammarModel):
+            return atom_value
+        if model != atom_value:
+            raise GrammarException('model_schema_mismatch', "atom has wrong value in model and schema")
+        if grammar.minimal:
+            return None
+        return atom_value
+
+    def compile_parse(self, grammar):
+        if self.default is not None:
+            return super().compile_parse(grammar)
+        atom_type = self.type
+        position = self.position
+        offset = self.offset
+
+        def parse(elem, name, context, list_pos, model):
+            if not isinstance(elem, atom_type):
+                raise self.wrong_type_error(name, elem)
+            target_elem = list_pos[position] + offset
+            if elem != target_elem:
+                raise self.wrong_value_error(name, elem, target_elem)
+            return None
+        return parse
+
+    def compile_gen(self, grammar):
+        position = self.position
+        offset = self.offset
+        minimal = grammar.minimal
+
+        def gen(model, context, list_pos):
+            atom_value = list_pos[position] + offset
+            if model is None or isinstance(model, GrammarModel):
+                return atom_value
+            if model != atom_value:
+                raise GrammarException('model_schema_mismatch', "atom has wrong value in model and schema")
+            if minimal:
+                return None
+            return atom_value
+        return gen
+
+    def template_source(self, source, depth):
+        if not isinstance(0, self.type):
+            return None
+        position = source.template_position(self.position, depth)
+        if self.offset == 0:
+            return position
+        return '(' + position + ' + ' + repr(self.offset) + ')'
+
+
+# target is the value (required is True) or default function
+class CallableAtom(Atom):
+    position_pure = False
+
+    def __init__(self, name, atom_type, default=None, value=None, **kwargs):
+        super().__init__(name, atom_type, default, value, **kwargs)
+        self.required = value is not None
+        self.target = value if self.required else default
+
+    def parse(self, grammar, elem, name, context, list_pos, model):
+        if not isinstance(elem, self.type):
+            raise self.wrong_type_error(name, elem)
+        if self.default is not None and self.value is not None:
+            raise self.both_value_default_error()
+        target_elem = self.target(elem, context, list_pos)
+        if elem != target_elem:
+            if self.required:
+                raise self.wrong_value_error(name, elem, target_elem)
+            return elem
+        return None
+
+    def gen(self, grammar, model, context, list_pos):
+        if model is None or isinstance(model, GrammarModel):
+            atom_value = self.target(None, context, list_pos)
+            if grammar.minimal:
+                if self.required:
+                    return atom_value
+                return None
+            if atom_value is None:
+                raise GrammarException('programmer_error', 'gen_atom resulted in None')
+            return atom_value
+        atom_value = self.target(model, context, list_pos)
+        if model == atom_value:
+            if grammar.minimal:
+                return None
+            return atom_value
+        if self.required:
+            raise GrammarException('model_schema_mismatch', "atom has wrong value in model and schema")
+        return model
+
+    def compile_parse(self, grammar):
+        if self.default is not None and self.value is not None:
+            return super().compile_parse(grammar)
+        atom_type = self.type
+        target = self.target
+        required = self.required
+
+        def parse(elem, name, context, list_pos, model):
+            if not isinstance(elem, atom_type):
+                raise self.wrong_type_error(name, elem)
+            target_elem = target(elem, context, list_pos)
+            if elem != target_elem:
+                if required:
+                    raise self.wrong_value_error(name, elem, target_elem)
+                return elem
+            return None
+        return parse
+
+    def compile_gen(self, grammar):
+        target = self.target
+        required = self.required
+        minimal = grammar.minimal
+
+        def gen(model, context, list_pos):
+            if model is None or isinstance(model, GrammarModel):
+                atom_value = target(None, context, list_pos)
+                if minimal:
+                    if required:
+                        return atom_value
+                    return None
+                if atom_value is None:
+                    raise GrammarException('programmer_error', 'gen_atom resulted in None')
+                return atom_value
+            atom_value = target(model, context, list_pos)
+            if model == atom_value:
+                if minimal:
+                    return None
+                return atom_value
+            if required:
+                raise GrammarException('model_schema_mismatch', "atom has wrong value in model and schema")
+            return model
+        return gen
+
+
+# The class for an atom with the value and default:
+# ConstantAtom has a constant value, DefaultAtom a constant default, PositionalAtom a value that is a list
+# position (identity, identity_plus_1, identity2) and CallableAtom any other value or default function.
+# Atom itself handles the rest, an atom with neither a value nor a default, or with both (an error)
+def atom_class(default, value):
+    if (value is None) == (default is None):
+        return Atom
+    if callable(value) and value in positional_functions:
+        return PositionalAtom
+    if callable(value) or callable(default):
+        return CallableAtom
+    if value is not None:
+        return ConstantAtom
+    return DefaultAtom
+
+
+# Value/Default atom functions, commonly used
+# identity just returns the position in the list, zero based
+def identity(_elem, _ctxt, lp):
+    return lp[-1]
 
-# returns the position in the enclosing list
-def identity2(_elem, _ctxt, lp):
-    return lp[-2]
+
+# returns the 1 based position in the list
+def identity_plus_1(_elem, _ctxt, lp):
+    return lp[-1] + 1
+
+
+# returns the position in the enclosing list
+def identity2(_elem, _ctxt, lp):
+    return lp[-2]
+
+
+# The list position functions, as the position and offset used by PositionalAtom
+positional_functions = {identity: (-1, 0), identity_plus_1: (-1, 1), identity2: (-2, 0)}
 
 
 false_atom = Atom('False', bool, value=False)
@@ -738,6 +1849,11 @@ identity_atom = Atom('I', int, value=identity)
 identity2_atom = Atom('I2', int, value=identity2)
 
 
+# A sample function (see Grammar.sample) for unlimited lists, with up to length entries
+def sample_length(length, sampler, schema, _ctxt, lp):
+    return schema.sample_entries(sampler, length, lp)
+
+
 # Helper function to remove all None elements from the end of a list
 def prune_list(list_to_prune):
     while len(list_to_prune) > 0 and list_to_prune[len(list_to_prune) - 1] is None:
@@ -753,10 +1869,269 @@ def compact_list(list_to_compact):
             i += 1
 
 
+# The memo keys of elements, see Grammar.parse_memo
+# Equal elements have the same key: the key is a number standing for the structure of the element, which is its type
+# and the structures of its entries for dicts and lists, and its type and value for atoms. The types are kept, so 1,
+# True and '1' (as values or dict keys) have different keys.
+# The key of a dict or list is kept by the element's id, so the key of each element below it is built once, and a
+# YAML alias (the same object) is found without building its key again. The element is kept with its key, so its id
+# isn't reused while it is here.
+# An element that can't be hashed (holding an atom that can't be) gets a new key, so it only matches itself.
+class MemoKeys:
+    def __init__(self):
+        self.elements = {}
+        self.structures = {}
+        self.count = 0
+
+    def clear(self):
+        self.elements.clear()
+        self.structures.clear()
+
+    def key(self, elem):
+        elem_type = type(elem)
+        if elem_type is dict or elem_type is list:
+            return self.container_key(elem, elem_type)
+        return self.structure_key((elem_type, elem))
+
+    # The structure of an entry of a dict or list: the key of a dict or list, the type and value of an atom
+    def entry_structure(self, elem):
+        elem_type = type(elem)
+        if elem_type is dict or elem_type is list:
+            return self.container_key(elem, elem_type)
+        return elem_type, elem
+
+    def container_key(self, elem, elem_type):
+        entry = self.elements.get(id(elem))
+        if entry is not None and entry[0] is elem:
+            return entry[1]
+        entry_structure = self.entry_structure
+        if elem_type is dict:
+            structure = frozenset([(type(key), key, entry_structure(value)) for key, value in elem.items()])
+        else:
+            structure = tuple([entry_structure(value) for value in elem])
+        key = self.structure_key((elem_type, structure))
+        self.elements[id(elem)] = (elem, key)
+        return key
+
+    def structure_key(self, structure):
+        try:
+            key = self.structures.get(structure)
+        except TypeError:
+            self.count += 1
+            return self.count
+        if key is None:
+            self.count += 1
+            key = self.count
+            self.structures[structure] = key
+        return key
+
+
+# Parsing a default element gives None, which is passed to the cleanup of the node
+# Cleanups that return None for None can be marked with keeps_none, which lets the nodes above use default fingerprints
+def keeps_none(cleanup):
+    cleanup.keeps_none = True
+    return cleanup
+
+
+# A default fingerprint is the default element of a node (see Grammar.default_template), with holes for the
+# positions taken from list_pos. An element matches only if it is exactly the default element: unlike ==, the types
+# must be the same, so True, 1 and 1.0 are told apart and an element that would fail the type checks never matches.
+# The element is compared with the default as it is walked, and the walk stops at the first difference, which for
+# an element that isn't default is normally within the first few keys.
+class DefaultFingerprint:
+    def __init__(self, template):
+        self.default = template(FingerprintPositions())
+        self.depth = fingerprint_depth(self.default)
+
+    def matches(self, elem, list_pos):
+        if len(list_pos) < self.depth:
+            return False
+        return fingerprint_matches(self.default, elem, list_pos)
+
+
+def fingerprint_matches(default, elem, list_pos):
+    default_type = type(default)
+    if default_type is FingerprintPosition:
+        return type(elem) is int and elem == list_pos[default.position] + default.offset
+    if type(elem) is not default_type:
+        return False
+    if default_type is dict:
+        if len(elem) != len(default):
+            return False
+        for key, key_default in default.items():
+            if key not in elem or not fingerprint_matches(key_default, elem[key], list_pos):
+                return False
+        return True
+    if default_type is list:
+        if len(elem) != len(default):
+            return False
+        for entry_default, entry in zip(default, elem):
+            if not fingerprint_matches(entry_default, entry, list_pos):
+                return False
+        return True
+    return elem == default
+
+
+# The number of list positions the holes of a default element need
+def fingerprint_depth(default):
+    if isinstance(default, FingerprintPosition):
+        return -default.position
+    if isinstance(default, dict):
+        default = list(default.values())
+    if isinstance(default, list):
+        return max([fingerprint_depth(entry) for entry in default], default=0)
+    return 0
+
+
+# The list_pos the fingerprint template is built with, each position is a hole
+class FingerprintPosition:
+    def __init__(self, position, offset=0):
+        self.position = position
+        self.offset = offset
+
+    def __add__(self, offset):
+        return FingerprintPosition(self.position, self.offset + offset)
+
+
+class FingerprintPositions:
+    def __getitem__(self, position):
+        return FingerprintPosition(position)
+
+
+# The profile of the parses or gens of the nodes with one name, see Grammar.profile
+# cumulative is the time from the start to the end of the calls, self_time leaves out the nodes below
+# A node called again below itself (by name) only adds the outer call to cumulative
+# models is the number of models made for the node's model, the case models of switch dicts are left out
+class NodeProfile:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.cumulative = 0.0
+        self.self_time = 0.0
+        self.models = 0
+        self.active = 0
+
+    def clear(self):
+        self.calls = 0
+        self.cumulative = 0.0
+        self.self_time = 0.0
+        self.models = 0
+
+    def summary(self):
+        return {'name': self.name, 'calls': self.calls, 'cumulative': self.cumulative, 'self': self.self_time,
+                'models': self.models}
+
+
+class GrammarProfile:
+    def __init__(self):
+        self.nodes = {'parse': {}, 'gen': {}}
+        # The time spent in the nodes below each running call
+        self.child_times = []
+
+    def node(self, operation, schema):
+        nodes = self.nodes[operation]
+        if schema.name not in nodes:
+            nodes[schema.name] = NodeProfile(schema.name)
+        return nodes[schema.name]
+
+    def clear(self):
+        for nodes in self.nodes.values():
+            for node in nodes.values():
+                node.clear()
+
+    def finish(self, node, elapsed, child_time):
+        node.self_time += elapsed - child_time
+        node.active -= 1
+        if node.active == 0:
+            node.cumulative += elapsed
+
+    def call(self, node, function, *args):
+        node.calls += 1
+        node.active += 1
+        self.child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.finish(node, elapsed, self.child_times.pop())
+            if self.child_times:
+                self.child_times[-1] += elapsed
+
+    # Profiles the parse_steps or gen_steps of a node in the stack engine (see Grammar.stack_parse)
+    # The nodes the steps call directly add to their child time, the nodes they yield run while they wait
+    def steps(self, node, steps):
+        node.calls += 1
+        node.active += 1
+        child_time = 0.0
+        start = time.perf_counter()
+        try:
+            result = None
+            while True:
+                self.child_times.append(0.0)
+                try:
+                    request = steps.send(result)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    child_time += self.child_times.pop()
+                waiting = time.perf_counter()
+                result = yield request
+                child_time += time.perf_counter() - waiting
+        finally:
+            steps.close()
+            self.finish(node, time.perf_counter() - start, child_time)
+
+    # The nodes of each operation, by self time
+    def sorted_nodes(self, operation):
+        nodes = [node for node in self.nodes[operation].values() if node.calls > 0]
+        return sorted(nodes, key=lambda node: node.self_time, reverse=True)
+
+    def report(self, limit=None):
+        result = ''
+        for operation in ['parse', 'gen']:
+            nodes = self.sorted_nodes(operation)
+            if not nodes:
+                continue
+            result += '%-40s %10s %12s %12s %8s\n' % (operation.capitalize() + ' node', 'calls', 'cumulative', 'self',
+                                                     'models')
+            for node in nodes[:limit]:
+                result += '%-40s %10d %12.6f %12.6f %8d\n' % (node.name, node.calls, node.cumulative, node.self_time,
+                                                             node.models)
+        return result
+
+    def summary(self):
+        return {operation: [node.summary() for node in self.sorted_nodes(operation)] for operation in self.nodes}
+
+    def dump(self, filename):
+        with open(filename, "w") as write_file:
+            json.dump(self.summary(), write_file, indent=4)
+
+
 class Grammar:
-    def __init__(self, schema, minimal=False):
+    def __init__(self, schema, minimal=False, memoize=False, profile=False, workers=None):
         self.schema = schema
         self.minimal = minimal
+        self.memoize = memoize
+        # The number of worker processes for parallel lists, see parallel_list
+        self.workers = workers
+        self.worker_pools = {}
+        self.parse_memos = {}
+        self.memo_keys = MemoKeys()
+        self.pure_nodes = {}
+        # Set by compile
+        self.compiled_parse = None
+        self.compiled_gen = None
+        self.compiled_parse_nodes = {}
+        self.compiled_gen_nodes = {}
+        self.default_templates = {}
+        self.templates_keep_none = {}
+        self.default_fingerprints = {}
+        self.streamed_nodes = {}
+        self.profile = None
+        if profile:
+            self.profile = GrammarProfile()
+            self.profile_interpreter()
 
     # Parsing
     # Parson a JSON/YAML subexpression can store the result in 3 ways
@@ -776,7 +2151,7 @@ class Grammar:
     # Parsing an element
     # elem is the JSON/YAML element to be parsed
     # schema is the grammar node for the element
-    # name is a debugging name indicating where in the grammar we are
+    # name is a debugging name indicating where in the grammar we are (a trail, see trail_name)
     # context is the immediately enclosing dictionary or list object
     # list_pos is the list_pos documented above
     # model is the current model to be used for storing significant changes
@@ -793,33 +2168,223 @@ class Grammar:
         if not isinstance(schema, GrammarNode):
             raise GrammarException('bad_schema', "Schema should be a GrammarNode")
 
-        new_model = False
-        # This really belongs inside the 'if' where we create a new model
-        # But PyCharm complains then that old_model might be reffed before assignment below
-        old_model = model
-        if schema.model is not None:
-            model = schema.model()
-            new_model = True
+        # See parse_memo, each parse starts with empty memos
+        memo = None
+        key = None
+        if self.memoize:
+            if name == "":
+                self.clear_parse_memos()
+            memo = self.parse_memos.get(schema, False)
+            if memo is False:
+                memo = self.parse_memo(schema)
+            if memo is not None:
+                key = self.memo_keys.key(elem)
+        if name == "":
+            name = schema.name
+        else:
+            name = (name, ":" + schema.name)
+        if memo is not None and key in memo:
+            result = copy_result(memo[key])
+        else:
+            new_model = False
+            # This really belongs inside the 'if' where we create a new model
+            # But PyCharm complains then that old_model might be reffed before assignment below
+            old_model = model
+            if schema.model is not None:
+                model = schema.model()
+                new_model = True
+
+            result = schema.parse(self, elem, name, context, list_pos, model)
+
+            if new_model:
+                if result is not None:
+                    raise GrammarException('unconsumed', "Model was used, but some result not added")
+                if model.modified:
+                    result = model
+                model = old_model
+            if memo is not None:
+                memo[key] = result
+
+        if schema.cleanup is not None:
+            result = schema.cleanup(result, context, list_pos)
+
+        if schema.variable is not None and result is not None:
+            model.set_var(schema.variable, result, name)
+            result = None
+        return result
+
+    # Validating
+    # validate checks an element against the schema and raises the same exceptions as parse_config, but makes no
+    # models and results: it checks the types, values, enums, list lengths and keys, and doesn't run the cleanups or
+    # bind variables. The errors that come from the models (a result that isn't consumed by a model, a variable
+    # assigned twice) are only found by parse_config.
+    def validate(self, elem):
+        self.validate_elem(elem, self.schema, "", None, [])
+
+    # The same as parse for validate
+    # The model is always None, it is there so that the containers validate the nodes below them with the loops that
+    # parse them
+    def validate_elem(self, elem, schema, name, context, list_pos, model=None):
+        if schema is None:
+            raise GrammarException('no_schema', "Schema is None")
+        if not isinstance(schema, GrammarNode):
+            raise GrammarException('bad_schema', "Schema should be a GrammarNode")
 
         if name == "":
             name = schema.name
         else:
-            name = name + ":" + schema.name
-        result = schema.parse(self, elem, name, context, list_pos, model)
+            name = (name, ":" + schema.name)
+        schema.validate(self, elem, name, context, list_pos)
+
+    # Collecting errors
+    # parse_collect parses like parse_config, but doesn't stop at the first error: the error is recorded with the path
+    # of the element (as given to parse_path), the element is skipped (it parses to None) and the parse goes on.
+    # It returns the result and the list of (path, exception), in the order found, so a config with several mistakes
+    # is checked in one parse.
+    # An error is recorded for the innermost element raising it. The errors a container raises once its children
+    # are parsed (missing or undefined keys, a result not consumed by the model) skip the whole container.
+    # With memoize, an element repeated in the config has its errors recorded once, at the first path.
+    # It always runs the interpreter in the process (the compiled closures, explicit stack and list workers don't go
+    # through Grammar.parse for each element)
+    def parse_collect(self, elem):
+        errors = []
+        path = []
+        parse = self.parse
+        # parse is an instance attribute when profiling, see profile_interpreter
+        own_parse = 'parse' in vars(self)
+        workers = self.workers
+        self.workers = None
+
+        def collect_parse(sub_elem, schema, name, context, list_pos, model):
+            # Lists parse their entries with the list as the context, dictionaries their keys with the dictionary
+            # and the key trail as the name (see KeyTable)
+            step = None
+            if isinstance(context, list):
+                step = str(list_pos[-1])
+            elif isinstance(context, dict) and isinstance(name, tuple):
+                step = name[1][1:]
+            if step is not None:
+                path.append(step)
+            try:
+                return parse(sub_elem, schema, name, context, list_pos, model)
+            except GrammarException as e:
+                errors.append(('/'.join(path), e))
+                return None
+            finally:
+                if step is not None:
+                    path.pop()
+
+        self.parse = collect_parse
+        try:
+            result = collect_parse(elem, self.schema, "", None, [], None)
+        finally:
+            if own_parse:
+                self.parse = parse
+            else:
+                del self.parse
+            self.workers = workers
+            if self.memoize:
+                self.clear_parse_memos()
+        return result, errors
+
+    # Parsing a path
+    # parse_path parses only the element at the path, a string of dictionary keys and list positions separated by
+    # '/', such as 'data/bankArray/17'. The schema and element are followed down the path, the list positions are
+    # pushed on list_pos as parse would, and then the element is parsed.
+    # The result is what the node parses to before its variable is bound: its model, if it has one. A node without a
+    # model that binds variables in the enclosing model is parsed into a new enclosing model, which is the result.
+    # An entry of a list that is None is default, and the result is None.
+    def parse_path(self, elem, path):
+        schema = self.schema
+        name = ""
+        context = None
+        list_pos = []
+        model_class = None
+        default_entry = False
+        for step in [step for step in path.split('/') if step != '']:
+            if name == "":
+                name = schema.name
+            else:
+                name = (name, ":" + schema.name)
+            if schema.model is not None:
+                model_class = schema.model
+            default_entry = isinstance(schema, List)
+            schema, elem, context, name, model_class = schema.path_step(self, step, elem, name, list_pos,
+                                                                        model_class)
+        if default_entry and elem is None:
+            return None
 
-        if new_model:
+        if name == "":
+            name = schema.name
+        else:
+            name = (name, ":" + schema.name)
+        model = None
+        bound_model = None
+        if schema.model is not None:
+            model = schema.model()
+        elif self.binds_model(schema):
+            if model_class is None:
+                raise GrammarException('path_without_model', 'While parsing ' + trail_name(name) +
+                                       ' the node binds variables but there is no enclosing model')
+            bound_model = model_class()
+            model = bound_model
+
+        try:
+            result = schema.parse(self, elem, name, context, list_pos, model)
+        finally:
+            if self.memoize:
+                self.clear_parse_memos()
+
+        if schema.model is not None:
             if result is not None:
                 raise GrammarException('unconsumed', "Model was used, but some result not added")
             if model.modified:
                 result = model
-            model = old_model
-
         if schema.cleanup is not None:
             result = schema.cleanup(result, context, list_pos)
+        if bound_model is not None:
+            if result is not None:
+                raise GrammarException('unconsumed', "Model was used, but some result not added")
+            if bound_model.modified:
+                result = bound_model
+        return result
 
-        if schema.variable is not None and result is not None:
-            model.set_var(schema.variable, result, name)
-            result = None
+    # Genning a path
+    # gen_path is the reverse of parse_path: it gens the node at the path from model (what parse_path gives for the
+    # path) and puts the result in place in elem, an element genned earlier. The path gives the same list positions
+    # and context as genning the whole element, so the result is the same as gen_config with the new model, in the
+    # time it takes to gen the node.
+    # Only for complete grammars: minimal grammars leave out default elements, so a change at the path can change
+    # the containers above it.
+    # Returns the genned node, which replaces the old one in elem (unless the path is empty)
+    def gen_path(self, elem, path, model):
+        if self.minimal:
+            raise GrammarException('gen_path_minimal', 'gen_path needs a complete grammar')
+        schema = self.schema
+        name = ""
+        context = None
+        list_pos = []
+        step = None
+        for step in [step for step in path.split('/') if step != '']:
+            if name == "":
+                name = schema.name
+            else:
+                name = (name, ":" + schema.name)
+            schema, elem, context, name, _model_class = schema.path_step(self, step, elem, name, list_pos, None)
+
+        if schema.model is not None and not isinstance(model, schema.model):
+            model = None
+        template = None
+        if model is None and schema.has_template:
+            template = self.default_template(schema)
+        if template is not None:
+            result = template(list_pos)
+        else:
+            result = schema.gen(self, model, context, list_pos)
+        if isinstance(context, list):
+            context[int(step)] = result
+        elif context is not None:
+            context[step] = result
         return result
 
     # Generate a config JSON/YAML string from a model
@@ -837,6 +2402,10 @@ class Grammar:
     def gen(self, model, schema, context, list_pos):
         if schema is None:
             raise GrammarException('no_schema', "Schema is None")
+        if model is None and schema.has_template:
+            template = self.default_template(schema)
+            if template is not None:
+                return template(list_pos)
 
         # If the schema specifies a model, and if the current model is not an instance of this
         # then we need to not use the current model
@@ -854,26 +2423,1125 @@ class Grammar:
                 if not isinstance(model, GrammarModel):
                     raise GrammarException('variable_without_model',
                                            "In gen_elem, have a variable that isn't a model")
-                model_vars = vars(model)
-                if schema.variable not in model_vars.keys():
-                    raise GrammarException('variable_not_in_model',
-                                           'The variable ' + schema.variable + ' is not in the model ' +
-                                           model.model_name)
-                sub_model = model_vars[schema.variable]
+                if not model.has_var(schema.variable):
+                    raise self.variable_not_in_model_error(schema.variable, model)
+                sub_model = getattr(model, schema.variable)
 
         result = schema.gen(self, sub_model, context, list_pos)
         return result
 
+    # Memoized parsing (memoize=True)
+    # A node is pure if its parse only depends on the element: no atom below it has a value or default function (which
+    # see the context and list position) and no node has a cleanup.
+    # A node is self contained if its parse doesn't bind variables in the enclosing model: it has its own model, or
+    # nothing below it binds a variable.
+    # The parse results of the pure and self contained containers are memoized by the element's key (see MemoKeys),
+    # for the length of a parse: repeated elements, including YAML aliases, are parsed once, and the repeats get a
+    # copy of the result (see copy_result), so each place still has its own models.
+    # A container of atoms without a model (the data bytes of a message) is parsed as fast as its key is built, so it
+    # isn't memoized.
+    def parse_memo(self, schema):
+        if schema not in self.parse_memos:
+            memo = None
+            if schema.sub_schemas() and self.is_pure(schema):
+                if schema.model is not None or (self.has_containers(schema) and not self.binds_model(schema)):
+                    memo = {}
+            self.parse_memos[schema] = memo
+        return self.parse_memos[schema]
+
+    def is_pure(self, schema):
+        if schema not in self.pure_nodes:
+            pure = schema.cleanup is None and schema.position_pure
+            for sub_schema in schema.sub_schemas():
+                pure = pure and self.is_pure(sub_schema)
+            self.pure_nodes[schema] = pure
+        return self.pure_nodes[schema]
+
+    @staticmethod
+    def has_containers(schema):
+        return any([sub_schema.sub_schemas() for sub_schema in schema.sub_schemas()])
+
+    # If parsing the node binds a variable in the model it is given
+    @staticmethod
+    def binds_model(schema):
+        if isinstance(schema, SwitchDict) and schema.model_var is not None:
+            return True
+        for sub_schema in schema.sub_schemas():
+            if sub_schema.variable is not None:
+                return True
+            if sub_schema.model is None and Grammar.binds_model(sub_schema):
+                return True
+        return False
+
+    def clear_parse_memos(self):
+        for memo in self.parse_memos.values():
+            if memo is not None:
+                memo.clear()
+        self.memo_keys.clear()
+
+    # Parallel lists
+    # The entries of a List built with parallel=True are parsed and genned in worker processes when the grammar has
+    # workers: the entries are split in one run per worker, and the results are put back in order.
+    # Each worker compiles its own grammar for the entry schema (see ListWorker), so the entries must be independent
+    # (see independent_entries). Other lists, and the lists of a profiled grammar, are parsed and genned in the
+    # process, as are lists genned from a model that isn't a list.
+    # The entry schema, elements and models are pickled to the workers, and the results back.
+    # An error is raised as the first failing entry raises it without workers, with the same trail.
+    # The workers of a list are started on its first parallel parse or gen, and kept until close_workers.
+    # Fewer than parallel_min_entries entries (not counting the default ones) are parsed and genned in the process:
+    # starting the workers costs about as much as parsing 6 backup banks, and pickling a bank and its result most of
+    # what parsing it costs, so a few entries don't pay for the workers.
+    parallel_min_entries = 16
+
+    def parallel_list(self, schema):
+        if self.workers is None or self.profile is not None or not schema.parallel:
+            return False
+        return self.independent_entries(schema)
+
+    # The entries of a list are independent if they only depend on their element (or model) and list position: the
+    # entry is a container without a variable or cleanup, with its own model or binding nothing in the enclosing model
+    def independent_entries(self, schema):
+        entry = schema.schema
+        if not entry.sub_schemas() or entry.variable is not None or entry.cleanup is not None:
+            return False
+        return entry.model is not None or not self.binds_model(entry)
+
+    # The runs of entries, one per worker, as (start, end) positions
+    def list_chunks(self, length):
+        chunk_count = max(1, min(self.workers, length))
+        return [(length * chunk // chunk_count, length * (chunk + 1) // chunk_count) for chunk in range(chunk_count)]
+
+    # The worker pool for the entry schema, started on first use
+    def worker_pool(self, schema):
+        pool = self.worker_pools.get(schema)
+        if pool is None:
+            pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=ListWorker.start,
+                                                          initargs=(schema, self.minimal, self.memoize))
+            self.worker_pools[schema] = pool
+        return pool
+
+    # Stops the workers of all the parallel lists, they are started again if needed
+    def close_workers(self):
+        worker_pools = self.worker_pools
+        self.worker_pools = {}
+        for pool in worker_pools.values():
+            pool.shutdown()
+
+    # Calls the ListWorker function on each run of entries in the workers, returns the (list position, result) pairs
+    def run_workers(self, function, schema, entries, *args):
+        result = []
+        pool = self.worker_pool(schema)
+        futures = [pool.submit(function, entries[start:end], *args) for start, end in self.list_chunks(len(entries))]
+        for future in futures:
+            result += future.result()
+        return result
+
+    # Parses the (list position, element) entries of the list, returns the (list position, result) pairs
+    # The entries go to the workers if the list is parallel and they are enough, see parallel_min_entries. Otherwise
+    # they are parsed here with the function the grammar runs for the entry node (see node_parse), without the list as
+    # their context, as in the workers.
+    def parse_entries(self, schema, entries, name, list_pos):
+        if self.parallel_list(schema) and len(entries) >= self.parallel_min_entries:
+            return self.run_workers(ListWorker.parse, schema.schema, entries, name, list_pos)
+        entry_parse = self.node_parse(schema.schema)
+        result = []
+        list_pos = list_pos + [0]
+        for new_list_pos, list_elem in entries:
+            list_pos[-1] = new_list_pos
+            result.append((new_list_pos, entry_parse(list_elem, name, None, list_pos, None)))
+        return result
+
+    # Gens the (list position, model) entries of the list as parse_entries parses them
+    def gen_entries(self, schema, entries, list_pos):
+        if self.parallel_list(schema) and len(entries) >= self.parallel_min_entries:
+            return self.run_workers(ListWorker.gen, schema.schema, entries, list_pos)
+        entry_gen = self.node_gen(schema.schema)
+        result = []
+        list_pos = list_pos + [0]
+        for new_list_pos, sub_model in entries:
+            list_pos[-1] = new_list_pos
+            result.append((new_list_pos, entry_gen(sub_model, None, list_pos)))
+        return result
+
+    # Returns the parse results of the entries of elem
+    # The entries matching the default fingerprint parse to None here, only the others are sent to the workers
+    def parallel_parse(self, schema, elem, name, list_pos):
+        fingerprint = self.default_fingerprint(schema.schema)
+        entries = []
+        list_pos.append(0)
+        try:
+            for new_list_pos, list_elem in enumerate(elem):
+                list_pos[-1] = new_list_pos
+                if list_elem is not None and (fingerprint is None or not fingerprint.matches(list_elem, list_pos)):
+                    entries.append((new_list_pos, list_elem))
+        finally:
+            list_pos.pop()
+
+        result = [None] * len(elem)
+        for new_list_pos, entry_result in self.parse_entries(schema, entries, name, list_pos):
+            result[new_list_pos] = entry_result
+        return result
+
+    # Returns the gen results of the list_length entries of model (a list), before pruning
+    # The entries without a model are genned here (from their default template), only the others are sent to the
+    # workers
+    def parallel_gen(self, schema, model, list_pos, list_length):
+        result = [None] * list_length
+        entries = []
+        list_pos.append(0)
+        try:
+            for new_list_pos in range(list_length):
+                sub_model = None
+                if new_list_pos < len(model):
+                    sub_model = model[new_list_pos]
+                if sub_model is None:
+                    list_pos[-1] = new_list_pos
+                    result[new_list_pos] = self.gen(None, schema.schema, result, list_pos)
+                else:
+                    entries.append((new_list_pos, sub_model))
+        finally:
+            list_pos.pop()
+
+        for new_list_pos, entry_result in self.gen_entries(schema, entries, list_pos):
+            result[new_list_pos] = entry_result
+        return result
+
+    # The parse function the grammar runs for the node, with the arguments of a compiled parse closure: the compiled
+    # one for compiled grammars and the explicit stack, or the interpreter
+    def node_parse(self, schema):
+        if self.compiled_parse is not None:
+            return self.compile_parse(schema)
+
+        def parse(elem, name, context, list_pos, model):
+            return self.parse(elem, schema, name, context, list_pos, model)
+        return parse
+
+    # The gen function the grammar runs for the node, as node_parse
+    def node_gen(self, schema):
+        if self.compiled_gen is not None:
+            return self.compile_gen(schema)
+
+        def gen(model, context, list_pos):
+            return self.gen(model, schema, context, list_pos)
+        return gen
+
+    # Streaming gen
+    # gen_stream writes the JSON for a model to writer (a text file), as json.dump(..., indent=4) of gen_config would,
+    # without holding the whole element: the outermost lists with independent entries (see independent_entries) are
+    # genned and written an entry at a time, so only one of their entries (a bank of a backup) is held at once.
+    # The element around them is genned first, with a marker for each of these lists (see stream_gen), and encoded;
+    # the lists are written in place of the markers. An error while writing a list leaves the output written so far.
+    # Minimal grammars leave out the lists that gen to nothing, which is only known once all their entries are genned,
+    # so the whole element is genned first.
+    def gen_stream(self, model, writer):
+        for chunk in self.gen_chunks(model):
+            writer.write(chunk)
+
+    # The chunks written by gen_stream, in order
+    def gen_chunks(self, model):
+        if self.minimal:
+            yield from json.JSONEncoder(indent=4).iterencode(self.gen_config(model))
+            return
+        lists = []
+        elem = self.stream_gen(model, lists)
+        list_lengths = [schema.gen_length(self, list_model) for schema, list_model, _list_pos in lists]
+
+        text = json.dumps(elem, indent=4)
+        pieces = re.split(r'"\\u0000stream(\d+)\\u0000"', text)
+        yield pieces[0]
+        for pos in range(1, len(pieces), 2):
+            # The list starts on the line of its marker, its entries are indented one level more
+            indent = pieces[pos - 1][pieces[pos - 1].rfind('\n') + 1:]
+            indent = '\n' + indent[:len(indent) - len(indent.lstrip(' '))]
+            list_number = int(pieces[pos])
+            schema, list_model, list_pos = lists[list_number]
+            yield from self.stream_list(schema, list_model, list_pos, list_lengths[list_number], indent)
+            yield pieces[pos + 1]
+
+    # Gens the element for the model, with a marker for each streamed list, which is added to lists as the list
+    # schema, model and list position
+    def stream_gen(self, model, lists):
+        gen = self.gen
+        own_gen = 'gen' in vars(self)
+
+        def marker_gen(sub_model, schema, context, list_pos):
+            if schema is None or not self.streams_below(schema):
+                return gen(sub_model, schema, context, list_pos)
+            # The model of the node, as in Grammar.gen
+            node_model = sub_model
+            if schema.model is not None and not isinstance(sub_model, schema.model):
+                node_model = None
+            if schema.variable is not None and sub_model is not None:
+                if not isinstance(sub_model, GrammarModel):
+                    raise GrammarException('variable_without_model', "In gen_elem, have a variable that isn't a model")
+                if not sub_model.has_var(schema.variable):
+                    raise self.variable_not_in_model_error(schema.variable, sub_model)
+                node_model = getattr(sub_model, schema.variable)
+            if isinstance(schema, List) and self.independent_entries(schema):
+                lists.append((schema, node_model, list(list_pos)))
+                return '\0stream' + str(len(lists) - 1) + '\0'
+            # Not from the template, which would gen the lists
+            return schema.gen(self, node_model, context, list_pos)
+
+        self.gen = marker_gen
+        try:
+            return marker_gen(model, self.schema, None, [])
+        finally:
+            if own_gen:
+                self.gen = gen
+            else:
+                del self.gen
+
+    # If the node is, or is above, a list with independent entries
+    def streams_below(self, schema):
+        if schema not in self.streamed_nodes:
+            self.streamed_nodes[schema] = ((isinstance(schema, List) and self.independent_entries(schema)) or
+                                           any([self.streams_below(sub_schema) for sub_schema in schema.sub_schemas()]))
+        return self.streamed_nodes[schema]
+
+    # The chunks of a streamed list, as json.dump writes it on a line starting with indent
+    # The entries are genned by gen_entries, one at a time, or parallel_min_entries at a time for the parallel lists
+    # of a model list, so that they go to the workers
+    def stream_list(self, schema, model, list_pos, list_length, indent):
+        if list_length == 0:
+            yield '[]'
+            return
+        entry_indent = indent + ' ' * 4
+        is_list = isinstance(model, list)
+        batch_size = 1
+        if is_list and self.parallel_list(schema):
+            batch_size = self.parallel_min_entries
+        separator = '['
+        for batch_start in range(0, list_length, batch_size):
+            entries = []
+            for new_list_pos in range(batch_start, min(batch_start + batch_size, list_length)):
+                sub_model = model
+                if is_list:
+                    sub_model = None
+                    if new_list_pos < len(model):
+                        sub_model = model[new_list_pos]
+                entries.append((new_list_pos, sub_model))
+            for _new_list_pos, entry in self.gen_entries(schema, entries, list_pos):
+                yield separator + entry_indent + json.dumps(entry, indent=4).replace('\n', entry_indent)
+                separator = ','
+        yield indent + ']'
+
+    # Parsing from events
+    # parse_events parses a JSON document read by a JsonEvents pull parser, as parse_config parses the loaded
+    # document, without loading it whole: the events are followed down the dictionaries and lists to the outermost
+    # lists with independent entries (see independent_entries), whose entries are loaded and parsed one at a time, so
+    # only one of them (a bank of a backup) is loaded at once. The other elements are loaded whole (see
+    # JsonEvents.value), and the document is parsed as usual, with the parsed entries in place of the lists
+    # (ParsedEntries).
+    # The entries are parsed as they are read, so an error in an entry is raised before the errors parse_config would
+    # find first in the document around the list.
+    def parse_events(self, events):
+        # The memo keys are the elements, not the parsed entries
+        memoize = self.memoize
+        self.memoize = False
+        try:
+            elem = self.load_events(events, self.schema, "", [])
+            if events.peek() is not None:
+                raise events.error('Extra data')
+            return self.parse(elem, self.schema, "", None, [], None)
+        finally:
+            self.memoize = memoize
+            if memoize:
+                self.clear_parse_memos()
+
+    # Loads the element for the node from events, with the lists below it parsed, name and list_pos as for parse
+    def load_events(self, events, schema, name, list_pos):
+        if not isinstance(schema, (Dict, List)) or not self.streams_below(schema):
+            return events.value()
+        if name == "":
+            name = schema.name
+        else:
+            name = (name, ":" + schema.name)
+        event = events.peek()
+        if isinstance(schema, List) and event == 'start_array':
+            events.next_event()
+            if self.independent_entries(schema):
+                result = self.load_entries(events, schema, name, list_pos)
+            else:
+                result = []
+                list_pos.append(0)
+                try:
+                    while events.peek() != 'end_array':
+                        list_pos[-1] = len(result)
+                        result.append(self.load_events(events, schema.schema, name, list_pos))
+                finally:
+                    list_pos.pop()
+            events.next_event()
+            return result
+        if isinstance(schema, Dict) and event == 'start_map' and not schema.key_table.duplicates:
+            events.next_event()
+            result = {}
+            while events.peek() != 'end_map':
+                key_name = events.next_event()[1]
+                if key_name in schema.key_table.index:
+                    key_schema = schema.key_table.index[key_name]['schema']
+                    result[key_name] = self.load_events(events, key_schema, (name, ':' + key_name), list_pos)
+                else:
+                    result[key_name] = events.value()
+            events.next_event()
+            return result
+        return events.value()
+
+    # Loads and parses the entries of a list with independent entries from events, as parallel_parse does: the
+    # entries matching the default fingerprint parse to None, the others are parsed by parse_entries, one at a time,
+    # or parallel_min_entries at a time for parallel lists, so that they go to the workers
+    def load_entries(self, events, schema, name, list_pos):
+        fingerprint = self.default_fingerprint(schema.schema)
+        batch_size = 1
+        if self.parallel_list(schema):
+            batch_size = self.parallel_min_entries
+        result = ParsedEntries()
+        entries = []
+        entry_list_pos = list_pos + [0]
+        while events.peek() != 'end_array':
+            entry_list_pos[-1] = len(result)
+            list_elem = events.value()
+            result.append(None)
+            if list_elem is None or (fingerprint is not None and fingerprint.matches(list_elem, entry_list_pos)):
+                continue
+            entries.append((entry_list_pos[-1], list_elem))
+            if len(entries) == batch_size:
+                for new_list_pos, entry_result in self.parse_entries(schema, entries, name, list_pos):
+                    result[new_list_pos] = entry_result
+                entries = []
+        for new_list_pos, entry_result in self.parse_entries(schema, entries, name, list_pos):
+            result[new_list_pos] = entry_result
+        return result
+
+    # Sampling
+    # sample returns a random element for the schema that parse_config accepts, for load testing. density (0 to 1) is
+    # the fraction of the elements that are filled rather than left as their default: the entries of complete lists
+    # (the banks, presets and messages of a backup), the optional keys of minimal grammars, the atoms and enums, and the
+    # cases of switch dicts. The same seed samples the same element.
+    # functions maps nodes to the sample functions that sample their elements, for the values the schema can't express,
+    # such as the MIDI channels or the message types of a backup. A sample function is called as
+    # function(sampler, schema, context, list_pos) and returns the element in place of the node's own sample
+    def sample(self, seed, density, functions=None):
+        if not 0 <= density <= 1:
+            raise GrammarException('bad_density', 'The sample density ' + str(density) + ' is not between 0 and 1')
+        return GrammarSampler(self, seed, density, functions).sample(self.schema, None, [])
+
+    # Default templates
+    # Without a model, a complete grammar gens the same structure for a node every time: only the atoms taking
+    # their value from the list position (PositionalAtom) change. The template for a node is a function of list_pos
+    # that builds that structure in one go, sharing the constant leaves, and is built once per node.
+    # Nodes that gen with callable atoms, have no default or have a switch model have no template, nor do minimal
+    # grammars (where the structure without a model is mostly None anyway).
+    # The template gives the same result as gen, with new dicts and lists each time
+    def default_template(self, schema):
+        if schema not in self.default_templates:
+            self.build_default_template(schema)
+        return self.default_templates[schema]
+
+    # Default fingerprints
+    # Parsing the default element of a node (its template) gives None, see DefaultFingerprint
+    # The nodes below must all parse to None too, so a node with a cleanup below it only has a fingerprint if the
+    # cleanup keeps None (see keeps_none)
+    # Only the entries of lists are checked against their fingerprint (the default banks, presets and messages of a
+    # backup), which skips the entry altogether: it parses to None, and its cleanup keeps None. Checking every node
+    # would compare each element again for every container above it.
+    def default_fingerprint(self, schema):
+        if schema not in self.default_fingerprints:
+            if schema not in self.default_templates:
+                self.build_default_template(schema)
+            fingerprint = None
+            template = self.default_templates[schema]
+            if template is not None and schema.has_fingerprint and self.templates_keep_none[schema]:
+                fingerprint = DefaultFingerprint(template)
+            self.default_fingerprints[schema] = fingerprint
+        return self.default_fingerprints[schema]
+
+    # templates_keep_none is True if all the cleanups below the node keep None
+    def build_default_template(self, schema):
+        template = None
+        keep_none = False
+        if not self.minimal:
+            source = TemplateSource(self)
+            expression = schema.template_source(source, 0)
+            if expression is not None:
+                template = eval('lambda list_pos: ' + expression, source.bindings())
+                keep_none = all([getattr(cleanup, 'keeps_none', False) for cleanup in source.template_cleanups])
+        self.default_templates[schema] = template
+        self.templates_keep_none[schema] = keep_none
+
+    # Compiling
+    # parse and gen interpret the schema: every call on every node re-checks the schema type, the model, variable and
+    # cleanup bindings, the grammar mode, which keys are required, and whether values/defaults are functions.
+    # None of that changes once the schema is built, so compile walks the schema once and builds a tree of closures
+    # with those decisions already made. Each node compiles itself (compile_parse/compile_gen), and the grammar
+    # wraps it with the model/variable/cleanup handling from parse/gen.
+    # Nodes are compiled once per grammar, shared nodes (zero_atom etc.) share their closures.
+    # The compiled closures give the same results and raise the same exceptions as parse and gen.
+    # Once compiled, parse_config and gen_config use the closures.
+    #
+    # A compiled parse closure takes (elem, name, context, list_pos, model), a compiled gen closure takes
+    # (model, context, list_pos), the same as parse and gen without the schema
+    def compile(self):
+        self.compiled_parse_nodes = {}
+        self.compiled_gen_nodes = {}
+        self.compiled_parse = self.compile_parse(self.schema)
+        self.compiled_gen = self.compile_gen(self.schema)
+        return self
+
+    # The compiled equivalent of parse for one schema node
+    def compile_parse(self, schema):
+        if schema is None:
+            raise GrammarException('no_schema', "Schema is None")
+        if not isinstance(schema, GrammarNode):
+            raise GrammarException('bad_schema', "Schema should be a GrammarNode")
+        if schema in self.compiled_parse_nodes:
+            return self.compiled_parse_nodes[schema]
+
+        node_parse = schema.compile_parse(self)
+        schema_name = schema.name
+        schema_trail = ':' + schema.name
+        schema_model = schema.model
+        cleanup = schema.cleanup
+        variable = schema.variable
+        memo = None
+        if self.memoize:
+            memo = self.parse_memo(schema)
+        memo_key = self.memo_keys.key
+
+        if memo is not None:
+            # Pure nodes have no cleanup
+            def parse(elem, name, context, list_pos, model):
+                if name == "":
+                    name = schema_name
+                else:
+                    name = (name, schema_trail)
+                key = memo_key(elem)
+                if key in memo:
+                    result = copy_result(memo[key])
+                else:
+                    if schema_model is not None:
+                        new_model = schema_model()
+                        result = node_parse(elem, name, context, list_pos, new_model)
+                        if result is not None:
+                            raise GrammarException('unconsumed', "Model was used, but some result not added")
+                        if new_model.modified:
+                            result = new_model
+                    else:
+                        result = node_parse(elem, name, context, list_pos, model)
+                    memo[key] = result
+                if variable is not None and result is not None:
+                    model.set_var(variable, result, name)
+                    result = None
+                return result
+        elif schema_model is None and cleanup is None and variable is None:
+            def parse(elem, name, context, list_pos, model):
+                if name == "":
+                    name = schema_name
+                else:
+                    name = (name, schema_trail)
+                return node_parse(elem, name, context, list_pos, model)
+        elif schema_model is None and cleanup is None:
+            def parse(elem, name, context, list_pos, model):
+                if name == "":
+                    name = schema_name
+                else:
+                    name = (name, schema_trail)
+                result = node_parse(elem, name, context, list_pos, model)
+                if result is not None:
+                    model.set_var(variable, result, name)
+                return None
+        else:
+            def parse(elem, name, context, list_pos, model):
+                if name == "":
+                    name = schema_name
+                else:
+                    name = (name, schema_trail)
+                if schema_model is not None:
+                    new_model = schema_model()
+                    result = node_parse(elem, name, context, list_pos, new_model)
+                    if result is not None:
+                        raise GrammarException('unconsumed', "Model was used, but some result not added")
+                    if new_model.modified:
+                        result = new_model
+                else:
+                    result = node_parse(elem, name, context, list_pos, model)
+                if cleanup is not None:
+                    result = cleanup(result, context, list_pos)
+                if variable is not None and result is not None:
+                    model.set_var(variable, result, name)
+                    result = None
+                return result
+
+        if self.profile is not None:
+            parse = self.profile_parse(schema, parse)
+        self.compiled_parse_nodes[schema] = parse
+        return parse
+
+    # The compiled equivalent of gen for one schema node
+    def compile_gen(self, schema):
+        if schema is None:
+            raise GrammarException('no_schema', "Schema is None")
+        if schema in self.compiled_gen_nodes:
+            return self.compiled_gen_nodes[schema]
+
+        node_gen = schema.compile_gen(self)
+        schema_model = schema.model
+        variable = schema.variable
+
+        if schema.has_template and self.default_template(schema) is not None:
+            node_gen = self.template_gen(self.default_template(schema), node_gen)
+
+        if schema_model is None and variable is None:
+            gen = node_gen
+        elif variable is None:
+            def gen(model, context, list_pos):
+                if not isinstance(model, schema_model):
+                    model = None
+                return node_gen(model, context, list_pos)
+        else:
+            get_variable = operator.attrgetter(variable)
+
+            def gen(model, context, list_pos):
+                sub_model = model
+                if schema_model is not None and not isinstance(model, schema_model):
+                    sub_model = None
+                if model is not None:
+                    if not isinstance(model, GrammarModel):
+                        raise GrammarException('variable_without_model',
+                                               "In gen_elem, have a variable that isn't a model")
+                    if not model.has_var(variable):
+                        raise self.variable_not_in_model_error(variable, model)
+                    sub_model = get_variable(model)
+                return node_gen(sub_model, context, list_pos)
+
+        if self.profile is not None:
+            gen = self.profile_gen(schema, gen)
+        self.compiled_gen_nodes[schema] = gen
+        return gen
+
+    # The model is only ever None below the variable and model handling, which pass None on
+    @staticmethod
+    def template_gen(template, node_gen):
+        def gen(model, context, list_pos):
+            if model is None:
+                return template(list_pos)
+            return node_gen(model, context, list_pos)
+        return gen
+
+    # Explicit stack engine
+    # parse and gen recurse, with several Python frames for each level of the element, so deep elements hit the
+    # Python recursion limit. stack_parse and stack_gen don't recurse: the containers parse and gen with generators
+    # (parse_steps/gen_steps on the nodes), which yield the arguments of parse or gen for each child container and are
+    # sent back its result; the other nodes are parsed and genned directly by parse and gen. run_steps keeps the
+    # generators waiting on a child in a list (with parse_steps/gen_steps on the grammar for the model, variable and
+    # cleanup handling), so the depth of an element is only limited by memory.
+    # The generators cost more than the recursion, so the interpreter keeps its own parse and gen; the steps share
+    # the key tables, case plans and checks with them, and give the same results and raise the same exceptions.
+    # use_stack makes parse_config and gen_config use it
+    def use_stack(self):
+        schema = self.schema
+
+        def parse(elem, name, context, list_pos, model):
+            return self.stack_parse(elem, schema, name, context, list_pos, model)
+
+        def gen(model, context, list_pos):
+            return self.stack_gen(model, schema, context, list_pos)
+
+        self.compiled_parse = parse
+        self.compiled_gen = gen
+        return self
+
+    def stack_parse(self, elem, schema, name, context, list_pos, model):
+        return self.run_steps((elem, schema, name, context, list_pos, model), self.parse, self.parse_steps)
+
+    def stack_gen(self, model, schema, context, list_pos):
+        return self.run_steps((model, schema, context, list_pos), self.gen, self.gen_steps)
+
+    # request holds the arguments for node_call (parse or gen), the schema is the second
+    # The last generator on the stack is the one running, the others are each waiting on the result of the next
+    @staticmethod
+    def run_steps(request, node_call, node_steps):
+        stack = []
+        try:
+            while True:
+                if getattr(request[1], 'has_steps', False):
+                    stack.append(node_steps(*request))
+                    result = None
+                else:
+                    result = node_call(*request)
+                request = None
+                while request is None:
+                    if not stack:
+                        return result
+                    try:
+                        request = stack[-1].send(result)
+                    except StopIteration as stop:
+                        stack.pop()
+                        result = stop.value
+        except BaseException:
+            # Closing the generators, innermost first, runs their finally blocks as the exception would have
+            while stack:
+                stack.pop().close()
+            raise
+
+    # The same as parse, for the containers
+    def parse_steps(self, elem, schema, name, context, list_pos, model):
+        memo = None
+        key = None
+        if self.memoize:
+            if name == "":
+                self.clear_parse_memos()
+            memo = self.parse_memos.get(schema, False)
+            if memo is False:
+                memo = self.parse_memo(schema)
+            if memo is not None:
+                key = self.memo_keys.key(elem)
+        if name == "":
+            name = schema.name
+        else:
+            name = (name, ":" + schema.name)
+        if memo is not None and key in memo:
+            result = copy_result(memo[key])
+        else:
+            new_model = False
+            old_model = model
+            if schema.model is not None:
+                model = schema.model()
+                new_model = True
+
+            result = yield from schema.parse_steps(self, elem, name, context, list_pos, model)
+
+            if new_model:
+                if result is not None:
+                    raise GrammarException('unconsumed', "Model was used, but some result not added")
+                if model.modified:
+                    result = model
+                model = old_model
+            if memo is not None:
+                memo[key] = result
+
+        if schema.cleanup is not None:
+            result = schema.cleanup(result, context, list_pos)
+
+        if schema.variable is not None and result is not None:
+            model.set_var(schema.variable, result, name)
+            result = None
+        return result
+
+    # The same as gen, for the containers
+    def gen_steps(self, model, schema, context, list_pos):
+        if model is None and schema.has_template:
+            template = self.default_template(schema)
+            if template is not None:
+                return template(list_pos)
+
+        if schema.model is not None and not isinstance(model, schema.model):
+            sub_model = None
+        else:
+            sub_model = model
+
+        if schema.variable is not None:
+            if model is not None:
+                if not isinstance(model, GrammarModel):
+                    raise GrammarException('variable_without_model',
+                                           "In gen_elem, have a variable that isn't a model")
+                if not model.has_var(schema.variable):
+                    raise self.variable_not_in_model_error(schema.variable, model)
+                sub_model = getattr(model, schema.variable)
+
+        return (yield from schema.gen_steps(self, sub_model, context, list_pos))
+
+    # Profiling (profile=True)
+    # The profile (a GrammarProfile) records the calls, times and models of the parse and gen of each node, by the
+    # node name, until it is cleared. report gives a table sorted by self time, dump writes the same as JSON.
+    # Each engine is wrapped as the grammar is made or compiled: the interpreter's parse and gen (and the stack
+    # engine's steps) are replaced on the grammar object, the compiled closures are wrapped. Without profile nothing
+    # is wrapped, and the engines run as they would otherwise.
+    def profile_interpreter(self):
+        profile = self.profile
+        parse = self.parse
+        gen = self.gen
+        parse_steps = self.parse_steps
+        gen_steps = self.gen_steps
+
+        def profiled_parse(elem, schema, name, context, list_pos, model):
+            if not isinstance(schema, GrammarNode):
+                return parse(elem, schema, name, context, list_pos, model)
+            node = profile.node('parse', schema)
+            self.count_model(node, schema, elem)
+            return profile.call(node, parse, elem, schema, name, context, list_pos, model)
+
+        def profiled_gen(model, schema, context, list_pos):
+            if not isinstance(schema, GrammarNode):
+                return gen(model, schema, context, list_pos)
+            return profile.call(profile.node('gen', schema), gen, model, schema, context, list_pos)
+
+        def profiled_parse_steps(elem, schema, name, context, list_pos, model):
+            node = profile.node('parse', schema)
+            self.count_model(node, schema, elem)
+            return profile.steps(node, parse_steps(elem, schema, name, context, list_pos, model))
+
+        def profiled_gen_steps(model, schema, context, list_pos):
+            return profile.steps(profile.node('gen', schema), gen_steps(model, schema, context, list_pos))
+
+        self.parse = profiled_parse
+        self.gen = profiled_gen
+        self.parse_steps = profiled_parse_steps
+        self.gen_steps = profiled_gen_steps
+
+    def profile_parse(self, schema, parse):
+        profile = self.profile
+        node = profile.node('parse', schema)
+
+        def profiled_parse(elem, name, context, list_pos, model):
+            self.count_model(node, schema, elem)
+            return profile.call(node, parse, elem, name, context, list_pos, model)
+        return profiled_parse
+
+    def profile_gen(self, schema, gen):
+        profile = self.profile
+        node = profile.node('gen', schema)
+
+        def profiled_gen(model, context, list_pos):
+            return profile.call(node, gen, model, context, list_pos)
+        return profiled_gen
+
+    # A node with a model makes one for each parse, unless the result comes from the parse memo
+    def count_model(self, node, schema, elem):
+        if schema.model is None:
+            return
+        memo = None
+        if self.memoize:
+            memo = self.parse_memo(schema)
+        if memo is not None and self.memo_keys.key(elem) in memo:
+            return
+        node.models += 1
+
+    @staticmethod
+    def variable_not_in_model_error(variable, model):
+        return GrammarException('variable_not_in_model',
+                                'The variable ' + variable + ' is not in the model ' + model.model_name)
+
     def print(self, indent=0):
         return self.schema.print(indent)
 
     def parse_config(self, elem):
-        return self.parse(elem, self.schema, "", None, [], None)
+        try:
+            if self.compiled_parse is not None:
+                return self.compiled_parse(elem, "", None, [], None)
+            return self.parse(elem, self.schema, "", None, [], None)
+        finally:
+            if self.memoize:
+                self.clear_parse_memos()
 
     def gen_config(self, model):
+        if self.compiled_gen is not None:
+            return self.compiled_gen(model, None, [])
         return self.gen(model, self.schema, None, [])
 
 
+# The worker process side of parallel lists, see Grammar.parallel_list
+# Each worker compiles a grammar for the entry schema once, and parses or gens runs of entries with it as List.parse
+# and List.gen do
+class ListWorker:
+    grammar = None
+
+    @staticmethod
+    def start(schema, minimal, memoize):
+        ListWorker.grammar = Grammar(schema, minimal, memoize).compile()
+
+    # entries are (list position, element or model) pairs, the results (list position, result) pairs
+    # The entries don't see the list (their context is None), see Grammar.parallel_list
+    @staticmethod
+    def parse(entries, name, list_pos):
+        grammar = ListWorker.grammar
+        result = []
+        list_pos = list_pos + [0]
+        try:
+            for new_list_pos, list_elem in entries:
+                list_pos[-1] = new_list_pos
+                result.append((new_list_pos, grammar.compiled_parse(list_elem, name, None, list_pos, None)))
+        finally:
+            if grammar.memoize:
+                grammar.clear_parse_memos()
+        return result
+
+    @staticmethod
+    def gen(entries, list_pos):
+        grammar = ListWorker.grammar
+        list_pos = list_pos + [0]
+        result = []
+        for new_list_pos, sub_model in entries:
+            list_pos[-1] = new_list_pos
+            result.append((new_list_pos, grammar.compiled_gen(sub_model, None, list_pos)))
+        return result
+
+
+# The Python expression of a default template, see Grammar.default_template
+# Each node writes its part of the expression (template_source), constants are written as literals and the other
+# objects the expression refers to are named _r<n>, and bound when it is evaluated (bindings)
+class TemplateSource:
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.refs = []
+        self.ref_names = {}
+        self.template_cleanups = []
+
+    def ref(self, obj):
+        if id(obj) not in self.ref_names:
+            self.ref_names[id(obj)] = '_r' + str(len(self.refs))
+            self.refs.append(obj)
+        return self.ref_names[id(obj)]
+
+    # Simple constants are written into the source
+    def literal(self, value):
+        if value is None or type(value) in [bool, int, str]:
+            return repr(value)
+        return self.ref(value)
+
+    @staticmethod
+    def is_literal(expression):
+        return expression in ['None', 'True', 'False'] or expression[0] in '\'"-0123456789'
+
+    # Inside the template, the positions of the template lists are the comprehension variables i<depth>, the outer
+    # positions come from list_pos
+    @staticmethod
+    def template_position(position, depth):
+        if -position <= depth:
+            return 'i' + str(depth + position)
+        return 'list_pos[' + str(position + depth) + ']'
+
+    # The cleanups below the template node are recorded, see Grammar.default_fingerprint
+    def template_source(self, schema, depth):
+        if schema.cleanup is not None:
+            self.template_cleanups.append(schema.cleanup)
+        return schema.template_source(self, depth)
+
+    def template_dict(self, items, keys, depth):
+        for key in keys:
+            value = self.template_source(key['schema'], depth)
+            if value is None:
+                return None
+            items = items + [(key['name'], value)]
+        return '{' + ', '.join([repr(key_name) + ': ' + value for key_name, value in items]) + '}'
+
+    # The names the expression needs to run
+    def bindings(self):
+        return {'_r' + str(pos): obj for pos, obj in enumerate(self.refs)}
+
+
+# The parse results of the entries of a list, parsed as the list is read (see Grammar.parse_events), in place of the
+# list
+class ParsedEntries(list):
+    pass
+
+
+# A pull parser for JSON, reading the file a chunk at a time (see Grammar.parse_events)
+# next_event returns the next event: ('start_map', None), ('key', name), ('end_map', None), ('start_array', None),
+# ('end_array', None), or ('value', value) for strings, numbers, booleans and null, and None at the end of the text.
+# peek returns the name of the next event, without reading it. value reads the next element whole, with the json
+# decoder, in place of its events.
+# The separators are checked as json.load checks them: a ':' after each key, a ',' or the end of the container after
+# each element, and no ',' before the end of a container.
+# state is what comes next: an element ('element'), the ':' after a key ('colon'), the ',' or the end of the
+# container after an element ('separator'), or an element after a ',' ('entry')
+# Errors are raised as json.JSONDecodeError, as json.load raises them, with the position in the whole text
+class JsonEvents:
+    chunk_size = 65536
+    whitespace = re.compile(r'[ \t\n\r]*')
+    container_events = {'{': 'start_map', '}': 'end_map', '[': 'start_array', ']': 'end_array'}
+
+    def __init__(self, read_file):
+        self.read_file = read_file
+        self.text = ''
+        self.pos = 0
+        self.end_of_file = False
+        self.decoder = json.JSONDecoder()
+        # For each open container, if it is a map
+        self.in_map = []
+        self.expect_key = False
+        self.state = 'element'
+        # The text dropped before self.text: its length, its lines and the length of its last line
+        self.offset = 0
+        self.lines = 0
+        self.column = 0
+
+    # The error at pos in self.text, with the position, line and column in the whole text
+    def error(self, msg, pos=None):
+        if pos is None:
+            pos = self.pos
+        line_start = self.text.rfind('\n', 0, pos)
+        if line_start < 0:
+            colno = self.column + pos + 1
+        else:
+            colno = pos - line_start
+        lineno = self.lines + self.text.count('\n', 0, pos) + 1
+        error = json.JSONDecodeError(msg, self.text, pos)
+        error.pos = self.offset + pos
+        error.lineno = lineno
+        error.colno = colno
+        error.args = ('%s: line %d column %d (char %d)' % (msg, lineno, colno, error.pos),)
+        return error
+
+    # Reads more text, dropping the text already parsed
+    def read(self, size):
+        text = self.read_file.read(size)
+        if text == '':
+            self.end_of_file = True
+        dropped = self.text[:self.pos]
+        self.offset += len(dropped)
+        line_start = dropped.rfind('\n')
+        if line_start < 0:
+            self.column += len(dropped)
+        else:
+            self.lines += dropped.count('\n')
+            self.column = len(dropped) - line_start - 1
+        self.text = self.text[self.pos:] + text
+        self.pos = 0
+
+    # Skips the whitespace, returns the next character ('' at the end of the text)
+    def skip(self):
+        while True:
+            self.pos = self.whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or self.end_of_file:
+                return self.text[self.pos:self.pos + 1]
+            self.read(self.chunk_size)
+
+    # Reads the separator before the next event, returns the event's first character
+    def separator(self):
+        char = self.skip()
+        if self.state == 'colon':
+            if char != ':':
+                raise self.error("Expecting ':' delimiter")
+            self.pos += 1
+            self.state = 'element'
+            char = self.skip()
+        elif self.state == 'separator':
+            if char == ',':
+                self.pos += 1
+                self.state = 'entry'
+                char = self.skip()
+            elif char not in ['}', ']']:
+                raise self.error("Expecting ',' delimiter")
+        if self.state == 'entry' and char in ['}', ']']:
+            if self.expect_key:
+                raise self.error('Expecting property name enclosed in double quotes')
+            raise self.error('Expecting value')
+        return char
+
+    def peek(self):
+        char = self.separator()
+        if char == '':
+            return None
+        if self.expect_key and char != '}':
+            return 'key'
+        if char in self.container_events:
+            return self.container_events[char]
+        return 'value'
+
+    # Decodes the next element, reading until it is complete
+    def decode(self):
+        self.skip()
+        while True:
+            try:
+                result, end = self.decoder.raw_decode(self.text, self.pos)
+                # A number can go on in the text not read yet
+                if end < len(self.text) or self.end_of_file:
+                    self.pos = end
+                    return result
+            except json.JSONDecodeError as e:
+                if self.end_of_file:
+                    raise self.error(e.msg, e.pos) from None
+            self.read(max(self.chunk_size, len(self.text)))
+
+    # After an element, a map expects a key, and a map or list a separator
+    def completed(self):
+        self.expect_key = len(self.in_map) > 0 and self.in_map[-1]
+        self.state = 'separator' if self.in_map else 'element'
+
+    def next_event(self):
+        event = self.peek()
+        if event is None:
+            if self.in_map:
+                raise self.error('Unexpected end of text')
+            return None
+        if event in ['start_map', 'start_array']:
+            self.pos += 1
+            self.in_map.append(event == 'start_map')
+            self.expect_key = event == 'start_map'
+            self.state = 'element'
+            return event, None
+        if event in ['end_map', 'end_array']:
+            if not self.in_map or self.in_map[-1] != (event == 'end_map'):
+                raise self.error('Unexpected ' + self.text[self.pos])
+            self.pos += 1
+            self.in_map.pop()
+            self.completed()
+            return event, None
+        if event == 'key':
+            if self.text[self.pos] != '"':
+                raise self.error('Expecting property name enclosed in double quotes')
+            key = self.decode()
+            self.expect_key = False
+            self.state = 'colon'
+            return event, key
+        result = self.decode()
+        self.completed()
+        return event, result
+
+    def value(self):
+        event = self.peek()
+        if event in ['start_map', 'start_array', 'value']:
+            result = self.decode()
+            self.completed()
+            return result
+        if event is None:
+            raise self.error('Expecting value')
+        raise self.error('Unexpected ' + self.text[self.pos])
+
+
+# The random choices of Grammar.sample
+# Atoms are filled with bytes (0 to 127, the range of MIDI data), the atom name and a number, or either boolean
+class GrammarSampler:
+    # The most entries sampled for an unlimited list
+    unlimited_length = 16
+
+    def __init__(self, grammar, seed, density, functions=None):
+        self.grammar = grammar
+        self.minimal = grammar.minimal
+        self.random = random.Random(seed)
+        self.density = density
+        self.functions = {} if functions is None else functions
+
+    def filled(self):
+        return self.random.random() < self.density
+
+    def sample(self, schema, context, list_pos):
+        function = self.functions.get(schema)
+        if function is not None:
+            return function(self, schema, context, list_pos)
+        return schema.sample(self, context, list_pos)
+
+    # Calls sample(*args) with functions in place of the sampler's own for their nodes, so a node shared by parts of
+    # the schema (the messages of the banks and of the presets) can be sampled differently below each of them
+    def sample_using(self, functions, sample, *args):
+        outer_functions = self.functions
+        self.functions = {**outer_functions, **functions}
+        try:
+            return sample(*args)
+        finally:
+            self.functions = outer_functions
+
+    def atom(self, atom):
+        if atom.type is bool:
+            return self.random.random() < 0.5
+        if atom.type is int:
+            return self.random.randint(0, 127)
+        if atom.type is str:
+            return atom.name + ' ' + str(self.random.randint(1, 999))
+        raise GrammarException('no_sample', 'There is no sample for ' + atom.name + ' atoms of ' + str(atom.type))
+
+
 class GrammarFile:
     def __init__(self, filename=None, is_yaml=None):
         if filename is None:
@@ -900,6 +3568,21 @@ class GrammarFile:
         else:
             raise GrammarException('Not implemented')
 
+    # Saves what grammar gens for model, JSON files are streamed (see Grammar.gen_stream)
+    def save_gen(self, grammar, model):
+        if self.filename is None or self.is_yaml:
+            self.save(grammar.gen_config(model))
+        else:
+            with open(self.filename, "w") as write_file:
+                grammar.gen_stream(model, write_file)
+
+    # Parses the file with grammar, JSON files are read as events (see Grammar.parse_events)
+    def load_parse(self, grammar):
+        if self.filename is None or self.is_yaml:
+            return grammar.parse_config(self.load())
+        with open(self.filename, "r") as read_file:
+            return grammar.parse_events(JsonEvents(read_file))
+
     def load(self):
         if self.filename is not None:
             with open(self.filename, "r") as read_file:
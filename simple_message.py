@@ -45,6 +45,7 @@ simple_message_type = ["unused", "PC", "CC", "Note On", "Note Off",
                        # 56
                        'MIDI Clock Tap Menu', 'PC Number Scroll Update', 'CC Value Scroll Update']
 simple_message_default = simple_message_type[0]
+simple_message_codec = jg.enum_codec(simple_message_type)
 
 bank_message_type = ["unused", "PC", "CC", "Note On", "Note Off",
                      "Real Time", "Set Toggle", "Select Exp Message", "message8",
@@ -398,7 +399,7 @@ class PCNumberScrollUpdateModel(PCCCNumberValueScrollBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("PC Number Scroll")
+        backup_message.type = simple_message_codec.index("PC Number Scroll")
         self.to_backup_common(backup_message)
         self.to_backup_counter(backup_message)
         self.to_backup_update(backup_message)
@@ -732,7 +733,7 @@ class MIDIClockTapMenuModel(jg.GrammarModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index('MIDI Clock')
+        backup_message.type = simple_message_codec.index('MIDI Clock')
         if self.bpm is None:
             backup_message.msg_array_data[1] = None
         else:
@@ -1060,7 +1061,7 @@ class StopWaveformModel(WaveformSequenceBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Waveform Generator")
+        backup_message.type = simple_message_codec.index("CC Waveform Generator")
         self.to_backup_engine(backup_message)
 
 
@@ -1080,7 +1081,7 @@ class StopAllWaveformModel(WaveformSequenceBaseModel):
 
     @staticmethod
     def to_backup(backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Waveform Generator")
+        backup_message.type = simple_message_codec.index("CC Waveform Generator")
         backup_message.msg_array_data[4] = 15
 
 
@@ -1104,7 +1105,7 @@ class StopSequenceModel(WaveformSequenceBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Sequence Generator")
+        backup_message.type = simple_message_codec.index("CC Sequence Generator")
         self.to_backup_engine(backup_message)
 
 
@@ -1124,7 +1125,7 @@ class StopAllSequenceModel(WaveformSequenceBaseModel):
 
     @staticmethod
     def to_backup(backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Sequence Generator")
+        backup_message.type = simple_message_codec.index("CC Sequence Generator")
         backup_message.msg_array_data[4] = 15
 
 
@@ -1156,7 +1157,7 @@ class StartWaveformModel(WaveformSequenceBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Waveform Generator")
+        backup_message.type = simple_message_codec.index("CC Waveform Generator")
         backup_message.msg_array_data[1] = 0x43  # start, don't stop, unknown 2 bits at end
         self.to_backup_common(backup_message)
         self.to_backup_midi_clock(backup_message)
@@ -1190,7 +1191,7 @@ class StartSequenceModel(WaveformSequenceBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Sequence Generator")
+        backup_message.type = simple_message_codec.index("CC Sequence Generator")
         backup_message.msg_array_data[1] = 0x43  # start, don't stop, unknown 2 bits at end
         self.to_backup_common(backup_message)
         self.to_backup_midi_clock(backup_message)
@@ -1225,7 +1226,7 @@ class StartWaveformNoMIDIClockModel(WaveformSequenceBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Waveform Generator")
+        backup_message.type = simple_message_codec.index("CC Waveform Generator")
         backup_message.msg_array_data[1] = 0x43  # start, don't stop, unknown 2 bits at end
         self.to_backup_common(backup_message)
         self.to_backup_waveform(backup_message)
@@ -1259,7 +1260,7 @@ class StartSequenceNoMIDIClockModel(WaveformSequenceBaseModel):
         return ':'.join(name)
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("CC Sequence Generator")
+        backup_message.type = simple_message_codec.index("CC Sequence Generator")
         backup_message.msg_array_data[1] = 0x43  # start, don't stop, unknown 2 bits at end
         self.to_backup_common(backup_message)
         self.to_backup_no_midi_clock(backup_message)
@@ -1622,7 +1623,7 @@ class DisengageLooperModeModel(jg.GrammarModel):
             return "enableLCD"
 
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
-        backup_message.type = simple_message_type.index("Looper Mode")
+        backup_message.type = simple_message_codec.index("Looper Mode")
         backup_message.msg_array_data[0] = 2
         if self.disable_message is not None and self.disable_message:
             backup_message.msg_array_data[0] |= 8
@@ -1824,7 +1825,7 @@ class SimpleMessage(jg.GrammarModel):
 
     # Add the MIDI message directly to the backup message
     def to_backup(self, backup_message, message_type, bank_catalog, simple_bank, simple_preset, trigger_enum):
-        backup_message.type = message_type.index(self.type)
+        backup_message.type = jg.enum_codec(message_type).index(self.type)
         backup_message.msg_array_data = [None] * 18
         if self.specific_message is not None:
             self.specific_message.to_backup(backup_message, bank_catalog, simple_bank,
@@ -1833,7 +1834,7 @@ class SimpleMessage(jg.GrammarModel):
         # Canonicalize the backup_message
         # Trigger
         if self.trigger is not None:
-            backup_message.trigger = trigger_enum.index(self.trigger)
+            backup_message.trigger = jg.enum_codec(trigger_enum).index(self.trigger)
         if backup_message.trigger == 0:
             backup_message.trigger = None
         if self.toggle_state is not None:
@@ -1986,7 +1987,7 @@ transition_message_case_keys = {
 #     return case_keys
 #
 def make_message_case_keys():
-    case_keys = copy.deepcopy(transition_message_case_keys)
+    case_keys = dict(transition_message_case_keys)
     for message_type in SimpleMessage.to_bank_classes:
         case_keys[message_type] = SimpleMessage.to_bank_classes[message_type].get_case_keys()
     return case_keys
@@ -134,19 +134,19 @@ class SimplePreset(jg.GrammarModel):
         if self.message_scroll is not None and self.message_scroll == "On":
             backup_preset.to_msg_scroll = True
         if self.text is not None:
-            backup_preset.name_color = colors.colors.index(self.text)
+            backup_preset.name_color = colors.color_codec.index(self.text)
         if self.text_toggle is not None:
-            backup_preset.name_toggle_color = colors.colors.index(self.text_toggle)
+            backup_preset.name_toggle_color = colors.color_codec.index(self.text_toggle)
         if self.text_shift is not None:
-            backup_preset.shifted_name_color = colors.colors.index(self.text_shift)
+            backup_preset.shifted_name_color = colors.color_codec.index(self.text_shift)
         if self.background is not None:
-            backup_preset.background_color = colors.colors.index(self.background)
+            backup_preset.background_color = colors.color_codec.index(self.background)
         if self.background_toggle is not None:
-            backup_preset.background_toggle_color = colors.colors.index(self.background_toggle)
+            backup_preset.background_toggle_color = colors.color_codec.index(self.background_toggle)
         if self.strip_color is not None:
-            backup_preset.strip_color = colors.colors.index(self.strip_color)
+            backup_preset.strip_color = colors.color_codec.index(self.strip_color)
         if self.strip_toggle_color is not None:
-            backup_preset.strip_toggle_color = colors.colors.index(self.strip_toggle_color)
+            backup_preset.strip_toggle_color = colors.color_codec.index(self.strip_toggle_color)
         backup_preset.to_toggle = self.toggle_mode
         if self.messages is not None:
             for pos, message in enumerate(self.messages):
@@ -230,9 +230,9 @@ class SimpleBank(jg.GrammarModel):
         backup_bank.name = self.name
         backup_bank.description = self.description
         if self.text is not None:
-            backup_bank.text_color = colors.colors.index(self.text)
+            backup_bank.text_color = colors.color_codec.index(self.text)
         if self.background is not None:
-            backup_bank.background_color = colors.colors.index(self.background)
+            backup_bank.background_color = colors.color_codec.index(self.background)
         backup_bank.to_display = self.display_description
         backup_bank.clear_toggle = self.clear_toggle
         if self.messages is not None:
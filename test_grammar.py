@@ -1,8 +1,19 @@
 import copy
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
 import unittest
+import yaml
 
 import backup_grammar
+import backup_model
+import config_samples
+import intuitive_grammar
 import simple_grammar
+import simple_model
 from version import intuitive_version
 import grammar as jg
 from IntuitiveException import IntuitiveException
@@ -30,6 +41,16 @@ class Object2ForTests(jg.GrammarModel):
         return self.y == other.y and self.modified == other.modified
 
 
+# A model object that declares its fields
+class DeclaredObjectForTests(jg.GrammarModel):
+    model_fields = ('x', 'y')
+
+    def __init__(self):
+        super().__init__('DeclaredObjectForTests')
+        self.x = None
+        self.y = None
+
+
 # Switch Models
 class SwitchBaseModel(jg.GrammarModel):
     def __init__(self):
@@ -167,6 +188,31 @@ class ModelTestCases(unittest.TestCase):
         self.assertEqual(obj.x, 2)
         self.assertEqual(obj.get_var('x'), 2)
 
+    def test_declared_fields(self):
+        obj = DeclaredObjectForTests()
+        self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(DeclaredObjectForTests.declared_fields, frozenset(['x', 'y']))
+        self.assertTrue(obj.has_var('y'))
+        self.assertFalse(obj.has_var('z'))
+        self.assertFalse(obj.has_var('modified'))
+        obj.set_var('y', 3, 'error message')
+        self.assertTrue(obj.modified)
+        self.assertEqual(obj.get_var('y'), 3)
+        with self.assertRaises(jg.GrammarException) as context:
+            obj.set_var('y', 4, 'error message')
+        self.assertEqual('multiply_assigned_var', context.exception.args[0])
+        with self.assertRaises(jg.GrammarException) as context:
+            obj.set_var('z', 4, 'error message')
+        self.assertEqual('model_missing_var', context.exception.args[0])
+        with self.assertRaises(jg.GrammarException) as context:
+            obj.get_var('z')
+        self.assertEqual('model_missing_var', context.exception.args[0])
+        with self.assertRaises(AttributeError):
+            obj.z = 4
+        # Models that don't declare their fields keep their instance variables
+        self.assertTrue(ObjectForTests().has_var('x'))
+        self.assertFalse(ObjectForTests().has_var('modified'))
+
 
 # Test the structure of the various grammar elements
 # These are brittle, not the best
@@ -192,16 +238,19 @@ class JsonGrammarElementStructureTestCase(unittest.TestCase):
 
     # Test dict structure, include variable, model and both and none
     def test_dict(self):
-        self.validate_dict(jg.Dict('foo', [1, 2, 3]),
-                           'foo', [1, 2, 3], None, None, None)
-        self.validate_dict(jg.Dict('foo', [1, 2, 3], var='x'),
-                           'foo', [1, 2, 3], 'x', None, None)
-        self.validate_dict(jg.Dict('foo', [1, 2, 3], model=ObjectForTests),
-                           'foo', [1, 2, 3], None, ObjectForTests, None)
-        self.validate_dict(jg.Dict('foo', [1, 2, 3], cleanup=3),
-                           'foo', [1, 2, 3], None, None, 3)
-        self.validate_dict(jg.Dict('foo', [1, 2, 3], var='x', model=ObjectForTests, cleanup=3),
-                           'foo', [1, 2, 3], 'x', ObjectForTests, 3)
+        # The key table is built in the constructor, so the keys must be real keys
+        keys = [jg.Dict.make_key('a', jg.Atom('atom', int, 1)), jg.Dict.make_key('b', jg.Atom('atom', int, 2))]
+        self.validate_dict(jg.Dict('foo', keys),
+                           'foo', keys, None, None, None)
+        self.validate_dict(jg.Dict('foo', keys, var='x'),
+                           'foo', keys, 'x', None, None)
+        self.validate_dict(jg.Dict('foo', keys, model=ObjectForTests),
+                           'foo', keys, None, ObjectForTests, None)
+        self.validate_dict(jg.Dict('foo', keys, cleanup=3),
+                           'foo', keys, None, None, 3)
+        self.validate_dict(jg.Dict('foo', keys, var='x', model=ObjectForTests, cleanup=3),
+                           'foo', keys, 'x', ObjectForTests, 3)
+        self.assertEqual(['a', 'b'], jg.Dict('foo', keys).key_table.names)
 
     # Test the switch dictionary, with none, var, model, and both
     def validate_switch_dict(self, node, name, switch_key, case_keys, common_keys, var, model, cleanup):
@@ -293,7 +342,12 @@ class JsonGrammarElementStructureTestCase(unittest.TestCase):
                           'c': [SwitchCModel, jg.SwitchDict.make_key('c1', jg.Atom('atom', int, 1)),
                                 jg.SwitchDict.make_key('c2', jg.Atom('atom', int, 2)),
                                 jg.SwitchDict.make_key('c3', jg.Atom('atom', int, 3))]}
-        self.assertIsNotNone(jg.SwitchDict('test', test_switch_key, test_case_keys, model_var='x'))
+        node = jg.SwitchDict('test', test_switch_key, test_case_keys, model_var='x')
+        self.assertEqual(SwitchAModel, node.case_models['a'])
+        # The case models are removed from the node's case keys, not from the caller's, and the keys are shared
+        self.assertEqual(SwitchAModel, test_case_keys['a'][0])
+        self.assertEqual(test_case_keys['a'][1:], node.case_keys['a'])
+        self.assertIs(test_case_keys['a'][1], node.case_keys['a'][0])
 
     def validate_list(self, node, length, schema, var, model, cleanup):
         self.assertEqual(length, node.length)
@@ -327,6 +381,23 @@ class JsonGrammarElementStructureTestCase(unittest.TestCase):
             jg.Atom('atom', int, 1, value=2)
         self.assertEqual(context.exception.args[0], 'both_value_default')
 
+        # The constructor picks the specialized atom once, the value and default are plain attributes
+        self.assertIsInstance(jg.zero_atom, jg.ConstantAtom)
+        self.assertIsInstance(jg.Atom('atom', int, 1), jg.DefaultAtom)
+        self.assertIsInstance(jg.identity2_atom, jg.PositionalAtom)
+        self.assertIsInstance(jg.Atom('atom', int, value=jg.identity_plus_1), jg.PositionalAtom)
+        self.assertIsInstance(jg.Atom('atom', int, lambda elem, ctxt, lp: 1), jg.CallableAtom)
+        self.assertIs(jg.Atom, type(jg.Atom('atom', int)))
+        test_atom = jg.Atom('atom', int, value=3)
+        self.assertIs(jg.ConstantAtom, type(test_atom))
+        self.assertIsNone(test_atom.parse(complete_conf, 3, 'foo', None, [], None))
+        test_atom.value = 4
+        self.assertIs(jg.ConstantAtom, type(test_atom))
+        self.assertEqual(4, test_atom.value)
+        test_atom = copy.deepcopy(jg.identity2_atom)
+        self.assertIs(jg.PositionalAtom, type(test_atom))
+        self.assertEqual((-2, 0), (test_atom.position, test_atom.offset))
+
 
 class JsonGrammarBaseTestCase(unittest.TestCase):
     def check_target(self, result, target):
@@ -434,6 +505,17 @@ class JsonGrammarParserTestCase(JsonGrammarBaseTestCase):
         # Test schema is none
         self.run_grammar_parse_error(None, 1, 'no_schema')
 
+    def test_error_trail(self):
+        self.assertEqual('foo', jg.trail_name('foo'))
+        self.assertEqual('foo:a:list', jg.trail_name((('foo', ':a'), ':list')))
+
+        # The trail is only rendered in the error message
+        schema = jg.Dict('foo', [jg.Dict.make_key('a', jg.List('list', 2, jg.Atom('atom', int, 1)))])
+        conf = jg.Grammar(schema)
+        with self.assertRaises(jg.GrammarException) as context:
+            conf.parse_config({'a': [1, 'x']})
+        self.assertEqual("In foo:a:list:atom expected <class 'int'> atom but got x", context.exception.args[1])
+
     def test_simple_var_cases(self):
         # Test var in schema, not modified
         self.run_grammar_parse_model(self.var_schema, 1, None, None, None)
@@ -527,6 +609,13 @@ class JsonGrammarDictNodeParseTestCase(JsonGrammarBaseTestCase):
         test_schema = jg.Dict('foo', [jg.Dict.make_key('b', jg.Atom('atom', int, 1)),
                                       jg.Dict.make_key('c', jg.Atom('atom', int, 2))])
         self.run_node_parse_error(test_schema, {'a': 1}, 'dict_bad_keys')
+        # The undefined keys are reported, in the order they appear in the elem
+        test_schema = jg.Dict('foo', [jg.Dict.make_key('b', jg.Atom('atom', int, 1), False),
+                                      jg.Dict.make_key('c', jg.Atom('atom', int, 2), False)])
+        with self.assertRaises(jg.GrammarException) as context:
+            test_schema.parse(complete_conf, {'x': 1, 'c': 2, 'a': 3}, "foo", None, [], None)
+        self.assertEqual('While parsing foo the following keys are undefined: x, a\nThe valid keys are: b, c',
+                         context.exception.args[1])
         # elem has too few keys, all correct, complete => error, minimal => parse
         test_schema = jg.Dict('foo',
                               [jg.Dict.make_key('a', jg.Atom('atom', int, 1)),
@@ -700,6 +789,18 @@ class JsonGrammarSwitchDictNodeParseTestCase(JsonGrammarBaseTestCase):
         test_switch = make_common_switch()
         self.run_node_parse(test_switch, {'switch': 'a', 'a1': 1, 'a2': 2, 'c1': 1, 'c2': 2},
                             None, None)
+        self.run_node_parse(test_switch, {'switch': 'b', 'b1': 3, 'b2': 2, 'c1': 2, 'c2': 2},
+                            {'switch': 'b', 'b1': 3, 'c1': 2}, {'switch': 'b', 'b1': 3, 'c1': 2})
+        self.assertTrue(test_switch.switch_parsed_once)
+        self.assertEqual(['c1', 'c2', 'b1', 'b2'], test_switch.case_plans['b'].parse_table.names)
+        self.assertEqual(['b1', 'b2', 'c1', 'c2'], test_switch.case_plans['b'].gen_table.names)
+
+        # A switch key with a cleanup is parsed again after the switch value
+        switch_key = jg.SwitchDict.make_key('x', jg.Enum('enum', ['a', 'b'], 'a',
+                                                         cleanup=lambda value, ctxt, lp: value and value.upper()))
+        test_switch = jg.SwitchDict('test', switch_key, {'a': [], 'b': []})
+        self.assertFalse(test_switch.switch_parsed_once)
+        self.run_node_parse(test_switch, {'x': 'b'}, {'x': 'B'}, {'x': 'B'})
 
     def test_switch_models(self):
         test_switch_enum = jg.Enum('enum', ['a', 'b', 'c'], 'a', var='switch_key')
@@ -751,6 +852,15 @@ class JsonGrammarListNodeParseTestCase(JsonGrammarBaseTestCase):
                                                  jg.Atom('atom', int, value=lambda elem, ctxt, x: x[-1] + x[-2])))
         self.run_node_parse(test_schema, [[0, 1, 2], [1, 2, 3], [2, 3, 4]], None, None)
 
+        # The list position is shared, and restored after the list, even on an error
+        list_pos = [5]
+        test_schema = jg.List('list', 2, jg.Atom('atom', int, value=lambda elem, ctxt, x: x[-2] + x[-1]))
+        self.assertIsNone(test_schema.parse(complete_conf, [5, 6], "foo", None, list_pos, None))
+        self.assertEqual([5], list_pos)
+        with self.assertRaises(jg.GrammarException):
+            test_schema.parse(complete_conf, [5, 5], "foo", None, list_pos, None)
+        self.assertEqual([5], list_pos)
+
         # Test lists with defaults
         test_schema = jg.List('list', 3, jg.Atom('atom', int, 1))
         # test list with all matching defaults
@@ -821,6 +931,16 @@ class JsonGrammarEnumNodeParseTestCase(JsonGrammarBaseTestCase):
         # Atom has right type not default value
         self.run_node_parse(test_enum_default, 'foo', 'foo', 'foo')
 
+    def test_enum_codec(self):
+        names = ['foo', 'bar', 'baz']
+        codec = jg.enum_codec(names)
+        self.assertIs(codec, jg.Enum('enum', names).codec)
+        for pos, enum_name in enumerate(names):
+            self.assertEqual(pos, codec.index(enum_name))
+            self.assertEqual(enum_name, codec.name(pos))
+        with self.assertRaises(ValueError):
+            codec.index('bum')
+
 
 class JsonGrammarAtomNodeParseTestCase(JsonGrammarBaseTestCase):
     def test_parse_atom_errors(self):
@@ -1212,6 +1332,682 @@ class JsonGrammarAtomNodeGenTestCase(JsonGrammarBaseTestCase):
         self.run_node_gen(default_bool_atom, test_model, True, None)
 
 
+# A backup with 4 banks, for the tests that go through whole backups
+small_backup_schema = jg.Dict(
+    'backup',
+    [jg.Dict.make_key('deviceModel', jg.Atom('Device Model', int, value=6)),
+     jg.Dict.make_key('hash', jg.Atom('Hash', int, 0, var='hash')),
+     jg.Dict.make_key('data', jg.Dict('data', [jg.Dict.make_key(
+         'bankArray', jg.List('Bank List', 4, backup_grammar.bank_array_schema, parallel=True, var='banks'))]))],
+    model=backup_model.Backup)
+
+
+# Helpers for the tests of the engines (compiled and explicit stack) and the grammar features on top of
+# them: each engine gives the same results and errors as the interpreter
+class JsonGrammarEngineBaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def mask_date(backup):
+        backup['downloadDate'] = ''
+        return backup
+
+    # The compiled and stack engines, and with interpreted=True the interpreter first
+    def make_grammars(self, schema, minimal=False, interpreted=False, memoize=False, profile=False):
+        grammars = [jg.Grammar(schema, minimal, memoize=memoize, profile=profile).compile(),
+                    jg.Grammar(schema, minimal, memoize=memoize, profile=profile).use_stack()]
+        if interpreted:
+            grammars.insert(0, jg.Grammar(schema, minimal, memoize=memoize, profile=profile))
+        return grammars
+
+    # Validating the element gives the same errors as parsing it
+    def run_both_parse(self, schema, elem, minimal=False):
+        interpreted = jg.Grammar(schema, minimal)
+        try:
+            target = interpreted.parse_config(elem)
+        except jg.GrammarException as e:
+            for grammar in self.make_grammars(schema, minimal):
+                with self.assertRaises(jg.GrammarException) as context:
+                    grammar.parse_config(elem)
+                self.assertEqual(e.args, context.exception.args)
+            with self.assertRaises(jg.GrammarException) as context:
+                interpreted.validate(elem)
+            self.assertEqual(e.args, context.exception.args)
+            return None
+        for grammar in self.make_grammars(schema, minimal):
+            self.assertEqual(target, grammar.parse_config(elem))
+        interpreted.validate(elem)
+        return target
+
+    def run_both_gen(self, schema, model, minimal=False):
+        interpreted = jg.Grammar(schema, minimal)
+        try:
+            target = interpreted.gen_config(model)
+        except jg.GrammarException as e:
+            for grammar in self.make_grammars(schema, minimal):
+                with self.assertRaises(jg.GrammarException) as context:
+                    grammar.gen_config(model)
+                self.assertEqual(e.args, context.exception.args)
+            return
+        for grammar in self.make_grammars(schema, minimal):
+            self.assertEqual(target, grammar.gen_config(model))
+
+
+class JsonGrammarCompileTestCase(JsonGrammarEngineBaseTestCase):
+    def test_compile_nodes(self):
+        switch = make_common_switch()
+        test_dict = jg.Dict('foo', [jg.Dict.make_key('a', jg.Atom('atom', int, 1)),
+                                    jg.Dict.make_key('b', jg.Atom('atom', int, value=jg.identity_plus_1))])
+        test_list = jg.List('list', 3, test_dict)
+        test_unlimited_list = jg.List('list', 0, jg.Enum('enum', ['a', 'b'], 'a'))
+        for minimal in [False, True]:
+            self.run_both_parse(switch, {'switch': 'b', 'b1': 3, 'c1': 1, 'c2': 2, 'b2': 2}, minimal)
+            self.run_both_parse(switch, {'switch': 'c'}, minimal)
+            self.run_both_parse(switch, {'switch': 'a', 'b1': 3}, minimal)
+            self.run_both_parse(test_list, [{'a': 1, 'b': 1}, {'a': 2, 'b': 2}, {'a': 1, 'b': 3}], minimal)
+            self.run_both_parse(test_list, [{'a': 1, 'b': 1}, {'a': 2, 'b': 3}], minimal)
+            self.run_both_parse(test_list, [{'a': 1, 'b': 1, 'c': 2}], minimal)
+            self.run_both_parse(test_list, [{'a': '1'}], minimal)
+            self.run_both_parse(test_unlimited_list, ['a', 'b', 'c'], minimal)
+            self.run_both_parse(test_unlimited_list, ['a', 'b', 'a'], minimal)
+            self.run_both_gen(switch, {'switch': 'b', 'b1': 3}, minimal)
+            self.run_both_gen(switch, {'switch': 'a', 'b1': 3}, minimal)
+            self.run_both_gen(switch, None, minimal)
+            self.run_both_gen(test_list, [{'a': 2}, None], minimal)
+            self.run_both_gen(test_list, [{'a': 2}, {'b': 7}, None], minimal)
+            self.run_both_gen(test_list, 3, minimal)
+            self.run_both_gen(test_unlimited_list, ['a', 'b', 'a'], minimal)
+
+    def test_compile_backup(self):
+        interpreted = jg.Grammar(backup_grammar.backup_schema)
+        grammars = self.make_grammars(backup_grammar.backup_schema)
+        backup = self.mask_date(interpreted.gen_config(None))
+        for grammar in grammars:
+            self.assertEqual(backup, self.mask_date(grammar.gen_config(None)))
+        backup['data']['bankArray'][3]['presetArray'][5]['msgArray'][2]['t'] = 2
+        backup['data']['bankArray'][3]['presetArray'][5]['msgArray'][2]['data'][0] = 7
+        backup['data']['bankArray'][3]['bankName'] = 'Bank 3'
+        backup_model = self.run_both_parse(backup_grammar.backup_schema, backup)
+        self.assertEqual(7, backup_model.banks[3].presets[5].messages[2].msg_array_data[0])
+        for grammar in grammars:
+            self.assertEqual(backup, self.mask_date(grammar.gen_config(backup_model)))
+
+        backup['data']['bankArray'][3]['presetArray'][5]['bankNum'] = 4
+        self.run_both_parse(backup_grammar.backup_schema, backup)
+        backup['data']['bankArray'][3]['presetArray'][5]['bankNum'] = 3
+        backup['data']['bankArray'][3].pop('bankName')
+        self.run_both_parse(backup_grammar.backup_schema, backup)
+
+    def test_compile_simple(self):
+        simple_file = jg.GrammarFile('Configs/Test/Demo.yaml')
+        simple_model = self.run_both_parse(simple_grammar.simple_schema, simple_file.load(), True)
+        target = jg.Grammar(simple_grammar.simple_schema, True).gen_config(simple_model)
+        for grammar in self.make_grammars(simple_grammar.simple_schema, True):
+            self.assertEqual(target, grammar.gen_config(simple_model))
+
+
+class JsonGrammarTemplateTestCase(JsonGrammarEngineBaseTestCase):
+    # Without a model, complete grammars gen containers from their default templates
+    def test_default_template(self):
+        inner = jg.Dict('inner', [jg.Dict.make_key('i', jg.identity_atom),
+                                  jg.Dict.make_key('j', jg.identity2_atom),
+                                  jg.Dict.make_key('z', jg.List('zeros', 2, jg.zero_atom))])
+        outer = jg.List('outer', 2, jg.Dict('middle', [jg.Dict.make_key('inner', jg.List('inner', 2, inner)),
+                                                       jg.Dict.make_key('switch', make_common_switch())]))
+        target = [{'inner': [{'i': 0, 'j': pos, 'z': [0, 0]}, {'i': 1, 'j': pos, 'z': [0, 0]}],
+                   'switch': {'switch': 'a', 'a1': 1, 'a2': 2, 'c1': 1, 'c2': 2}} for pos in range(2)]
+        grammar = jg.Grammar(outer)
+        self.assertIsNotNone(grammar.default_template(outer))
+        self.assertEqual(target, grammar.gen_config(None))
+        for grammar in self.make_grammars(outer):
+            self.assertEqual(target, grammar.gen_config(None))
+        # The dicts and lists are new each time
+        result = grammar.gen_config(None)
+        self.assertIsNot(result[0]['inner'][0]['z'], result[0]['inner'][1]['z'])
+        self.assertIsNot(result[0]['inner'], grammar.gen_config(None)[0]['inner'])
+
+        self.assertIsNone(jg.Grammar(outer, True).default_template(outer))
+        callable_list = jg.List('list', 2, jg.Atom('atom', int, default=lambda elem, context, list_pos: 3))
+        self.assertIsNone(jg.Grammar(callable_list).default_template(callable_list))
+        self.assertEqual([3, 3], jg.Grammar(callable_list).gen_config(None))
+
+
+class JsonGrammarFingerprintTestCase(JsonGrammarEngineBaseTestCase):
+    # Default elements are recognized by their fingerprint, without parsing each node
+    def test_default_fingerprint(self):
+        entry = jg.Dict('entry', [jg.Dict.make_key('i', jg.identity_atom),
+                                  jg.Dict.make_key('j', jg.identity2_atom),
+                                  jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x')),
+                                  jg.Dict.make_key('l', jg.List('list', 2, jg.false_atom))], model=ObjectForTests)
+        outer = jg.List('outer', 2, jg.Dict('middle', [jg.Dict.make_key('entries', jg.List('entries', 2, entry))]))
+        grammar = jg.Grammar(outer)
+        fingerprint = grammar.default_fingerprint(entry)
+        self.assertEqual(2, fingerprint.depth)
+        self.assertTrue(fingerprint.matches({'i': 1, 'j': 0, 'a': 1, 'l': [False, False]}, [0, 1]))
+        self.assertTrue(fingerprint.matches({'l': [False, False], 'a': 1, 'j': 0, 'i': 1}, [0, 1]))
+        self.assertFalse(fingerprint.matches({'i': 1, 'j': 0, 'a': 1, 'l': [False, False]}, [1]))
+        self.assertFalse(fingerprint.matches({'i': 1, 'j': 0, 'a': 1, 'l': [False]}, [0, 1]))
+        self.assertFalse(fingerprint.matches({'i': True, 'j': 0, 'a': 1, 'l': [False, False]}, [0, 1]))
+        self.assertFalse(fingerprint.matches({'i': 1, 'j': 0, 'a': 1, 'l': [False, False]}, [1, 1]))
+        # Equal, but not the same types
+        self.assertFalse(fingerprint.matches({'i': 1, 'j': 0, 'a': 1.0, 'l': [False, False]}, [0, 1]))
+        self.assertFalse(fingerprint.matches({'i': 1, 'j': 0, 'a': 1, 'l': [0, False]}, [0, 1]))
+        self.assertIsNone(grammar.default_fingerprint(outer))
+
+        elem = grammar.gen_config(None)
+        self.assertIsNone(self.run_both_parse(outer, elem))
+        elem[1]['entries'][0]['a'] = 2
+        self.assertEqual(2, self.run_both_parse(outer, elem)[1]['entries'][0].x)
+        elem[1]['entries'][0]['a'] = 1.0
+        self.run_both_parse(outer, elem)
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.parse_config(elem)
+        self.assertEqual('atom_wrong_type', context.exception.args[0])
+
+        # A cleanup below a node must keep None for the node to have a fingerprint
+        def cleanup(result, _context, _list_pos):
+            return result
+        entries = jg.List('entries', 2, jg.Dict('entry', [jg.Dict.make_key('a', jg.zero_atom)], cleanup=cleanup))
+        outer = jg.Dict('outer', [jg.Dict.make_key('e', entries)])
+        self.assertIsNone(jg.Grammar(outer).default_fingerprint(outer))
+        self.assertIsNotNone(jg.Grammar(outer).default_fingerprint(entries.schema))
+        jg.keeps_none(cleanup)
+        self.assertIsNotNone(jg.Grammar(outer).default_fingerprint(outer))
+
+
+class JsonGrammarMemoTestCase(JsonGrammarEngineBaseTestCase):
+    # Repeated elements of pure, self contained nodes are parsed once, and share their result
+    def test_parse_memo(self):
+        entry = jg.Dict('entry', [jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests)
+        test_list = jg.List('list', 3, entry)
+        elem = [{'a': 2}, {'a': 2}, {'a': 3}]
+        for grammar in self.make_grammars(test_list, interpreted=True, memoize=True):
+            result = grammar.parse_config(elem)
+            self.assertEqual([2, 2, 3], [model.x for model in result])
+            # A repeat gets a copy of the memoized result
+            self.assertIsNot(result[0], result[1])
+            self.assertIsNot(result[0], grammar.parse_config(elem)[0])
+            self.assertEqual({}, grammar.parse_memo(entry))
+
+        # The copy has its own models and lists below it, only the atom values are shared
+        inner = jg.Dict('inner', [jg.Dict.make_key('b', jg.List('list', 2, jg.Atom('atom', int, 1), var='y'))],
+                        var='x', model=Object2ForTests)
+        outer = jg.Dict('outer', [jg.Dict.make_key('a', inner)], model=DeclaredObjectForTests)
+        nested_list = jg.List('list', 2, outer)
+        elem = [{'a': {'b': [2, 3]}}, {'a': {'b': [2, 3]}}]
+        for grammar in self.make_grammars(nested_list, interpreted=True, memoize=True):
+            result = grammar.parse_config(elem)
+            self.assertEqual(result[0].x, result[1].x)
+            self.assertEqual((True, 'DeclaredObjectForTests'), (result[1].modified, result[1].model_name))
+            self.assertIsNot(result[0].x, result[1].x)
+            self.assertIsNot(result[0].x.y, result[1].x.y)
+            result[1].x.y.append(4)
+            self.assertEqual([2, 3], result[0].x.y)
+
+        # YAML aliases are the same object, found by the element rather than its entries
+        date_entry = jg.Dict('entry', [jg.Dict.make_key('a', jg.Atom('atom', datetime.date, var='x'))],
+                             model=ObjectForTests)
+        date_list = jg.List('list', 3, date_entry)
+        elem = yaml.safe_load('[&day {a: 2024-01-02}, *day, {a: 2024-01-02}]')
+        for grammar in self.make_grammars(date_list, interpreted=True, memoize=True):
+            result = grammar.parse_config(elem)
+            self.assertIsNot(result[0], result[1])
+            self.assertEqual([datetime.date(2024, 1, 2)] * 3, [model.x for model in result])
+
+        # The keys keep the types: a dict key 1 (or True) isn't the key '1' (or 'true') the schema has
+        for key_name, bad_key in [('1', 1), ('true', True)]:
+            key_entry = jg.Dict('entry', [jg.Dict.make_key(key_name, jg.Atom('atom', int, 1, var='x'))],
+                                model=ObjectForTests)
+            key_list = jg.List('list', 2, key_entry)
+            for grammar in self.make_grammars(key_list, interpreted=True, memoize=True):
+                with self.assertRaises(jg.GrammarException) as context:
+                    grammar.parse_config([{key_name: 2}, {bad_key: 2}])
+                self.assertEqual('dict_bad_keys', context.exception.args[0])
+        memo_keys = jg.MemoKeys()
+        self.assertNotEqual(memo_keys.key([1]), memo_keys.key([True]))
+        self.assertNotEqual(memo_keys.key([1]), memo_keys.key([1.0]))
+        self.assertEqual(memo_keys.key({'a': [1], 'b': 2}), memo_keys.key({'b': 2, 'a': [1]}))
+        self.assertNotEqual(memo_keys.key([[1]]), memo_keys.key([[2]]))
+
+        # Each parse, and parse_path, starts with empty memos
+        grammar = jg.Grammar(test_list, memoize=True)
+        elem = [{'a': 2}, {'a': 2}, {'a': 3}]
+        first = grammar.parse(elem, test_list, "", None, [], None)
+        self.assertEqual(first[0].x, first[1].x)
+        self.assertIsNot(first[0], grammar.parse(elem, test_list, "", None, [], None)[0])
+        self.assertIsNot(grammar.parse_path(elem, '0'), grammar.parse_path(elem, '1'))
+        self.assertEqual({}, grammar.parse_memo(entry))
+
+        grammar = jg.Grammar(test_list, memoize=True)
+        self.assertIsNone(grammar.parse_memo(entry.keys[0]['schema']))
+        # Not self contained, the variable is bound in the enclosing model
+        unmodeled = jg.Dict('entry', [jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))])
+        self.assertIsNone(grammar.parse_memo(unmodeled))
+        self.assertIsNone(grammar.parse_memo(jg.List('list', 2, unmodeled)))
+        self.assertIsNotNone(grammar.parse_memo(jg.List('list', 2, entry, var='x')))
+        # A container of atoms without a model isn't worth memoizing
+        self.assertIsNone(grammar.parse_memo(jg.List('list', 2, jg.zero_atom, var='x')))
+        # Not pure, the list position is used
+        positioned = jg.Dict('entry', [jg.Dict.make_key('i', jg.identity_atom)], model=ObjectForTests)
+        self.assertIsNone(grammar.parse_memo(positioned))
+
+
+class JsonGrammarStackTestCase(unittest.TestCase):
+    # The stack engine doesn't recurse, so elements can be nested deeper than the recursion limit
+    def test_stack_depth(self):
+        depth = sys.getrecursionlimit() * 2
+        schema = jg.Atom('atom', int, 1)
+        elem = 2
+        for _ in range(depth):
+            schema = jg.Dict('foo', [jg.Dict.make_key('a', schema)])
+            elem = {'a': elem}
+        grammar = jg.Grammar(schema, True)
+        with self.assertRaises(RecursionError):
+            grammar.parse_config(elem)
+        grammar.use_stack()
+        result = grammar.gen_config(grammar.parse_config(elem))
+        for _ in range(depth):
+            result = result['a']
+        self.assertEqual(2, result)
+
+        # An error deep in the element still pops the list position, in the stack engine and the interpreter
+        test_list = jg.List('list', 2, jg.List('list', 2, jg.Atom('atom', int, 1)))
+        grammar = jg.Grammar(test_list)
+        for parse in [grammar.stack_parse, grammar.parse]:
+            list_pos = [5]
+            with self.assertRaises(jg.GrammarException) as context:
+                parse([[1, 1], [1, 'x']], test_list, 'foo', None, list_pos, None)
+            self.assertEqual('atom_wrong_type', context.exception.args[0])
+            self.assertEqual([5], list_pos)
+
+
+class JsonGrammarProfileTestCase(JsonGrammarEngineBaseTestCase):
+    # Profiling counts the calls and models of each node, by name, in each engine
+    def test_profile(self):
+        entry = jg.Dict('entry', [jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests)
+        test_list = jg.List('list', 3, entry)
+        elem = [{'a': 2}, {'a': 2}, {'a': 1}]
+        self.assertNotIn('parse', vars(jg.Grammar(test_list)))
+        self.assertIsNone(jg.Grammar(test_list).profile)
+        for grammar in self.make_grammars(test_list, interpreted=True, profile=True):
+            target = grammar.gen_config(grammar.parse_config(elem))
+            self.assertEqual(elem, target)
+            profile = grammar.profile.summary()
+            self.assertEqual(['calls', 'cumulative', 'models', 'name', 'self'], sorted(profile['parse'][0]))
+            parse_nodes = {node['name']: node for node in profile['parse']}
+            self.assertEqual({'list', 'entry', 'atom'}, set(parse_nodes))
+            # The default entry matches its fingerprint, the list doesn't parse it
+            self.assertEqual((2, 2), (parse_nodes['entry']['calls'], parse_nodes['entry']['models']))
+            self.assertEqual(2, parse_nodes['atom']['calls'])
+            self.assertGreaterEqual(parse_nodes['list']['cumulative'], parse_nodes['entry']['cumulative'])
+            self.assertGreaterEqual(parse_nodes['list']['cumulative'], parse_nodes['list']['self'])
+            self.assertIn('list', grammar.profile.report())
+            grammar.profile.clear()
+            self.assertEqual('', grammar.profile.report())
+
+        # Results from the parse memo don't make a model (nor does the default entry)
+        grammar = jg.Grammar(test_list, memoize=True, profile=True)
+        grammar.parse_config(elem)
+        self.assertEqual(1, grammar.profile.nodes['parse']['entry'].models)
+        profile_file = os.path.join(self.tmp_dir.name, 'profile.json')
+        grammar.profile.dump(profile_file)
+        with open(profile_file) as read_file:
+            self.assertEqual(grammar.profile.summary(), json.load(read_file))
+
+
+class JsonGrammarValidateTestCase(unittest.TestCase):
+    # Validating makes no models and runs no cleanups
+    def test_validate(self):
+        def cleanup(result, _context, _list_pos):
+            raise AssertionError('cleanup called')
+        entry = jg.Dict('entry', [jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests,
+                        cleanup=cleanup)
+        test_list = jg.List('list', 2, entry)
+        grammar = jg.Grammar(test_list)
+        grammar.validate([{'a': 2}, {'a': 3}])
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.validate([{'a': 2}, {'b': 3}])
+        self.assertEqual('dict_bad_keys', context.exception.args[0])
+        # Variables aren't bound, so assigning one twice is only found by parsing
+        list_schema = jg.List('list', 3, jg.Atom('atom', int, 1, var='x'), model=ObjectForTests)
+        jg.Grammar(list_schema).validate([1, 2, 3])
+
+        jg.Grammar(small_backup_schema).validate(jg.Grammar(small_backup_schema).gen_config(None))
+        jg.Grammar(simple_grammar.simple_schema, True).validate(jg.GrammarFile('Configs/Test/Demo.yaml').load())
+
+
+class JsonGrammarPathTestCase(unittest.TestCase):
+    # Parsing a path gives the same model as parsing the whole element, with the same list positions
+    def test_parse_path(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.gen_config(None)
+        backup['data']['bankArray'][3]['bankName'] = 'Bank 3'
+        backup['data']['bankArray'][3]['presetArray'][3]['msgArray'][2]['t'] = 2
+        bank = grammar.parse_path(backup, 'data/bankArray/3')
+        self.assertIsInstance(bank, backup_model.Bank)
+        self.assertEqual('Bank 3', bank.name)
+        self.assertEqual(grammar.gen(grammar.parse_config(backup).banks[3], backup_grammar.bank_array_schema, None,
+                                     [3]),
+                         grammar.gen(bank, backup_grammar.bank_array_schema, None, [3]))
+        self.assertEqual(2, grammar.parse_path(backup, 'data/bankArray/3/presetArray/3').messages[2].type)
+        self.assertEqual('Bank 3', grammar.parse_path(backup, 'data/bankArray/3/bankName'))
+        self.assertIsNone(grammar.parse_path(backup, 'data/bankArray/2'))
+        for path, code in [('data/bankArray/4', 'bad_path'), ('data/banks', 'bad_path'), ('hash/1', 'bad_path')]:
+            with self.assertRaises(jg.GrammarException) as context:
+                grammar.parse_path(backup, path)
+            self.assertEqual(code, context.exception.args[0])
+        backup['data']['bankArray'][3]['bankNumber'] = 2
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.parse_path(backup, 'data/bankArray/3')
+        self.assertEqual('atom_wrong_value', context.exception.args[0])
+
+        # Nodes without a model are parsed into the enclosing model, or the case model of a switch dict
+        inner = jg.Dict('inner', [jg.Dict.make_key('v', jg.Atom('atom', int, 1, var='x'))])
+        switch = jg.SwitchDict('switch', jg.SwitchDict.make_key('switch', jg.Enum('enum', ['a', 'b'], default='a')),
+                               {'a': [ObjectForTests, jg.SwitchDict.make_key('d', inner)], 'b': []},
+                               model_var='y', model=Object2ForTests)
+        result = jg.Grammar(switch, True).parse_path({'switch': 'a', 'd': {'v': 5}}, 'd')
+        self.assertIsInstance(result, ObjectForTests)
+        self.assertEqual(5, result.x)
+        with self.assertRaises(jg.GrammarException) as context:
+            jg.Grammar(inner).parse_path({'v': 5}, '')
+        self.assertEqual('path_without_model', context.exception.args[0])
+
+    # Genning a path in place gives the same element as genning the whole model
+    def test_gen_path(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.gen_config(None)
+        backup['data']['bankArray'][3]['bankName'] = 'Bank 3'
+        model = grammar.parse_config(backup)
+        bank = grammar.parse_path(backup, 'data/bankArray/3')
+        bank.name = 'Changed'
+        self.assertEqual('Changed', grammar.gen_path(backup, 'data/bankArray/3', bank)['bankName'])
+        model.banks[3] = bank
+        self.assertEqual(grammar.gen_config(model), backup)
+        grammar.gen_path(backup, 'data/bankArray/3/bankName', 'Name')
+        self.assertEqual('Name', backup['data']['bankArray'][3]['bankName'])
+        # Without a model, the default bank (with its bank number)
+        grammar.gen_path(backup, 'data/bankArray/3', None)
+        self.assertEqual(grammar.gen_config(None), backup)
+
+        with self.assertRaises(jg.GrammarException) as context:
+            jg.Grammar(simple_grammar.simple_schema, True).gen_path({}, 'banks/0', None)
+        self.assertEqual('gen_path_minimal', context.exception.args[0])
+
+
+class JsonGrammarCollectTestCase(unittest.TestCase):
+    # Collecting errors records every error with its path, and the element parse_path would raise it for
+    def test_parse_collect(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.gen_config(None)
+        self.assertEqual([], grammar.parse_collect(backup)[1])
+        backup['deviceModel'] = 'x'
+        backup['data']['bankArray'][0]['bankName'] = 5
+        backup['data']['bankArray'][1]['bogus'] = 1
+        backup['data']['bankArray'][2]['bankName'] = 'Bank 2'
+        backup['data']['bankArray'][3]['presetArray'][1]['msgArray'] = []
+        result, errors = grammar.parse_collect(backup)
+        self.assertEqual([('deviceModel', 'atom_wrong_type'), ('data/bankArray/0/bankName', 'atom_wrong_type'),
+                          ('data/bankArray/1', 'dict_bad_keys'),
+                          ('data/bankArray/3/presetArray/1/msgArray', 'list_bad_length')],
+                         [(path, error.args[0]) for path, error in errors])
+        for path, error in errors:
+            with self.assertRaises(jg.GrammarException) as context:
+                grammar.parse_path(backup, path)
+            self.assertEqual(error.args, context.exception.args)
+        # The rest of the config is parsed
+        self.assertEqual('Bank 2', result.banks[2].name)
+        self.assertIsNone(result.banks[0])
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.parse_config(backup)
+        self.assertEqual('atom_wrong_type', context.exception.args[0])
+
+        # Compiled and profiled grammars collect through the interpreter, and are left as they were
+        compiled = jg.Grammar(small_backup_schema).compile()
+        profiled = jg.Grammar(small_backup_schema, profile=True)
+        for test_grammar in [compiled, profiled]:
+            self.assertEqual([error.args for _path, error in errors],
+                             [error.args for _path, error in test_grammar.parse_collect(backup)[1]])
+        self.assertNotIn('parse', vars(compiled))
+        self.assertEqual(1, profiled.profile.nodes['parse'][small_backup_schema.name].calls)
+
+
+class JsonGrammarParallelTestCase(unittest.TestCase):
+    # Parallel lists parse their entries in worker processes, with the same results and errors in each engine
+    def test_parallel_list(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.gen_config(None)
+        for bank in [1, 2, 3]:
+            backup['data']['bankArray'][bank]['bankName'] = 'Bank ' + str(bank)
+        backup['data']['bankArray'][2]['presetArray'][3]['msgArray'][2]['t'] = 2
+        expected = grammar.parse_config(backup)
+        parallel_grammars = [jg.Grammar(small_backup_schema, workers=2),
+                             jg.Grammar(small_backup_schema, workers=3).compile(),
+                             jg.Grammar(small_backup_schema, workers=2).use_stack()]
+        for parallel_grammar in parallel_grammars:
+            # The 3 banks that aren't default are fewer than parallel_min_entries
+            self.assertEqual(expected, parallel_grammar.parse_config(backup))
+            self.assertEqual({}, parallel_grammar.worker_pools)
+            parallel_grammar.parallel_min_entries = 1
+            self.addCleanup(parallel_grammar.close_workers)
+            self.assertEqual(expected, parallel_grammar.parse_config(backup))
+            self.assertEqual(backup, parallel_grammar.gen_config(expected))
+            # The workers are started once, and kept for the next parse
+            pools = list(parallel_grammar.worker_pools.values())
+            self.assertEqual(1, len(pools))
+            parallel_grammar.parse_config(backup)
+            self.assertEqual(pools, list(parallel_grammar.worker_pools.values()))
+        self.assertEqual([(0, 1), (1, 2), (2, 4)], parallel_grammars[1].list_chunks(4))
+
+        backup['data']['bankArray'][2]['bankNumber'] = 1
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.parse_config(backup)
+        for parallel_grammar in parallel_grammars:
+            with self.assertRaises(jg.GrammarException) as parallel_context:
+                parallel_grammar.parse_config(backup)
+            self.assertEqual(context.exception.args, parallel_context.exception.args)
+        # Collecting errors parses in the process
+        self.assertEqual(['data/bankArray/2/bankNumber'],
+                         [path for path, _error in parallel_grammars[0].parse_collect(backup)[1]])
+
+        # Entries binding variables in the enclosing model are parsed in the process
+        entry = jg.Dict('entry', [jg.Dict.make_key('a', jg.Atom('atom', int, 1))], var='x')
+        entry_list = jg.List('list', 2, entry, parallel=True)
+        self.assertFalse(jg.Grammar(entry_list, workers=2).parallel_list(entry_list))
+
+        # Genning keeps the list positions, and minimal grammars prune the list
+        entry = jg.Dict('entry', [jg.Dict.make_key('i', jg.identity_atom), jg.Dict.make_key('i2', jg.identity2_atom),
+                                  jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests)
+        outer = jg.List('outer', 2, jg.List('inner', 4, entry, parallel=True))
+        for minimal in [False, True]:
+            elem = jg.Grammar(outer, minimal).gen_config(None)
+            elem[1][2]['a'] = 3
+            model = jg.Grammar(outer, minimal).parse_config(elem)
+            for parallel_grammar in [jg.Grammar(outer, minimal, workers=2),
+                                     jg.Grammar(outer, minimal, workers=2).compile()]:
+                parallel_grammar.parallel_min_entries = 1
+                self.addCleanup(parallel_grammar.close_workers)
+                self.assertEqual(model, parallel_grammar.parse_config(elem))
+                self.assertEqual(elem, parallel_grammar.gen_config(model))
+
+
+class JsonGrammarStreamTestCase(JsonGrammarEngineBaseTestCase):
+    # Streaming gen writes what json.dump writes for gen_config
+    def test_gen_stream(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.gen_config(None)
+        backup['data']['bankArray'][3]['bankName'] = 'Bank 3'
+        backup['data']['bankArray'][3]['presetArray'][3]['msgArray'][2]['t'] = 2
+        model = grammar.parse_config(backup)
+        # The banks are written one at a time, with the lists below them
+        chunks = list(grammar.gen_chunks(model))
+        self.assertEqual(json.dumps(backup, indent=4), ''.join(chunks))
+        self.assertEqual(1, len([chunk for chunk in chunks if '"Bank 3"' in chunk]))
+        self.assertNotIn('gen', vars(grammar))
+
+        entry = jg.Dict('entry', [jg.Dict.make_key('i', jg.identity_atom),
+                                  jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests)
+        schema = jg.Dict('outer', [jg.Dict.make_key('list', jg.List('list', 3, entry, var='y')),
+                                   jg.Dict.make_key('b', jg.Atom('atom', str, 'é'))], model=Object2ForTests)
+        for minimal in [False, True]:
+            grammar = jg.Grammar(schema, minimal)
+            elem = {'list': [{'i': 0, 'a': 1}, {'i': 1, 'a': 2}, {'i': 2, 'a': 1}], 'b': 'é'}
+            model = grammar.parse_config(elem)
+            for gen_model in [model, None]:
+                stream = io.StringIO()
+                grammar.gen_stream(gen_model, stream)
+                self.assertEqual(json.dumps(grammar.gen_config(gen_model), indent=4), stream.getvalue())
+        # The streamed lists are checked before anything is written
+        bad_model = Object2ForTests()
+        bad_model.y = 5
+        with self.assertRaises(jg.GrammarException) as context:
+            next(jg.Grammar(schema).gen_chunks(bad_model))
+        self.assertEqual('model_schema_mismatch', context.exception.args[0])
+
+        # JSON files are streamed
+        save_file = os.path.join(self.tmp_dir.name, 'outer.json')
+        grammar = jg.Grammar(schema)
+        jg.GrammarFile(save_file).save_gen(grammar, grammar.parse_config(elem))
+        with open(save_file) as read_file:
+            self.assertEqual(elem, json.load(read_file))
+
+
+class JsonGrammarSampleTestCase(unittest.TestCase):
+    # Sampled elements parse, with the filled entries first and the message types simple configs have
+    def test_sample(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.sample(1, 0.5, config_samples.backup_sample_functions)
+        self.assertEqual(backup, grammar.sample(1, 0.5, config_samples.backup_sample_functions))
+        grammar.validate(backup)
+        model = grammar.parse_config(backup)
+        banks = [bank for bank in model.banks if bank is not None]
+        self.assertEqual(banks, model.banks[:len(banks)])
+        self.assertTrue(0 < len(banks) < 4)
+        message_types = config_samples.sample_message_types(im.simple_message_type)
+        for bank in backup['data']['bankArray'][:len(banks)]:
+            for preset in bank['presetArray']:
+                self.assertTrue(all([message['t'] == 0 or message['t'] in message_types
+                                     for message in preset['msgArray']]))
+        # The backup converts to a simple config and back
+        simple = simple_model.Simple()
+        simple.from_backup(model)
+        simple_grammar_obj = jg.Grammar(simple_grammar.simple_schema, True)
+        jg.Grammar(backup_grammar.backup_schema).gen_config(
+            simple_grammar_obj.parse_config(simple_grammar_obj.gen_config(simple)).to_backup())
+
+        self.assertEqual(grammar.gen_config(None), grammar.sample(1, 0))
+
+        for minimal_grammar, functions in [(simple_grammar_obj, config_samples.simple_sample_functions),
+                                           (jg.Grammar(intuitive_grammar.intuitive_schema, True), None)]:
+            for seed in range(3):
+                minimal_grammar.validate(minimal_grammar.sample(seed, 0.5, functions))
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.sample(1, 2)
+        self.assertEqual('bad_density', context.exception.args[0])
+
+
+# Parsing from JSON events, and the JSON pull parser, which checks the text as json.load does and reports the same
+# errors
+class JsonGrammarEventsTestCase(unittest.TestCase):
+    def run_events_error(self, text, chunk_size=5):
+        with self.assertRaises(json.JSONDecodeError) as expected:
+            json.loads(text)
+        events = jg.JsonEvents(io.StringIO(text))
+        events.chunk_size = chunk_size
+        with self.assertRaises(json.JSONDecodeError) as context:
+            while events.next_event() is not None:
+                pass
+        self.assertEqual(expected.exception.args, context.exception.args)
+        self.assertEqual((expected.exception.pos, expected.exception.lineno, expected.exception.colno),
+                         (context.exception.pos, context.exception.lineno, context.exception.colno))
+
+    # parse_events parses JSON read as events as parse_config parses the loaded document
+    def test_parse_events(self):
+        grammar = jg.Grammar(small_backup_schema)
+        backup = grammar.gen_config(None)
+        backup['data']['bankArray'][3]['bankName'] = 'Bank 3'
+        backup['data']['bankArray'][3]['presetArray'][3]['msgArray'][2]['t'] = 2
+        expected = grammar.parse_config(backup)
+        for events_grammar in [grammar, jg.Grammar(small_backup_schema).compile(),
+                               jg.Grammar(small_backup_schema, memoize=True).use_stack()]:
+            events = jg.JsonEvents(io.StringIO(json.dumps(backup, indent=4)))
+            events.chunk_size = 5
+            self.assertEqual(expected, events_grammar.parse_events(events))
+
+        events = jg.JsonEvents(io.StringIO('{"a": [1, {"b": null}], "c": true}'))
+        self.assertEqual([('start_map', None), ('key', 'a'), ('start_array', None), ('value', 1), ('start_map', None),
+                          ('key', 'b'), ('value', None), ('end_map', None), ('end_array', None), ('key', 'c'),
+                          ('value', True), ('end_map', None), None],
+                         [events.next_event() for _ in range(13)])
+        for text in ['{"a": 1} 2', '{"a": [1}', '{1: 2}', '{"a": 1', '']:
+            with self.assertRaises(json.JSONDecodeError):
+                grammar.parse_events(jg.JsonEvents(io.StringIO(text)))
+
+        # The errors in the lists are found
+        backup['data']['bankArray'][2]['bankNumber'] = 1
+        with self.assertRaises(jg.GrammarException) as context:
+            grammar.parse_config(backup)
+        with self.assertRaises(jg.GrammarException) as events_context:
+            grammar.parse_events(jg.JsonEvents(io.StringIO(json.dumps(backup))))
+        self.assertEqual(context.exception.args, events_context.exception.args)
+
+    def test_separators(self):
+        # Missing comma, missing colon, trailing comma, leading comma
+        for text in ['{"a": 1 "b": 2}', '[1 2]', '[[1] [2]]', '{"a" 1}', '{"a": {"b" ""}}', '[1, 2,]', '{"a": 1,}',
+                     '[,1]', '{,"a": 1}', '[1: 2]']:
+            self.run_events_error(text)
+
+    # The position is in the whole text, not the text read so far
+    def test_error_position(self):
+        lines = ['{', '    "a": [', '        1,', '        2', '        3', '    ]', '}']
+        self.run_events_error("\n".join(lines), 3)
+        self.run_events_error('[' + '1, ' * 1000 + '2 3]', 7)
+
+    def test_parse_events_errors(self):
+        schema = jg.Dict('foo', [jg.Dict.make_key('a', jg.List('list', 2, jg.Dict('entry', [
+            jg.Dict.make_key('b', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests))),
+                                 jg.Dict.make_key('c', jg.Atom('atom', str, ''))])
+        grammar = jg.Grammar(schema)
+        self.assertEqual(2, grammar.parse_events(jg.JsonEvents(io.StringIO(
+            '{"a": [{"b": 2}, {"b": 1}], "c": ""}')))['a'][0].x)
+        # In the streamed list, around it and after the element
+        for text in ['{"a": [{"b": 2} {"b": 1}], "c": ""}', '{"a": [{"b": 2}, {"b" 1}], "c": ""}',
+                     '{"a": [{"b": 2}, {"b": 1}] "c": ""}', '{"a": [{"b": 2}, {"b": 1}], "c" ""}',
+                     '{"a": [{"b": 2}, {"b": 1},], "c": ""}', '{"a": [{"b": 2}, {"b": 1}], "c": ""} 2']:
+            with self.assertRaises(json.JSONDecodeError) as expected:
+                json.loads(text)
+            with self.assertRaises(json.JSONDecodeError) as context:
+                grammar.parse_events(jg.JsonEvents(io.StringIO(text)))
+            self.assertEqual(expected.exception.args, context.exception.args)
+
+    # The entries of the streamed lists are parsed and genned by the workers, or the compiled functions
+    def test_streamed_entries(self):
+        entry = jg.Dict('entry', [jg.Dict.make_key('i', jg.identity_atom),
+                                  jg.Dict.make_key('a', jg.Atom('atom', int, 1, var='x'))], model=ObjectForTests)
+        entry_list = jg.List('list', 20, entry, parallel=True)
+        schema = jg.Dict('outer', [jg.Dict.make_key('list', entry_list)])
+        elem = jg.Grammar(schema).gen_config(None)
+        for list_pos in [2, 3, 7, 19]:
+            elem['list'][list_pos]['a'] = list_pos
+        expected = jg.Grammar(schema).parse_config(elem)
+        compiled = jg.Grammar(schema).compile()
+        self.assertIs(compiled.compiled_parse_nodes[entry], compiled.node_parse(entry))
+        self.assertIs(compiled.compiled_gen_nodes[entry], compiled.node_gen(entry))
+        parallel = jg.Grammar(schema, workers=2).compile()
+        parallel.parallel_min_entries = 3
+        self.addCleanup(parallel.close_workers)
+        for grammar in [compiled, parallel]:
+            self.assertEqual(expected, grammar.parse_events(jg.JsonEvents(io.StringIO(json.dumps(elem)))))
+            stream = io.StringIO()
+            grammar.gen_stream(expected, stream)
+            self.assertEqual(json.dumps(elem, indent=4), stream.getvalue())
+        self.assertEqual([entry], list(parallel.worker_pools))
+
+
 class JsonGrammarPrintTestCase(unittest.TestCase):
     def test_print(self):
         grammar = jg.Grammar(backup_grammar.backup_schema)
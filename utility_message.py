@@ -226,7 +226,7 @@ class UtilityModel(jg.GrammarModel):
     # TODO: general cleanup on this list, some may not be required
     def to_backup(self, backup_message, _bank_catalog, _simple_bank, _simple_preset):
         backup_sets = [0]*4
-        backup_message.type = simple_message.simple_message_type.index("Utility")
+        backup_message.type = simple_message.simple_message_codec.index("Utility")
         backup_message.msg_array_data[0] = utility_message_type.index(self.utility_type)
         if self.preset is not None and self.preset != 'A':
             backup_sets[1] += 1